@@ -1,7 +1,9 @@
+import asyncio
 import json
-import os
-import datetime
-from fastapi import FastAPI, Query, HTTPException
+import threading
+import time
+from fastapi import FastAPI, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
@@ -10,37 +12,97 @@ from contextlib import asynccontextmanager
 
 # --- 1. ИМПОРТ И НАСТРОЙКА ---
 
-# Импортируем нашу функцию парсера
+# Импортируем нашу функцию парсера и менеджер фоновых запусков
 from parser_categories import run_parser
+from parser_selenium import create_window_driver, warm_up_session
+from parser_jobs import ParserJobManager, ParserBusyError, FINISHED_STATUSES
+# Прогретые сессии браузера и HTTP, которые живут между запусками по расписанию
+from driver_pool import DriverPool
+from fetchers import HttpFetcher
+from rate_limiter import RateLimiter
+import metrics
+from product_cache import ProductCache
+# Общая очередь распределенного обхода: координатор и воркеры
+from job_queue import JobQueue
+from distributed_crawl import Coordinator, start_workers, QUEUE_WORKERS, QUEUE_TICK_S, ITEMS_CATEGORY_URL
+# Площадки: данные каждой хранятся и отдаются отдельно (параметр marketplace)
+from marketplaces import MARKETPLACE, MARKETPLACES, MARKETPLACE_PROFILES
+# Кэш снимков данных в памяти и хранилище SQLite
+from snapshot_store import SnapshotStore
+import storage
+from items_index import ItemsIndex, CategoryIndex, SORT_FIELDS
 # Импортируем планировщик
 from apscheduler.schedulers.background import BackgroundScheduler
 
-# Глобальная переменная-флаг, чтобы избежать запуска двух парсеров одновременно
-is_parser_running = False
+# Пул браузеров принадлежит процессу API: Chrome запускается при первом фолбэке на Selenium
+# и переиспользуется следующими запусками, пока не отработает свой лимит страниц или памяти.
+# Браузер прогревается на сайте каждой площадки при первом заходе на нее (cookies у площадок свои)
+driver_pool = DriverPool(lambda: create_window_driver(headless=True), warm=warm_up_session)
+# HTTP-клиент с cookies сессии создается при старте сервера (см. lifespan)
+http_session: Optional[HttpFetcher] = None
+# Подобранная скорость запросов к каждому хосту тоже переживает запуск
+rate_limiter = RateLimiter()
+# Кэш товаров по ASIN открывается при старте сервера (см. lifespan) и копит попадания между запусками
+product_cache: Optional[ProductCache] = None
+
+
+def run_parser_with_sessions(progress=None, cancel_event=None, marketplace=None):
+    """Запуск парсера на общих прогретых сессиях процесса API."""
+    return run_parser(progress=progress, cancel_event=cancel_event, driver_pool=driver_pool, http=http_session,
+                      limiter=rate_limiter, product_cache=product_cache, marketplace=marketplace)
+
+
+# Фоновые запуски парсера; общая блокировка не дает API и планировщику запустить два парсера сразу
+parser_jobs = ParserJobManager(run_parser_with_sessions)
+
+# Снимки данных по площадкам: последний запуск читается из SQLite только когда появляется новый
+bestsellers_stores = {
+    code: SnapshotStore(storage.RunSource(storage.BESTSELLERS, marketplace=code), default={}, build=CategoryIndex)
+    for code in MARKETPLACE_PROFILES
+}
+items_stores = {
+    code: SnapshotStore(storage.RunSource(storage.ITEMS, marketplace=code), default=[],
+                        build=lambda items, market=market: ItemsIndex(items, market))
+    for code, market in MARKETPLACE_PROFILES.items()
+}
+# Допустимые значения параметра marketplace
+MARKETPLACE_PATTERN = "^(" + "|".join(MARKETPLACE_PROFILES) + ")$"
 
 
 # --- 2. ЛОГИКА ПЛАНИРОВЩИКА ---
 
-def scheduled_parser_job():
-    """Задача, которую планировщик будет запускать раз в сутки."""
-    global is_parser_running
-    if not is_parser_running:
-        print("--- [SCHEDULER] --- Запуск парсера по расписанию...")
-        is_parser_running = True
-        try:
-            run_parser()
-            print("--- [SCHEDULER] --- Парсер успешно завершил работу.")
-        except Exception as e:
-            print(f"--- [SCHEDULER] --- Ошибка во время выполнения парсера: {e}")
-        finally:
-            is_parser_running = False
-    else:
-        print("--- [SCHEDULER] --- Пропуск запуска: парсер уже работает.")
+# Обход по расписанию идет через очередь: координатор ставит задачи, их выполняют воркеры
+# этого процесса (QUEUE_WORKERS) и внешние (python distributed_crawl.py worker)
+crawl_queue = JobQueue()
+coordinator = Coordinator(crawl_queue)
+queue_stop = threading.Event()
+queue_workers = []
+# Ручной запуск парсера и обход по расписанию не идут одновременно: оба пишут запуски в storage
+# и делят сессии, ограничитель скорости и кэш товаров процесса
+crawl_start_lock = threading.Lock()
+
+
+def active_crawl_run() -> Optional[dict]:
+    """Незавершенный запуск обхода через очередь (созданный любой репликой API) или None."""
+    runs = crawl_queue.runs(active_only=True, limit=1)
+    return runs[0] if runs else None
+
+
+def scheduled_crawl_job():
+    """Задача, которую планировщик будет запускать раз в сутки (на все реплики API - один запуск)."""
+    with crawl_start_lock:
+        job = parser_jobs.current
+        if job is not None:
+            print(f"--- [SCHEDULER] --- Пропуск запуска: парсер уже работает (задача {job.id}).")
+            return
+        print("--- [SCHEDULER] --- Запуск обхода по расписанию...")
+        coordinator.start_run(items_url=ITEMS_CATEGORY_URL, marketplaces=MARKETPLACES)
 
 
 # Создаем и настраиваем планировщик
 scheduler = BackgroundScheduler(timezone="Europe/Kiev")
-scheduler.add_job(scheduled_parser_job, 'interval', hours=24)  # hours=24 для запуска раз в сутки
+scheduler.add_job(scheduled_crawl_job, 'interval', hours=24)  # hours=24 для запуска раз в сутки
+scheduler.add_job(coordinator.tick, 'interval', seconds=QUEUE_TICK_S)  # закрытие запусков, в которых все сделано
 
 
 # --- 3. LIFESPAN MANAGER ДЛЯ УПРАВЛЕНИЯ ПЛАНИРОВЩИКОМ ---
@@ -48,12 +110,33 @@ scheduler.add_job(scheduled_parser_job, 'interval', hours=24)  # hours=24 для
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Код, который выполнится при старте сервера
+    global http_session, product_cache
+    # JSON-снимки - данные amazon.com: импортируются как запуски "us" при любой MARKETPLACE
+    if storage.latest_run(storage.BESTSELLERS, marketplace="us") is None \
+            and storage.latest_run(storage.ITEMS, marketplace="us") is None:
+        print("--- [SERVER] --- БД пуста, импортирую сохраненные JSON-снимки...")
+        storage.import_json_files()
     print("--- [SERVER] --- Запуск фонового планировщика...")
     scheduler.start()
+    http_session = HttpFetcher()
+    product_cache = ProductCache()
+    # Воркеры на каждую площадку: площадки обходятся одновременно, каждая со скоростью своего хоста
+    queue_workers.extend(start_workers(crawl_queue, QUEUE_WORKERS, queue_stop, marketplaces=MARKETPLACES,
+                                       http=http_session, driver_pool=driver_pool, limiter=rate_limiter,
+                                       product_cache=product_cache))
     yield
     # Код, который выполнится при остановке сервера
     print("--- [SERVER] --- Остановка планировщика...")
     scheduler.shutdown()
+    parser_jobs.shutdown()
+    # Незавершенные задачи воркеров вернутся в очередь, когда истечет их аренда
+    queue_stop.set()
+    for thread in queue_workers:
+        thread.join()
+    print("--- [SERVER] --- Закрываю браузеры и HTTP-сессию...")
+    driver_pool.close()
+    http_session.close()
+    product_cache.close()
 
 
 # --- 4. ИНИЦИАЛИЗАЦИЯ FASTAPI ПРИЛОЖЕНИЯ ---
@@ -74,14 +157,47 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def measure_request_latency(request: Request, call_next):
+    """Время ответа каждого запроса попадает в гистограмму amazon_api_request_seconds."""
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Шаблон пути, а не сам путь: все /api/parser-status/{job_id} - одна серия, а не серия на задачу
+    route = getattr(request.scope.get("route"), "path", None) or "static"
+    metrics.API_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route,
+                                        status=response.status_code)
+    return response
+
+
 # --- 5. ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 
-def get_file_update_time(filename: str) -> Optional[str]:
-    """Возвращает время последнего изменения файла в читаемом формате."""
-    if not os.path.exists(filename):
-        return None
-    mod_time = os.path.getmtime(filename)
-    return datetime.datetime.fromtimestamp(mod_time).strftime('%Y-%m-%d %H:%M:%S')
+def snapshot_headers(snapshot) -> dict:
+    return {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+
+
+def is_not_modified(snapshot, request: Request) -> bool:
+    return request.headers.get("if-none-match") == snapshot.etag
+
+
+def snapshot_response(snapshot, request: Request) -> Response:
+    """Отдает готовое тело снимка с ETag; на совпавший If-None-Match отвечает 304."""
+    headers = snapshot_headers(snapshot)
+    if is_not_modified(snapshot, request):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+
+def stream_categories(index: CategoryIndex, names, ndjson: bool):
+    """Отдает категории по одной из готовых JSON-фрагментов: объектом {имя: товары} или строками NDJSON."""
+    if ndjson:
+        for name in names:
+            yield b'{"category": ' + json.dumps(name, ensure_ascii=False).encode("utf-8") + \
+                b', "products": ' + index.chunks[name] + b'}\n'
+        return
+    yield b"{"
+    for i, name in enumerate(names):
+        yield (b", " if i else b"") + json.dumps(name, ensure_ascii=False).encode("utf-8") + b": " + index.chunks[name]
+    yield b"}"
 
 
 # --- 6. API ЭНДПОИНТЫ ---
@@ -89,62 +205,180 @@ def get_file_update_time(filename: str) -> Optional[str]:
 # === Эндпоинты для Задания 3 (НОВЫЙ ФУНКЦИОНАЛ) ===
 
 @app.get("/api/bestsellers", tags=["Задание 3 - Best Sellers по категориям"])
-def get_all_bestsellers():
-    """Возвращает полный снимок данных из amazon_bestsellers_data.json."""
-    try:
-        with open("amazon_bestsellers_data.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
-
-@app.post("/api/trigger-parser", tags=["Задание 3 - Best Sellers по категориям"])
-async def trigger_parser_manually():
-    """Запускает парсер бестселлеров вручную."""
-    global is_parser_running
-    if is_parser_running:
-        raise HTTPException(status_code=409, detail="Парсер уже запущен. Попробуйте позже.")
-
-    print("--- [API] --- Получен запрос на ручной запуск парсера...")
-    is_parser_running = True
-    try:
-        success = run_parser()
-        if success:
-            return {"status": "success", "message": "Парсер успешно завершил работу."}
-        else:
-            raise HTTPException(status_code=500, detail="Во время работы парсера произошла ошибка.")
-    finally:
-        is_parser_running = False
+def get_all_bestsellers(request: Request, category: Optional[str] = Query(None),
+                        offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1),
+                        format: str = Query("json", pattern="^(json|ndjson)$"),
+                        marketplace: str = Query(MARKETPLACE, pattern=MARKETPLACE_PATTERN)):
+    """
+    Возвращает снимок последнего запуска парсера бестселлеров потоком, категория за категорией.
+    category - только одна категория (список ее товаров); offset/limit - страница списка категорий;
+    format=ndjson - по строке {"category", "products"} на категорию; marketplace - площадка (us, de, ...).
+    """
+    snapshot = bestsellers_stores[marketplace].get()
+    index: CategoryIndex = snapshot.index
+    headers = snapshot_headers(snapshot)
+    if is_not_modified(snapshot, request):
+        return Response(status_code=304, headers=headers)
+
+    if category is not None:
+        if category not in index.chunks:
+            raise HTTPException(status_code=404, detail="Категория не найдена.")
+        return Response(content=index.chunks[category], media_type="application/json", headers=headers)
+
+    headers["X-Total-Count"] = str(len(index.names))
+    names = index.page(offset, limit)
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(stream_categories(index, names, format == "ndjson"), media_type=media_type,
+                             headers=headers)
+
+
+@app.get("/api/bestsellers/categories", tags=["Задание 3 - Best Sellers по категориям"])
+def get_bestseller_categories(request: Request,
+                              marketplace: str = Query(MARKETPLACE, pattern=MARKETPLACE_PATTERN)):
+    """Список категорий последнего запуска площадки с числом товаров - без самих товаров."""
+    snapshot = bestsellers_stores[marketplace].get()
+    headers = snapshot_headers(snapshot)
+    if is_not_modified(snapshot, request):
+        return Response(status_code=304, headers=headers)
+    categories = snapshot.index.categories()
+    body = json.dumps({"count": len(categories), "categories": categories}, ensure_ascii=False)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/bestsellers/history", tags=["Задание 3 - Best Sellers по категориям"])
+def get_rank_history(asin: str = Query(..., min_length=10, max_length=10),
+                     marketplace: str = Query(MARKETPLACE, pattern=MARKETPLACE_PATTERN)):
+    """Возвращает историю позиций товара (по ASIN) во всех сохраненных запусках площадки."""
+    return {"asin": asin, "marketplace": marketplace, "history": storage.rank_history(asin, marketplace=marketplace)}
+
+
+@app.get("/api/marketplaces", tags=["Задание 3 - Best Sellers по категориям"])
+def get_marketplaces():
+    """Площадки: сайт, валюта, обходится ли по расписанию и время последнего обновления данных."""
+    return [
+        {**market.to_dict(), "scheduled": code in MARKETPLACES,
+         "last_updated": storage.last_updated(storage.BESTSELLERS, marketplace=code)}
+        for code, market in MARKETPLACE_PROFILES.items()
+    ]
+
+
+@app.post("/api/trigger-parser", status_code=202, tags=["Задание 3 - Best Sellers по категориям"])
+def trigger_parser_manually(marketplace: str = Query(MARKETPLACE, pattern=MARKETPLACE_PATTERN)):
+    """
+    Ставит запуск парсера бестселлеров площадки в фон и сразу возвращает id задачи.
+    409 - если парсер уже работает или идет обход по расписанию через очередь.
+    """
+    print(f"--- [API] --- Получен запрос на ручной запуск парсера ({marketplace})...")
+    with crawl_start_lock:
+        run = active_crawl_run()
+        if run is not None:
+            raise HTTPException(status_code=409, detail={
+                "message": "Идет обход по расписанию. Попробуйте позже.", "crawl_run_id": run["id"],
+            })
+        try:
+            job = parser_jobs.submit(trigger="api", marketplace=marketplace)
+        except ParserBusyError as e:
+            raise HTTPException(status_code=409, detail={
+                "message": "Парсер уже запущен. Попробуйте позже.", "job_id": e.running_job.id,
+            })
+    return {"status": job.status, "job_id": job.id, "message": "Парсер запущен в фоне."}
 
 
 @app.get("/api/parser-status", tags=["Задание 3 - Best Sellers по категориям"])
 def get_parser_status():
     """Возвращает статус парсера и время последнего обновления данных."""
+    current = parser_jobs.current
     return {
-        "is_running": is_parser_running,
-        "last_updated": get_file_update_time("amazon_bestsellers_data.json")
+        "is_running": parser_jobs.is_running,
+        "job_id": current.id if current else None,
+        "last_updated": storage.last_updated(storage.BESTSELLERS),
+        "marketplaces": {code: storage.last_updated(storage.BESTSELLERS, marketplace=code) for code in MARKETPLACES},
+        "driver_pool": driver_pool.stats(),
+        "product_cache": product_cache.stats() if product_cache else None,
+        "crawl_queue": coordinator.status(),
     }
 
 
+def _get_job_or_404(job_id: str):
+    job = parser_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача парсера не найдена.")
+    return job
+
+
+@app.get("/api/parser-status/{job_id}", tags=["Задание 3 - Best Sellers по категориям"])
+def get_parser_job(job_id: str):
+    """Возвращает статус и прогресс задачи парсера."""
+    return _get_job_or_404(job_id).to_dict()
+
+
+@app.get("/api/parser-status/{job_id}/events", tags=["Задание 3 - Best Sellers по категориям"])
+async def stream_parser_job(job_id: str):
+    """Поток событий прогресса задачи (Server-Sent Events) до ее завершения."""
+    job = _get_job_or_404(job_id)
+
+    async def event_stream():
+        sent = 0
+        while True:
+            events = job.events[sent:]
+            for event in events:
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            sent += len(events)
+            if job.status in FINISHED_STATUSES and sent >= len(job.events):
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/api/parser-status/{job_id}/cancel", tags=["Задание 3 - Best Sellers по категориям"])
+def cancel_parser_job(job_id: str):
+    """Отменяет задачу парсера: воркеры доделывают текущую страницу и выходят без записи данных."""
+    _get_job_or_404(job_id)
+    return parser_jobs.cancel(job_id).to_dict()
+
+
+# === Мониторинг ===
+
+@app.get("/metrics", tags=["Мониторинг"])
+def get_metrics():
+    """Метрики парсеров, API и долгоживущих сессий в текстовом формате Prometheus."""
+    for field, value in driver_pool.stats().items():
+        metrics.DRIVER_POOL.set(value, field=field)
+    if product_cache is not None:
+        for field, value in product_cache.stats().items():
+            metrics.PRODUCT_CACHE.set(value, field=field)
+    for host, state in rate_limiter.stats().items():
+        metrics.HOST_RATE.set(state["rate"], host=host)
+    metrics.PARSER_RUNNING.set(int(parser_jobs.is_running))
+    return Response(content=metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # === Эндпоинты для Заданий 1 и 2 (старый функционал) ===
 
 @app.get("/items", tags=["Задания 1, 2 - Статический парсер"])
-def get_items(min_rating: Optional[float] = Query(None), max_price: Optional[float] = Query(None)):
-    """Возвращает отфильтрованный список товаров из data.json."""
-    try:
-        with open("data.json", "r", encoding="utf-8") as f:
-            items = json.load(f)
-    except FileNotFoundError:
-        return {"count": 0, "items": []}
-
-    filtered_items = items
-    if min_rating is not None:
-        filtered_items = [it for it in filtered_items if float(it.get("rating", "0").split()[0] or 0) >= min_rating]
-    if max_price is not None:
-        filtered_items = [it for it in filtered_items if
-                          it.get("price") and float(str(it["price"]).replace("$", "").replace(",", "")) <= max_price]
-
-    return {"count": len(filtered_items), "items": filtered_items}
+def get_items(min_rating: Optional[float] = Query(None), max_price: Optional[float] = Query(None),
+              min_price: Optional[float] = Query(None), min_reviews: Optional[int] = Query(None),
+              sort_by: Optional[str] = Query(None, pattern="^(" + "|".join(SORT_FIELDS) + ")$"),
+              order: str = Query("asc", pattern="^(asc|desc)$"),
+              limit: Optional[int] = Query(None, ge=1), offset: int = Query(0, ge=0),
+              marketplace: str = Query(MARKETPLACE, pattern=MARKETPLACE_PATTERN)):
+    """
+    Возвращает отфильтрованный и отсортированный список товаров последнего запуска parser_selenium
+    на площадке marketplace; цены - в ее валюте (поле currency).
+    Числовые поля разобраны один раз при загрузке, фильтры отвечаются бинарным поиском по индексам.
+    """
+    index: ItemsIndex = items_stores[marketplace].get().index
+    count, items = index.query(
+        {
+            "rating_value": (min_rating, None),
+            "price_value": (min_price, max_price),
+            "reviews_count_value": (min_reviews, None),
+        },
+        sort_by=sort_by, descending=(order == "desc"), offset=offset, limit=limit,
+    )
+    return {"count": count, "items": items}
 
 
 # --- 7. ПОДКЛЮЧЕНИЕ СТАТИКИ И ЗАПУСК СЕРВЕРА ---
@@ -0,0 +1,264 @@
+"""
+Офлайн-бенчмарк обхода и API: парсеры работают против локального fixture_server
+(сохраненные HTML-страницы с настраиваемой задержкой и долей ошибок), API нагружается
+генератором запросов - без обращения к реальному сайту.
+
+    python benchmarks/bench_crawl.py [--latency 0.05] [--error-rate 0.02] [--workers 2]
+    python benchmarks/bench_crawl.py --save baseline
+    python benchmarks/bench_crawl.py --compare benchmarks/results/baseline.json
+
+Отчет: страниц в секунду и мс разбора на страницу для run_parser и parse_category_selenium,
+пиковый RSS процесса, запросов в секунду и p50/p99 для /items и /api/bestsellers.
+Результаты сохраняются в benchmarks/results/<имя>.json; --compare показывает изменение
+относительно сохраненного прогона.
+
+Браузер в бенчмарке не запускается: фолбэк на Selenium сразу завершается ошибкой
+и учитывается как ошибка загрузки страницы.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import resource  # только Unix
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Метрики, по которым --compare считает изменение: (раздел, ключ, чем больше - тем лучше)
+COMPARED = [
+    ("categories", "pages_per_s", True), ("categories", "parse_ms_per_page", False),
+    ("products", "pages_per_s", True), ("products", "parse_ms_per_page", False),
+    ("api_items", "requests_per_s", True), ("api_items", "p99_ms", False),
+    ("api_bestsellers", "requests_per_s", True), ("api_bestsellers", "p99_ms", False),
+    ("process", "peak_rss_mb", False),
+]
+
+
+def peak_rss_mb():
+    """Пиковый RSS этого процесса в МБ (None, если платформа не дает его узнать)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _no_browser():
+    raise RuntimeError("browser fallback is disabled in the benchmark")
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))]
+
+
+def _crawl_summary(report, elapsed):
+    """Страниц в секунду и время разбора на страницу из отчета запуска (metrics.RunReport)."""
+    pages = sum(sum(outcomes.values()) for outcomes in report["pages"].values())
+    parse_s = report["stages"].get("parse", {}).get("total_s", 0.0)
+    return {
+        "elapsed_s": round(elapsed, 3), "pages": pages,
+        "pages_per_s": round(pages / elapsed, 1) if elapsed else None,
+        "parse_ms_per_page": round(parse_s * 1000 / pages, 3) if pages else None,
+        "result": report["result"], "pages_by_outcome": report["pages"],
+    }
+
+
+def bench_categories(base_url, args):
+    import parser_categories
+    from driver_pool import DriverPool
+    from rate_limiter import RateLimiter
+
+    limiter = RateLimiter(jitter=0, rate=args.rate, min_rate=args.rate, max_rate=args.rate, burst=args.rate)
+    pool = DriverPool(_no_browser)
+    started = time.perf_counter()
+    parser_categories.run_parser(workers=args.workers, incremental=False, driver_pool=pool, limiter=limiter,
+                                 max_depth=args.depth, base_url=base_url)
+    elapsed = time.perf_counter() - started
+    report = parser_categories.last_run_report
+    summary = _crawl_summary(report, elapsed)
+    summary["categories"] = len(report.get("items_per_category", {}))
+    summary["items"] = sum(report.get("items_per_category", {}).values())
+    return summary
+
+
+def bench_products(base_url, args):
+    import parser_selenium
+    from driver_pool import DriverPool
+    from rate_limiter import RateLimiter
+
+    limiter = RateLimiter(jitter=0, rate=args.rate, min_rate=args.rate, max_rate=args.rate, burst=args.rate)
+    pool = DriverPool(_no_browser)
+    parser_selenium.RETRY_BACKOFF_S = 0.0
+    started = time.perf_counter()
+    items = parser_selenium.parse_category_selenium(
+        base_url + "/Best-Sellers-Electronics/zgbs/electronics", max_items=args.items, incremental=False,
+        driver_pool=pool, limiter=limiter, concurrency=args.product_concurrency, base_url=base_url)
+    elapsed = time.perf_counter() - started
+    summary = _crawl_summary(parser_selenium.last_run_report, elapsed)
+    summary["items"] = len(items)
+    return summary
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _load(url, seconds, concurrency):
+    """Генератор нагрузки: concurrency потоков шлют GET url, пока не истечет время."""
+    import httpx
+
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        latencies, errors = [], 0
+        with httpx.Client(timeout=10) as client:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok = client.get(url).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: worker(), range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(l for worker_latencies, _ in results for l in worker_latencies)
+    return {
+        "requests": len(latencies), "errors": sum(errors for _, errors in results),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def bench_api(args):
+    """Поднимает api_server в uvicorn на свободном порту и нагружает /items и /api/bestsellers."""
+    import uvicorn
+    import api_server
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(api_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.05)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        results = {}
+        for name, path in [("api_items", "/items"), ("api_bestsellers", "/api/bestsellers")]:
+            _load(base + path, 0.5, 1)  # прогрев: снимок читается из БД при первом запросе
+            results[name] = _load(base + path, args.api_seconds, args.api_concurrency)
+        return results
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def run(args):
+    from fixture_server import FixtureServer
+
+    workdir = tempfile.mkdtemp(prefix="amazon-bench-")
+    cwd = os.getcwd()
+    # Все файлы запуска (БД, журналы, очередь обхода, кэш) - во временной папке
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.makedirs(os.path.join(workdir, "static"))
+    os.chdir(workdir)
+    try:
+        results = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "settings": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "verbose")},
+        }
+        # Вывод парсеров прячем, чтобы он не тонул в отчете (--verbose - показать)
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output, FixtureServer(latency=args.latency, error_rate=args.error_rate,
+                                   captcha_rate=args.captcha_rate, seed=args.seed) as server:
+            results["categories"] = bench_categories(server.base_url, args)
+            results["products"] = bench_products(server.base_url, args)
+            if args.api_seconds > 0:
+                results.update(bench_api(args))
+        results["process"] = {"peak_rss_mb": peak_rss_mb()}
+        return results
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'metric':<36} {'value':>12}" + (f" {'baseline':>12} {'change':>9}" if baseline else ""))
+    for section, key, higher_is_better in COMPARED:
+        value = results.get(section, {}).get(key)
+        line = f"{section + '.' + key:<36} {value if value is not None else '-':>12}"
+        if baseline:
+            old = baseline.get(section, {}).get(key)
+            change = ""
+            if value is not None and old:
+                delta = (value - old) / old * 100
+                worse = delta < 0 if higher_is_better else delta > 0
+                change = f"{delta:+.1f}%" + (" !" if worse and abs(delta) >= 10 else "")
+            line += f" {old if old is not None else '-':>12} {change:>9}"
+        print(line)
+
+
+def save_results(results, name):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    filename = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean fake-server response delay, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 503 responses")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="share of captcha pages")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=1000.0, help="requests per second allowed to the fake host")
+    parser.add_argument("--workers", type=int, default=2, help="run_parser category workers")
+    parser.add_argument("--depth", type=int, default=1, help="subcategory crawl depth")
+    parser.add_argument("--items", type=int, default=20, help="products for parse_category_selenium")
+    parser.add_argument("--product-concurrency", type=int, default=4)
+    parser.add_argument("--api-seconds", type=float, default=3.0, help="load duration per endpoint (0 - skip)")
+    parser.add_argument("--api-concurrency", type=int, default=8)
+    parser.add_argument("--save", nargs="?", const=datetime.now().strftime("%Y%m%d-%H%M%S"), metavar="NAME",
+                        help="save results to benchmarks/results/NAME.json")
+    parser.add_argument("--compare", metavar="FILE", help="saved results to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the parsers' output")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    results = run(args)
+    print_results(results, baseline)
+    if args.save:
+        print(f"\nSaved: {save_results(results, args.save)}")
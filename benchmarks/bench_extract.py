@@ -0,0 +1,70 @@
+"""
+Сравнение скорости извлечения данных: прежний путь через BeautifulSoup
+против extractors (lxml + скомпилированные XPath) на сохраненных HTML-фикстурах.
+Заодно проверяет, что оба пути возвращают одинаковые словари.
+
+    python benchmarks/bench_extract.py [--repeat 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import extractors  # noqa: E402
+import bs4_reference  # noqa: E402
+
+FIXTURES_DIR = os.path.join(ROOT, "fixtures")
+BASE_URL = bs4_reference.BASE_URL
+PRODUCT_URL = BASE_URL + "/Queen-Size-Piece-Sheet-Set/dp/B01M16WBW1"
+
+
+def _read(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _cases():
+    category_html = _read("category.html")
+    product_html = _read("product.html")
+    return [
+        ("category cards",
+         lambda: bs4_reference.parse_category_page(category_html),
+         lambda: extractors.extract_category_cards(category_html, BASE_URL, limit=5)),
+        ("category links",
+         lambda: bs4_reference.extract_product_links(category_html, 5),
+         lambda: extractors.extract_product_links(category_html, BASE_URL, 5)),
+        ("product page",
+         lambda: bs4_reference.extract_product(product_html, PRODUCT_URL, 1),
+         lambda: extractors.extract_product(product_html, PRODUCT_URL, 1)),
+    ]
+
+
+def _time_ms(fn, repeat):
+    fn()  # прогрев
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def run(repeat: int = 50) -> dict:
+    results = {}
+    print(f"{'case':<16} {'bs4 ms/page':>12} {'lxml ms/page':>13} {'speedup':>8}  same output")
+    for name, old, new in _cases():
+        same = old() == new()
+        old_ms, new_ms = _time_ms(old, repeat), _time_ms(new, repeat)
+        results[name] = {"bs4_ms": old_ms, "lxml_ms": new_ms, "same_output": same}
+        print(f"{name:<16} {old_ms:>12.3f} {new_ms:>13.3f} {old_ms / new_ms:>7.1f}x  {same}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    results = run(args.repeat)
+    sys.exit(0 if all(r["same_output"] for r in results.values()) else 1)
@@ -0,0 +1,159 @@
+"""
+Прежний путь извлечения данных через BeautifulSoup, сохраненный без изменений
+(кроме вывода в консоль) для сравнения с extractors в бенчмарке.
+"""
+import re
+from typing import Dict, List
+
+from bs4 import BeautifulSoup
+
+BASE_URL = "https://www.amazon.com"
+
+
+def parse_category_page(page_source):
+    """Разбирает HTML страницы категории и возвращает список первых 5 товаров (прежний parser_categories)."""
+    page_soup = BeautifulSoup(page_source, 'html.parser')
+
+    product_list = page_soup.select_one('ol.a-ordered-list')
+    if not product_list:
+        return []
+
+    product_cards = product_list.select('li.zg-no-numbers')
+    if not product_cards:
+        return []
+
+    products_in_category = []
+
+    for card in product_cards[:5]:
+        try:
+            link_tag = card.select_one('a.a-link-normal')
+            product_url = BASE_URL + link_tag['href'] if link_tag else None
+            rank = card.select_one('span.zg-bdg-text').get_text(strip=True)
+            title = card.select_one('div[class*="_cDEzb_p13n-sc-css-line-clamp-"]').get_text(strip=True)
+            image_url = card.select_one('img')['src']
+            rating = card.select_one('span.a-icon-alt').get_text(strip=True)
+            reviews_count = card.select_one('span.a-size-small').get_text(strip=True)
+
+            price_element = card.select_one('span._cDEzb_p13n-sc-price_3mJ9Z')
+            if price_element:
+                price = price_element.get_text(strip=True)
+            else:
+                offer_price_element = card.select_one('span.p13n-sc-price')
+                price = offer_price_element.get_text(strip=True) if offer_price_element else 'N/A'
+
+            products_in_category.append({
+                "rank": rank, "title": title, "url": product_url,
+                "image_url": image_url, "rating": rating,
+                "reviews_count": reviews_count, "price": price
+            })
+        except Exception:
+            continue
+
+    return products_in_category
+
+
+def extract_product_links(html: str, max_items: int) -> List[str]:
+    """Ссылки на товары из сетки категории (прежний parser_selenium.parse_category_selenium)."""
+    soup = BeautifulSoup(html, "lxml")
+    product_links = []
+    product_grid = soup.select_one('div.p13n-desktop-grid')
+    if product_grid:
+        links = product_grid.select('a.a-link-normal', href=True)
+        for link in links:
+            href = link['href']
+            if href.startswith('/'):
+                full_url = BASE_URL + href
+                if full_url not in product_links:
+                    product_links.append(full_url)
+            if len(product_links) >= max_items:
+                break
+    return product_links
+
+
+def extract_product(html: str, url: str, rank: int) -> Dict:
+    """Извлекает поля товара из HTML страницы товара (прежний parser_selenium.extract_product)."""
+    soup = BeautifulSoup(html, "lxml")
+
+    # --- Извлечение данных с улучшенными селекторами ---
+
+    title = soup.select_one("#productTitle")
+    title_text = title.get_text(strip=True) if title else "N/A"
+
+    asin = None
+    asin_tag = soup.select_one('input#ASIN')
+    if asin_tag and asin_tag.get('value'):
+        asin = asin_tag['value']
+    else:
+        # Запасной метод извлечения ASIN из URL
+        match = re.search(r"/dp/([A-Z0-9]{10})", url)
+        if match:
+            asin = match.group(1)
+
+    # Рейтинг и отзывы
+    rating_text = "N/A"
+    rating_tag = soup.select_one("#acrPopover")
+    if rating_tag and rating_tag.get('title'):
+        rating_text = rating_tag['title']
+
+    reviews_text = "0"
+    reviews_tag = soup.select_one("#acrCustomerReviewText")
+    if reviews_tag:
+        reviews_text = reviews_tag.get_text(strip=True)
+
+    # Картинка
+    image_url = None
+    img_tag = soup.select_one("#landingImage")
+    if img_tag and img_tag.get('src'):
+        image_url = img_tag['src']
+
+    # Буллеты
+    bullets = [li.get_text(strip=True) for li in soup.select("#feature-bullets ul li")[:5]]
+
+    # --- НОВАЯ УЛУЧШЕННАЯ ЛОГИКА ДЛЯ ЦЕНЫ, СКИДКИ И PRIME ---
+
+    price, list_price, discount = "N/A", None, None
+    is_prime = False
+
+    price_block = soup.select_one("#corePrice_feature_div, #tmmSwatches")
+    if price_block:
+        # Текущая цена
+        current_price_tag = price_block.select_one("span.a-offscreen")
+        if current_price_tag:
+            price = current_price_tag.get_text(strip=True)
+
+        # Старая (зачеркнутая) цена
+        list_price_tag = price_block.select_one("span[data-a-strike='true'] span.a-offscreen")
+        if list_price_tag:
+            list_price = list_price_tag.get_text(strip=True)
+
+        # Просчет скидки, если есть обе цены
+        if price != "N/A" and list_price:
+            try:
+                p_float = float(re.sub(r'[$,]', '', price))
+                lp_float = float(re.sub(r'[$,]', '', list_price))
+                if lp_float > p_float:
+                    discount = f"{int(round((lp_float - p_float) / lp_float * 100))}%"
+            except (ValueError, ZeroDivisionError):
+                pass
+
+    # Проверка на Prime (ищем иконку)
+    if soup.select_one("i.a-icon-prime"):
+        is_prime = True
+
+    # BSR
+    bsr = "N/A"
+    detail = soup.select_one("#detailBullets_feature_div") or soup.select_one("#productDetails_detailBullets_sections1")
+    if detail:
+        for li in detail.select('li'):
+            text = li.get_text()
+            if "Best Sellers Rank" in text:
+                bsr_text = ' '.join(li.get_text().split())
+                bsr = bsr_text.replace("Best Sellers Rank: ", "").split(' (')[0]
+                break
+
+    return {
+        "asin": asin, "rank": rank, "title": title_text, "price": price,
+        "list_price": list_price, "discount_percent": discount, "rating": rating_text,
+        "reviews_count": reviews_text, "is_prime": is_prime, "best_sellers_rank": bsr,
+        "bullet_points": bullets, "main_image_url": image_url, "url": url
+    }
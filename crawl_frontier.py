@@ -0,0 +1,150 @@
+"""
+Очередь обхода дерева категорий бестселлеров (frontier).
+
+Страницы ключуются канонически (normalize.url_key): ссылки, отличающиеся только
+ref=-сегментами и идентификатором сессии, считаются одной страницей.
+Обход идет в ширину с ограничением глубины; внутри одного уровня раньше берутся
+страницы с большим приоритетом. Состояние запуска сохраняется на диск после каждой
+обработанной страницы, поэтому после падения обход продолжается с того же места.
+"""
+import heapq
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from normalize import canonical_url, url_key
+from snapshot_store import write_json_atomic
+
+FRONTIER_FILE = "crawl_frontier.json"
+# Глубина обхода подкатегорий: 0 - только категории со страницы бестселлеров
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "1"))
+
+
+class CrawlFrontier:
+    """
+    Потокобезопасная очередь страниц одного запуска с множеством уже виденных ключей.
+    Запись: {"key", "url", "name", "depth", "priority", "parent"}.
+
+    Помимо состояния запуска хранит дерево категорий (ключ -> подкатегории) между
+    запусками: если страница категории не изменилась и не была загружена заново
+    (ответ 304), ее подкатегории берутся из этого дерева.
+    """
+
+    def __init__(self, filename: str = FRONTIER_FILE, max_depth: int = CRAWL_MAX_DEPTH):
+        self.filename = filename
+        self.max_depth = max_depth
+        self._cond = threading.Condition()
+        self._save_lock = threading.Lock()
+        self._heap: list = []
+        self._seen: set = set()
+        self._in_progress: Dict[str, dict] = {}
+        self._done: List[str] = []
+        # Порядок обнаружения категорий - в нем категории попадут в итоговый снимок
+        self.order: List[dict] = []
+        self._seq = 0
+        self.tree: Dict[str, List[dict]] = {}
+        self.resumed = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self.tree = state.get("tree", {})
+        run = state.get("run")
+        if not run:
+            return
+        # Незавершенный запуск: страницы, взятые в работу до падения, снова ставим в очередь
+        self.resumed = True
+        self._seen = set(run["seen"])
+        self._done = run["done"]
+        self.order = run["order"]
+        self._seq = run["seq"]
+        self._heap = [tuple(item[:3]) + (item[3],) for item in run["queue"]]
+        for entry in run["in_progress"]:
+            self._push_entry(entry)
+        heapq.heapify(self._heap)
+
+    def _push_entry(self, entry: dict):
+        self._seq += 1
+        heapq.heappush(self._heap, (entry["depth"], -entry["priority"], self._seq, entry))
+
+    def add(self, url: str, name: str, depth: int = 0, priority: int = 0, parent: Optional[str] = None) -> bool:
+        """Ставит страницу в очередь; False, если она уже встречалась или глубже лимита."""
+        key = url_key(url)
+        with self._cond:
+            if depth > self.max_depth or key in self._seen:
+                return False
+            self._seen.add(key)
+            entry = {"key": key, "url": canonical_url(url), "name": name, "depth": depth,
+                     "priority": priority, "parent": parent}
+            self.order.append({"key": key, "name": name})
+            self._push_entry(entry)
+            self._cond.notify()
+            return True
+
+    def pop(self, cancel_event: Optional[threading.Event] = None) -> Optional[dict]:
+        """
+        Следующая страница для обработки. Если очередь пуста, но другие воркеры еще
+        обрабатывают страницы (и могут найти подкатегории) - ждет. None - обход закончен.
+        """
+        with self._cond:
+            while not self._heap:
+                if not self._in_progress or (cancel_event is not None and cancel_event.is_set()):
+                    return None
+                self._cond.wait(0.5)
+            entry = heapq.heappop(self._heap)[3]
+            self._in_progress[entry["key"]] = entry
+            return entry
+
+    def done(self, entry: dict, children: Optional[List[dict]] = None):
+        """Отмечает страницу обработанной, ставит в очередь ее подкатегории и сохраняет состояние."""
+        added = 0
+        with self._cond:
+            if children is not None:
+                self.tree[entry["key"]] = children
+            else:
+                children = self.tree.get(entry["key"])
+        for child in children or []:
+            added += self.add(child["url"], f"{entry['name']} › {child['name']}",
+                              depth=entry["depth"] + 1, parent=entry["key"])
+        with self._cond:
+            self._in_progress.pop(entry["key"], None)
+            self._done.append(entry["key"])
+            self._cond.notify_all()
+        self.save()
+        return added
+
+    @property
+    def total(self) -> int:
+        with self._cond:
+            return len(self._seen)
+
+    def save(self):
+        # Снимок и запись под одной блокировкой, чтобы старое состояние не перезаписало более новое
+        with self._save_lock:
+            with self._cond:
+                state = {
+                    "saved_at": time.time(),
+                    "tree": dict(self.tree),
+                    "run": {
+                        "seen": sorted(self._seen), "done": list(self._done),
+                        "order": list(self.order), "seq": self._seq,
+                        "queue": [list(item) for item in self._heap],
+                        "in_progress": list(self._in_progress.values()),
+                    },
+                }
+            write_json_atomic(self.filename, state, indent=None)
+
+    def finish(self):
+        """Запуск завершен: состояние очереди больше не нужно, дерево категорий остается на диске."""
+        with self._save_lock:
+            with self._cond:
+                self.resumed = False
+                self._heap, self._in_progress = [], {}
+                state = {"saved_at": time.time(), "tree": dict(self.tree)}
+            write_json_atomic(self.filename, state, indent=None)
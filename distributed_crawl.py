@@ -0,0 +1,375 @@
+"""
+Распределенный обход через общую очередь задач (job_queue).
+
+Координатор раз в сутки создает запуск (один на сутки, даже если координаторов несколько)
+и ставит в очередь корневые задачи. Воркеры - потоки процесса API и/или отдельные процессы
+на других узлах - берут задачи в аренду, выполняют и пишут результат идемпотентно прямо
+в storage, поэтому API показывает категории и товары по мере их готовности. Когда задач
+в запуске не осталось, координатор закрывает запуск в storage.
+
+Запуск охватывает все площадки MARKETPLACES: у каждой свои запуски в storage и свой
+раздел очереди. Воркеры процесса запускаются на каждую площадку отдельно, поэтому
+площадки обходятся одновременно, каждая в пределах скорости своего хоста (RateLimiter).
+
+Виды задач:
+    bestsellers  - собрать категории со страницы бестселлеров и поставить задачи category
+    category     - собрать товары категории; поставить подкатегории до max_depth
+    product_list - собрать ссылки на товары категории и поставить задачи product
+    product      - разобрать страницу товара
+
+    python distributed_crawl.py worker [--threads 2] [--marketplace de]  # воркер на этом узле
+    python distributed_crawl.py start [--items-url URL]                  # создать запуск сейчас
+    python distributed_crawl.py coordinator                              # планировщик без API
+    python distributed_crawl.py status
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import storage
+import metrics
+from job_queue import JobQueue, FAILED, PENDING
+from marketplaces import MARKETPLACES, get_marketplace, marketplace_for_url
+from crawl_frontier import CRAWL_MAX_DEPTH
+from extractors import extract_subcategories
+from fetch_records import FetchRecords, CRAWL_STATE_FILE
+from normalize import extract_asin, url_key
+from fetchers import HttpFetcher, SeleniumFetcher, FallbackFetcher, AMAZON_BASE_URL, CATEGORY_PAGE
+from rate_limiter import RateLimiter
+from product_cache import ProductCache
+from parser_categories import collect_categories, scrape_category, CATEGORY_ITEM_LIMIT
+from parser_selenium import collect_product_links, parse_product_page, create_warm_driver, product_key, MAX_ITEMS
+
+# Сколько потоков-воркеров на каждую площадку запускает процесс API (0 - только внешние воркеры)
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "1"))
+# Категория, товары которой собираются для /items (без нее задачи товаров не ставятся):
+# полная ссылка - только ее площадка, путь ("/Best-Sellers-Electronics/zgbs/electronics") - все площадки
+ITEMS_CATEGORY_URL = os.getenv("ITEMS_CATEGORY_URL")
+# Как часто свободный воркер заглядывает в очередь и координатор проверяет запуски (секунды)
+QUEUE_POLL_S = 2.0
+QUEUE_TICK_S = 30.0
+
+# Приоритеты: сначала список категорий, затем категории (меньшая глубина раньше), затем товары
+PRIORITY_BESTSELLERS = 100
+PRIORITY_PRODUCT_LIST = 90
+PRIORITY_CATEGORY = 50
+PRIORITY_PRODUCT = 0
+
+
+class Coordinator:
+    """Создает запуски и закрывает их, когда очередь запуска опустела."""
+
+    def __init__(self, queue: JobQueue, max_depth: int = CRAWL_MAX_DEPTH, item_limit: int = CATEGORY_ITEM_LIMIT):
+        self.queue = queue
+        self.max_depth = max_depth
+        self.item_limit = item_limit
+
+    def start_run(self, slot: Optional[str] = None, items_url: Optional[str] = ITEMS_CATEGORY_URL,
+                  max_items: int = MAX_ITEMS, marketplaces: Optional[List[str]] = None) -> Optional[int]:
+        """
+        Создает запуск для slot (по умолчанию - текущие сутки) по площадкам marketplaces
+        (по умолчанию MARKETPLACES) и ставит корневые задачи.
+        None - запуск для этого slot уже создан (например, координатором другой реплики).
+        """
+        markets = [get_marketplace(code) for code in marketplaces or MARKETPLACES]
+        slot = slot or datetime.now().strftime("%Y-%m-%d")
+        run_id = self.queue.create_run(f"crawl:{slot}")
+        if run_id is None:
+            print(f"--- [COORDINATOR] --- Запуск '{slot}' уже создан, пропускаю.")
+            return None
+        roots, storage_runs = [], []
+        for market in markets:
+            bestsellers_run = storage.start_run(storage.BESTSELLERS, marketplace=market.code)
+            storage_runs.append(bestsellers_run)
+            roots.append(("bestsellers", market.base_url + "/gp/bestsellers", PRIORITY_BESTSELLERS, {
+                "marketplace": market.code, "bestsellers_run": bestsellers_run,
+                "max_depth": self.max_depth, "item_limit": self.item_limit}))
+            url = _items_url_for(items_url, market)
+            if url:
+                items_run = storage.start_run(storage.ITEMS, marketplace=market.code)
+                storage_runs.append(items_run)
+                roots.append(("product_list", url, PRIORITY_PRODUCT_LIST, {
+                    "marketplace": market.code, "url": url, "max_items": max_items, "items_run": items_run}))
+        self.queue.update_run_params(run_id, {"marketplaces": [m.code for m in markets], "storage_runs": storage_runs})
+        for kind, url, priority, payload in roots:
+            self.queue.enqueue(run_id, kind, _task_key(payload["marketplace"], url), payload, priority,
+                               partition=payload["marketplace"])
+        print(f"--- [COORDINATOR] --- Создан запуск #{run_id} ('{slot}', площадки: "
+              f"{', '.join(m.code for m in markets)}).")
+        return run_id
+
+    def tick(self):
+        """Закрывает запуски, в которых не осталось задач; вызывается периодически."""
+        for run in self.queue.runs(active_only=True):
+            tasks = run["tasks"]
+            # Запуск без задач: создавший его координатор упал до постановки корневых задач
+            stale = not tasks["total"] and time.time() - run["created_at"] > self.queue.lease_s
+            if tasks["total"] and not self.queue.is_drained(run["id"]) or not tasks["total"] and not stale:
+                continue
+            for storage_run in run["params"].get("storage_runs", []):
+                storage.finish_run(storage_run)
+            self.queue.finish_run(run["id"])
+            print(f"--- [COORDINATOR] --- Запуск #{run['id']} завершен: выполнено задач {tasks['done']}, "
+                  f"провалено {tasks[FAILED]}.")
+
+    def status(self) -> Optional[dict]:
+        runs = self.queue.runs(limit=1)
+        return runs[0] if runs else None
+
+
+def _task_key(marketplace: str, url: str) -> str:
+    """Ключ задачи в запуске: одна и та же категория на разных площадках - разные задачи."""
+    return f"{marketplace}:{url_key(url)}"
+
+
+def _items_url_for(items_url: Optional[str], market) -> Optional[str]:
+    """Ссылка на категорию для /items на площадке market (см. ITEMS_CATEGORY_URL)."""
+    if not items_url:
+        return None
+    if items_url.startswith("/"):
+        return market.base_url + items_url
+    owner = marketplace_for_url(items_url) or get_marketplace()
+    return items_url if owner is market else None
+
+
+class QueueWorker:
+    """
+    Берет задачи из очереди и выполняет их на своих (или общих для процесса) сессиях:
+    HTTP-клиенте, пуле браузеров, ограничителе скорости и кэше товаров.
+    marketplace - брать только задачи этой площадки (None - любые).
+    base_url - адрес сайта вместо адресов площадок (например, локальный fixture_server).
+    records - журналы загрузок по площадкам ({код: FetchRecords}, общие для воркеров процесса):
+    страница, не изменившаяся с прошлого запуска, берется из данных этого запуска в storage.
+    Аренда задачи продлевается перед каждой загрузкой страницы, если прошла треть ее срока.
+    """
+
+    def __init__(self, queue: JobQueue, http: Optional[HttpFetcher] = None, driver_pool=None,
+                 limiter: Optional[RateLimiter] = None, product_cache: Optional[ProductCache] = None,
+                 base_url: Optional[str] = None, name: Optional[str] = None, poll_s: float = QUEUE_POLL_S,
+                 marketplace: Optional[str] = None, records: Optional[Dict[str, FetchRecords]] = None):
+        self.queue = queue
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.marketplace = marketplace
+        default_url = self.base_url or get_marketplace(marketplace).base_url
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{marketplace or '*'}:{uuid.uuid4().hex[:6]}"
+        self.poll_s = poll_s
+        self._own_http = http is None
+        self.http = http or HttpFetcher(base_url=default_url)
+        self.driver_pool = driver_pool
+        if driver_pool is not None:
+            browser = SeleniumFetcher(pool=driver_pool)
+        else:
+            browser = SeleniumFetcher(driver_factory=lambda: create_warm_driver(headless=True, base_url=default_url))
+        self.fetcher = FallbackFetcher(self.http, browser, limiter=limiter or RateLimiter())
+        self.records = records if records is not None else {}
+        # Журналы, в которых есть подтвержденные, но еще не сохраненные загрузки
+        self._unsaved_records = set()
+        self._lease_renewed_at = 0.0
+        self._own_cache = product_cache is None
+        self.product_cache = product_cache or ProductCache()
+        self._handlers = {
+            "bestsellers": self._bestsellers, "category": self._category,
+            "product_list": self._product_list, "product": self._product,
+        }
+
+    def run(self, stop_event: threading.Event):
+        """Выполняет задачи, пока не выставлен stop_event."""
+        print(f"[QUEUE] Воркер {self.name} запущен.")
+        try:
+            while not stop_event.is_set():
+                if not self.run_once():
+                    stop_event.wait(self.poll_s)
+        finally:
+            self.close()
+
+    def run_once(self) -> bool:
+        """Выполняет одну задачу; False, если готовых задач нет."""
+        task = self.queue.lease(self.name, partition=self.marketplace)
+        if task is None:
+            # Очередь пуста - самое время сохранить журналы загрузок
+            self._save_records()
+            return False
+        self._lease_renewed_at = time.monotonic()
+        self.fetcher.before_fetch = lambda url: self._keep_lease(task)
+        try:
+            market = get_marketplace(task.payload.get("marketplace"))
+            self.fetcher.records = self._records_for(market)
+            self._handlers[task.kind](task, market, self.base_url or market.base_url)
+        except Exception as e:
+            status = self.queue.fail(task, f"{type(e).__name__}: {e}")
+            outcome = "lease_lost" if status is None else ("retry" if status == PENDING else "failed")
+            print(f"[QUEUE] Задача {task.kind} '{task.key}' (попытка {task.attempts}): {e} -> {outcome}")
+        else:
+            # Результат уже записан идемпотентно; если аренду успели передать другому, он запишет то же самое
+            outcome = "done" if self.queue.complete(task) else "lease_lost"
+        metrics.QUEUE_TASKS.inc(kind=task.kind, outcome=outcome)
+        return True
+
+    def _keep_lease(self, task):
+        """Продлевает аренду задачи между страницами; если ее уже выдали другому воркеру - прерывает задачу."""
+        if time.monotonic() - self._lease_renewed_at < self.queue.lease_s / 3:
+            return
+        if not self.queue.extend(task):
+            raise RuntimeError("task lease was taken over by another worker")
+        self._lease_renewed_at = time.monotonic()
+
+    def _records_for(self, market) -> FetchRecords:
+        records = self.records.get(market.code)
+        if records is None:
+            records = self.records.setdefault(market.code, FetchRecords(market.filename(CRAWL_STATE_FILE)))
+        return records
+
+    def _confirm_pages(self, market, urls):
+        """Подтверждает загрузки страниц, данные которых уже записаны в storage."""
+        self._records_for(market).confirm(urls)
+        self._unsaved_records.add(market.code)
+
+    def _save_records(self):
+        for code in self._unsaved_records:
+            self.records[code].save()
+        self._unsaved_records.clear()
+
+    def _enqueue(self, task, kind, url, payload, priority):
+        """Ставит задачу той же площадки, что и task."""
+        market = task.payload.get("marketplace") or get_marketplace().code
+        self.queue.enqueue(task.run_id, kind, _task_key(market, url), {**payload, "marketplace": market}, priority,
+                           partition=market)
+
+    def _bestsellers(self, task, market, base_url):
+        categories = collect_categories(self.fetcher, base_url, market)
+        if not categories:
+            raise RuntimeError("no categories on the bestsellers page")
+        for category in categories:
+            self._enqueue_category(task, category["url"], category["name"], 0)
+
+    def _enqueue_category(self, task, url, name, depth):
+        payload = {**task.payload, "url": url, "name": name, "depth": depth}
+        self._enqueue(task, "category", url, payload, PRIORITY_CATEGORY - depth)
+
+    def _category(self, task, market, base_url):
+        category = task.payload
+        stats = {"load_s": 0.0, "parse_s": 0.0}
+        previous = storage.load_previous_category(category["bestsellers_run"], category["name"])
+        want_children = category["depth"] < category["max_depth"]
+        kept_pages = []
+        products, _, _, children = scrape_category(
+            self.fetcher, category, previous, category["item_limit"], stats,
+            want_children=want_children, base_url=base_url, kept_pages=kept_pages)
+        if not products:
+            raise RuntimeError("no products on the category page")
+        if want_children and children is None:
+            # Ответ 304 пришел без тела, а дерева подкатегорий, как у frontier, у очереди нет
+            page = self.fetcher.fetch(category["url"], CATEGORY_PAGE, force=True)
+            children = extract_subcategories(page.text, base_url)
+        storage.save_run_category(category["bestsellers_run"], category["name"], products)
+        self._confirm_pages(market, kept_pages)
+        if category["depth"] == 0:
+            metrics.CATEGORY_ITEMS.set(len(products), marketplace=market.code, category=category["name"])
+        self.product_cache.update_prices(products, lambda card: market.product_key(extract_asin(card.get("url"))))
+        for child in children or []:
+            self._enqueue_category(task, child["url"], f"{category['name']} › {child['name']}",
+                                   category["depth"] + 1)
+
+    def _product_list(self, task, market, base_url):
+        url = task.payload["url"]
+        if url.startswith(market.base_url):
+            # Координатор строит ссылку от адреса площадки; воркер с --base-url ходит на свой адрес
+            url = base_url + url[len(market.base_url):]
+        links = collect_product_links(self.fetcher, url, task.payload["max_items"], base_url)
+        if not links:
+            raise RuntimeError("no product links on the category page")
+        for rank, url in enumerate(links, start=1):
+            self._enqueue(task, "product", url, {"url": url, "rank": rank, "items_run": task.payload["items_run"]},
+                          PRIORITY_PRODUCT)
+
+    def _product(self, task, market, base_url):
+        url = task.payload["url"]
+        previous = storage.load_previous_item(task.payload["items_run"], url)
+        item = parse_product_page(self.fetcher, url, task.payload["rank"], previous, cache=self.product_cache,
+                                  marketplace=market)
+        if item["title"] == "N/A":
+            # Капча или незнакомая разметка: повторим позже; если попытки кончатся,
+            # finish_run перенесет позицию из прошлого запуска
+            raise RuntimeError("product page was not parsed (captcha or unknown layout)")
+        storage.save_run_item(task.payload["items_run"], task.payload["rank"] - 1, item)
+        self._confirm_pages(market, [product_key(url)])
+
+    def close(self):
+        self._save_records()
+        self.fetcher.close()
+        if self._own_cache:
+            self.product_cache.close()
+        else:
+            self.product_cache.flush()
+        if self._own_http:
+            self.http.close()
+
+
+def start_workers(queue: JobQueue, count: int, stop_event: threading.Event,
+                  marketplaces: Optional[List[str]] = None, **sessions) -> list:
+    """
+    Запускает по count потоков-воркеров на каждую площадку marketplaces (None - count воркеров
+    на любые задачи) на общих сессиях процесса; возвращает потоки.
+    """
+    threads = []
+    # Журналы загрузок - общие для воркеров процесса, чтобы они не перезаписывали файлы друг друга
+    sessions.setdefault("records", {})
+    for market in marketplaces or [None]:
+        for i in range(count):
+            worker = QueueWorker(queue, marketplace=market, **sessions)
+            thread = threading.Thread(target=worker.run, args=(stop_event,), daemon=True,
+                                      name=f"queue-worker-{market or 'any'}-{i}")
+            thread.start()
+            threads.append(thread)
+    return threads
+
+
+def _print_status(queue: JobQueue):
+    for run in queue.runs(limit=5):
+        state = "завершен" if run["finished_at"] else "идет"
+        print(f"#{run['id']} {run['key']} ({state}): {json.dumps(run['tasks'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["worker", "start", "coordinator", "status"])
+    parser.add_argument("--threads", type=int, default=1, help="worker threads per marketplace in this process")
+    parser.add_argument("--marketplace", action="append", help="marketplaces to work on (default: MARKETPLACES)")
+    parser.add_argument("--base-url", help="site address instead of the marketplaces' own (e.g. fixture_server)")
+    parser.add_argument("--items-url", default=ITEMS_CATEGORY_URL, help="category whose products feed /items")
+    parser.add_argument("--max-items", type=int, default=MAX_ITEMS)
+    args = parser.parse_args()
+
+    crawl_queue = JobQueue()
+    coordinator = Coordinator(crawl_queue)
+    if args.command == "status":
+        _print_status(crawl_queue)
+    elif args.command == "start":
+        # Ручной запуск не должен совпасть с суточным ключом координатора
+        coordinator.start_run(slot=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), items_url=args.items_url,
+                              max_items=args.max_items, marketplaces=args.marketplace)
+    else:
+        stop = threading.Event()
+        if args.command == "worker":
+            http = HttpFetcher(base_url=args.base_url or AMAZON_BASE_URL)
+            workers = start_workers(crawl_queue, args.threads, stop, marketplaces=args.marketplace or MARKETPLACES,
+                                    http=http, limiter=RateLimiter(), base_url=args.base_url)
+        try:
+            while not stop.is_set():
+                if args.command == "coordinator":
+                    coordinator.start_run(items_url=args.items_url, max_items=args.max_items,
+                                          marketplaces=args.marketplace)
+                    coordinator.tick()
+                stop.wait(QUEUE_TICK_S)
+        except KeyboardInterrupt:
+            stop.set()
+        if args.command == "worker":
+            for thread in workers:
+                thread.join()
+            http.close()
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+from urllib.parse import urlsplit
+
+# Настройки пула по умолчанию (можно переопределить переменными окружения)
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "2"))
+DRIVER_MAX_PAGES = int(os.getenv("DRIVER_MAX_PAGES", "200"))
+DRIVER_MAX_RSS_MB = float(os.getenv("DRIVER_MAX_RSS_MB", "1500"))
+
+
+def _children_by_parent() -> dict:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # Имя процесса в скобках может содержать пробелы - берем поля после ')'
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def process_tree_rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Суммарный RSS процесса и всех его потомков в МБ (только Linux; иначе None)."""
+    if not pid or not os.path.isdir("/proc"):
+        return None
+    children = _children_by_parent()
+    total_kb, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+        stack.extend(children.get(current, []))
+    return total_kb / 1024
+
+
+def _driver_pid(driver) -> Optional[int]:
+    # undetected_chromedriver хранит pid браузера, обычный Selenium - pid chromedriver
+    pid = getattr(driver, "browser_pid", None)
+    if pid:
+        return pid
+    service = getattr(driver, "service", None)
+    process = getattr(service, "process", None)
+    return getattr(process, "pid", None)
+
+
+class PooledDriver:
+    """Прогретый драйвер из пула и счетчики его использования."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created_at = time.time()
+        self.pages = 0
+        self.uses = 0
+        # Сайты (scheme://host), на которых сессия браузера уже прогрета
+        self.warmed_sites = set()
+        self.baseline_rss_mb = process_tree_rss_mb(_driver_pid(driver))
+
+    def rss_growth_mb(self) -> Optional[float]:
+        current = process_tree_rss_mb(_driver_pid(self.driver))
+        if current is None or self.baseline_rss_mb is None:
+            return None
+        return current - self.baseline_rss_mb
+
+
+class DriverPool:
+    """
+    Долгоживущий пул браузеров, которым владеет процесс API.
+
+    Драйверы создаются фабрикой и между запусками парсера остаются открытыми.
+    warm(driver, site) прогревает сессию (cookies) на сайте site; вызывается через warm_up()
+    при первом заходе драйвера на каждый сайт, так что один браузер обслуживает все площадки.
+    Драйвер пересоздается, когда отработал max_pages страниц или память его процессов
+    выросла больше чем на max_rss_growth_mb.
+    """
+
+    def __init__(self, factory: Callable, max_size: int = DRIVER_POOL_SIZE,
+                 max_pages: int = DRIVER_MAX_PAGES, max_rss_growth_mb: float = DRIVER_MAX_RSS_MB,
+                 warm: Optional[Callable] = None):
+        self.factory = factory
+        self.warm = warm
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self.max_rss_growth_mb = max_rss_growth_mb
+        self._idle: List[PooledDriver] = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        # undetected_chromedriver патчит бинарник chromedriver при старте - запускаем браузеры по одному
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.counters = {"started": 0, "reused": 0, "recycled": 0, "startup_s": 0.0}
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledDriver:
+        """Выдает прогретый драйвер; если все заняты и пул полон - ждет освобождения."""
+        with self._cond:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No free browser in the driver pool")
+                self._cond.wait(remaining)
+            if self._closed:
+                raise RuntimeError("Driver pool is closed")
+            self._in_use += 1
+            if self._idle:
+                lease = self._idle.pop()
+                lease.uses += 1
+                self.counters["reused"] += 1
+                return lease
+
+        # Запуск Chrome долгий - делаем его вне общей блокировки пула
+        try:
+            with self._start_lock:
+                started = time.perf_counter()
+                lease = PooledDriver(self.factory())
+            lease.uses = 1
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.counters["started"] += 1
+            self.counters["startup_s"] += time.perf_counter() - started
+        return lease
+
+    def warm_up(self, lease: PooledDriver, url: str):
+        """Прогревает сессию драйвера на сайте url, если он там еще не был."""
+        parts = urlsplit(url)
+        site = f"{parts.scheme}://{parts.netloc}"
+        if self.warm is None or site in lease.warmed_sites:
+            return
+        self.warm(lease.driver, site)
+        lease.warmed_sites.add(site)
+
+    def release(self, lease: PooledDriver, broken: bool = False):
+        """Возвращает драйвер в пул или закрывает его, если он отслужил свое."""
+        reason = None
+        if broken:
+            reason = "broken"
+        elif lease.pages >= self.max_pages:
+            reason = f"{lease.pages} pages"
+        else:
+            growth = lease.rss_growth_mb()
+            if growth is not None and growth > self.max_rss_growth_mb:
+                reason = f"memory +{growth:.0f} MB"
+
+        with self._cond:
+            self._in_use -= 1
+            if reason is None and not self._closed:
+                self._idle.append(lease)
+            else:
+                self.counters["recycled"] += 1
+            self._cond.notify()
+
+        if reason is not None or self._closed:
+            if reason:
+                print(f"[POOL] Пересоздаю браузер ({reason}).")
+            self._quit(lease)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self.counters, "startup_s": round(self.counters["startup_s"], 1),
+                    "idle": len(self._idle), "in_use": self._in_use, "max_size": self.max_size}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for lease in idle:
+            self._quit(lease)
+
+    @staticmethod
+    def _quit(lease: PooledDriver):
+        try:
+            lease.driver.quit()
+        except Exception as e:
+            print(f"[POOL] Ошибка при закрытии браузера: {e}")
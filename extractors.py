@@ -0,0 +1,262 @@
+"""
+Быстрое извлечение данных из HTML: страница разбирается lxml один раз,
+все XPath-выражения скомпилированы при импорте модуля, а поля карточки
+товара собираются за один обход ее поддерева.
+Результат - те же словари, что раньше собирались через BeautifulSoup.
+"""
+import json
+from typing import Dict, List, Optional
+
+import lxml.html
+from lxml import etree
+
+from marketplaces import Marketplace, get_marketplace
+from normalize import extract_asin, parse_price
+
+# --- Скомпилированные выражения ---
+
+_TEXT = etree.XPath("descendant-or-self::text()")
+
+# Страница бестселлеров: заголовки каруселей с ссылками "See More" (подпись зависит от площадки)
+_CAROUSEL_HEADERS = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' a-carousel-header-row ')]")
+_CAROUSEL_NAME = etree.XPath(".//h2[contains(concat(' ', normalize-space(@class), ' '), ' a-carousel-heading ')]")
+_SEE_MORE = etree.XPath(".//a[contains(@aria-label, $label)]")
+
+# Страница категории
+_SUBCATEGORY_LINKS = etree.XPath(
+    "//div[@role='treeitem'][span[contains(@class, 'zg-selected')]]"
+    "/following-sibling::div[@role='group'][1]//div[@role='treeitem']/a[@href]"
+)
+_PRODUCT_LIST = etree.XPath("//ol[contains(concat(' ', normalize-space(@class), ' '), ' a-ordered-list ')][1]")
+_PRODUCT_CARDS = etree.XPath("descendant::li[contains(concat(' ', normalize-space(@class), ' '), ' zg-no-numbers ')]")
+_RECS_LIST = etree.XPath(
+    "(//div[contains(concat(' ', normalize-space(@class), ' '), ' p13n-desktop-grid ')])[1]/@data-client-recs-list"
+)
+_GRID_LINKS = etree.XPath(
+    "(//div[contains(concat(' ', normalize-space(@class), ' '), ' p13n-desktop-grid ')])[1]"
+    "//a[contains(concat(' ', normalize-space(@class), ' '), ' a-link-normal ')][@href]/@href"
+)
+
+# Страница товара
+_PRODUCT_TITLE = etree.XPath("//*[@id='productTitle']")
+_ASIN_INPUT = etree.XPath("//input[@id='ASIN']/@value")
+_RATING_TITLE = etree.XPath("//*[@id='acrPopover']/@title")
+_REVIEWS = etree.XPath("//*[@id='acrCustomerReviewText']")
+_LANDING_IMAGE = etree.XPath("//img[@id='landingImage']/@src")
+_BULLETS = etree.XPath("//*[@id='feature-bullets']//ul//li")
+_PRICE_BLOCK = etree.XPath("(//*[@id='corePrice_feature_div' or @id='tmmSwatches'])[1]")
+_OFFSCREEN = etree.XPath(".//span[contains(concat(' ', normalize-space(@class), ' '), ' a-offscreen ')]")
+_STRIKE_PRICE = etree.XPath(
+    ".//span[@data-a-strike='true']//span[contains(concat(' ', normalize-space(@class), ' '), ' a-offscreen ')]"
+)
+_PRIME_ICON = etree.XPath("//i[contains(concat(' ', normalize-space(@class), ' '), ' a-icon-prime ')][1]")
+_DETAIL_BULLETS = etree.XPath("//*[@id='detailBullets_feature_div']")
+_DETAIL_TABLE = etree.XPath("//*[@id='productDetails_detailBullets_sections1']")
+_DETAIL_ITEMS = etree.XPath(".//li")
+
+
+def parse_html(html: str):
+    """Разбирает страницу один раз; дерево можно передавать во все extract_*-функции."""
+    return lxml.html.document_fromstring(html or "<html></html>")
+
+
+def _as_tree(page):
+    return parse_html(page) if isinstance(page, str) else page
+
+
+def _text(element) -> str:
+    """Аналог BeautifulSoup.get_text(strip=True): склеивает обрезанные текстовые узлы."""
+    return "".join(t.strip() for t in _TEXT(element))
+
+
+def _raw_text(element) -> str:
+    """Аналог BeautifulSoup.get_text()."""
+    return "".join(_TEXT(element))
+
+
+def _see_more_links(header, labels):
+    for label in labels:
+        links = _SEE_MORE(header, label=label)
+        if links:
+            return links
+    return []
+
+
+def extract_categories(page, base_url: str, marketplace: Optional[Marketplace] = None) -> List[Dict[str, str]]:
+    """Категории со страницы бестселлеров: [{'name', 'url'}]. marketplace - площадка (подписи ссылок)."""
+    labels = (marketplace or get_marketplace()).see_more_labels
+    tree = _as_tree(page)
+    categories = []
+    for header in _CAROUSEL_HEADERS(tree):
+        names, links = _CAROUSEL_NAME(header), _see_more_links(header, labels)
+        if names and links and links[0].get("href") is not None:
+            categories.append({"name": _text(names[0]), "url": base_url + links[0].get("href")})
+    return categories
+
+
+def _card_fields(card) -> Optional[Dict[str, str]]:
+    """
+    Один обход поддерева карточки: первый подходящий элемент для каждого поля.
+    Возвращает None, если не хватает обязательных полей (как и раньше, такие карточки пропускаются).
+    """
+    link = rank = title = image = rating = reviews = price = offer_price = None
+    for el in card.iter("a", "span", "div", "img"):
+        tag = el.tag
+        classes = el.get("class") or ""
+        if tag == "span":
+            tokens = classes.split()
+            if rank is None and "zg-bdg-text" in tokens:
+                rank = el
+            elif rating is None and "a-icon-alt" in tokens:
+                rating = el
+            elif reviews is None and "a-size-small" in tokens:
+                reviews = el
+            elif price is None and "_cDEzb_p13n-sc-price_3mJ9Z" in tokens:
+                price = el
+            elif offer_price is None and "p13n-sc-price" in tokens:
+                offer_price = el
+        elif tag == "a":
+            if link is None and "a-link-normal" in classes.split():
+                link = el
+        elif tag == "div":
+            if title is None and "_cDEzb_p13n-sc-css-line-clamp-" in classes:
+                title = el
+        elif tag == "img":
+            if image is None:
+                image = el
+
+    if rank is None or title is None or image is None or image.get("src") is None \
+            or rating is None or reviews is None:
+        return None
+    price_element = price if price is not None else offer_price
+    return {
+        "link": link.get("href") if link is not None else None,
+        "rank": _text(rank), "title": _text(title), "image_url": image.get("src"),
+        "rating": _text(rating), "reviews_count": _text(reviews),
+        "price": _text(price_element) if price_element is not None else "N/A",
+    }
+
+
+def extract_subcategories(page, base_url: str) -> List[Dict[str, str]]:
+    """Подкатегории текущей категории из дерева навигации слева: [{'name', 'url'}]."""
+    return [{"name": _text(a), "url": base_url + a.get("href")}
+            for a in _SUBCATEGORY_LINKS(_as_tree(page)) if a.get("href", "").startswith("/")]
+
+
+def extract_category_cards(page, base_url: str, limit: Optional[int] = 5) -> Optional[List[Dict]]:
+    """
+    Карточки товаров со страницы категории (не больше limit).
+    Возвращает None, если на странице нет списка товаров, и [] - если в нем нет карточек.
+    """
+    tree = _as_tree(page)
+    product_list = _PRODUCT_LIST(tree)
+    if not product_list:
+        return None
+    products = []
+    for card in _PRODUCT_CARDS(product_list[0])[:limit]:
+        fields = _card_fields(card)
+        if fields is None:
+            continue
+        link = fields.pop("link")
+        products.append({
+            "rank": fields["rank"], "title": fields["title"],
+            "url": base_url + link if link is not None else None,
+            "image_url": fields["image_url"], "rating": fields["rating"],
+            "reviews_count": fields["reviews_count"], "price": fields["price"],
+        })
+    return products
+
+
+def count_category_cards(page) -> int:
+    tree = _as_tree(page)
+    product_list = _PRODUCT_LIST(tree)
+    return len(_PRODUCT_CARDS(product_list[0])) if product_list else 0
+
+
+def count_listed_products(page) -> int:
+    """
+    Сколько товаров страница категории перечисляет в data-client-recs-list.
+    Карточек в HTML бывает меньше: вторая половина подгружается скриптом при прокрутке.
+    """
+    values = _RECS_LIST(_as_tree(page))
+    try:
+        listed = json.loads(values[0]) if values else []
+    except ValueError:
+        return 0
+    return len(listed) if isinstance(listed, list) else 0
+
+
+def extract_product_links(page, base_url: str, limit: int) -> List[str]:
+    """Уникальные ссылки на товары из сетки категории, в порядке появления."""
+    links: List[str] = []
+    for href in _GRID_LINKS(_as_tree(page)):
+        if href.startswith('/'):
+            full_url = base_url + href
+            if full_url not in links:
+                links.append(full_url)
+        if len(links) >= limit:
+            break
+    return links
+
+
+def extract_product(page, url: str, rank: int, marketplace: Optional[Marketplace] = None) -> Dict:
+    """
+    Поля страницы товара; формат совпадает с прежним parse_product_page.
+    marketplace - площадка: формат цен для скидки и подпись строки BSR.
+    """
+    marketplace = marketplace or get_marketplace()
+    tree = _as_tree(page)
+
+    titles = _PRODUCT_TITLE(tree)
+    title_text = _text(titles[0]) if titles else "N/A"
+
+    asin_values = _ASIN_INPUT(tree)
+    asin = asin_values[0] if asin_values and asin_values[0] else extract_asin(url)
+
+    rating_titles = _RATING_TITLE(tree)
+    rating_text = rating_titles[0] if rating_titles and rating_titles[0] else "N/A"
+
+    reviews = _REVIEWS(tree)
+    reviews_text = _text(reviews[0]) if reviews else "0"
+
+    images = _LANDING_IMAGE(tree)
+    image_url = images[0] if images and images[0] else None
+
+    bullets = [_text(li) for li in _BULLETS(tree)[:5]]
+
+    price, list_price, discount = "N/A", None, None
+    price_blocks = _PRICE_BLOCK(tree)
+    if price_blocks:
+        block = price_blocks[0]
+        current = _OFFSCREEN(block)
+        if current:
+            price = _text(current[0])
+        struck = _STRIKE_PRICE(block)
+        if struck:
+            list_price = _text(struck[0])
+        if price != "N/A" and list_price:
+            p_float = parse_price(price, marketplace)
+            lp_float = parse_price(list_price, marketplace)
+            if p_float is not None and lp_float and lp_float > p_float:
+                discount = f"{int(round((lp_float - p_float) / lp_float * 100))}%"
+
+    is_prime = bool(_PRIME_ICON(tree))
+
+    bsr = "N/A"
+    detail = _DETAIL_BULLETS(tree) or _DETAIL_TABLE(tree)
+    if detail:
+        for li in _DETAIL_ITEMS(detail[0]):
+            text = _raw_text(li)
+            label = next((label for label in marketplace.bsr_labels if label in text), None)
+            if label is not None:
+                bsr_text = ' '.join(text.split())
+                # "Best Sellers Rank: #1 in ...", "Amazon 売れ筋ランキング: - 1位..." -> значение после подписи
+                bsr = bsr_text.split(label, 1)[1].lstrip(" :：-").split(' (')[0]
+                break
+
+    return {
+        "asin": asin, "rank": rank, "title": title_text, "price": price,
+        "list_price": list_price, "discount_percent": discount, "rating": rating_text,
+        "reviews_count": reviews_text, "is_prime": is_prime, "best_sellers_rank": bsr,
+        "bullet_points": bullets, "main_image_url": image_url, "url": url
+    }
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from snapshot_store import write_json_atomic
+
+CRAWL_STATE_FILE = "crawl_state.json"
+
+
+class FetchRecords:
+    """
+    Журнал загрузок по URL: хэш содержимого, время последней загрузки и
+    ETag/Last-Modified (если сервер их отдал). По нему краулер понимает,
+    что страница не изменилась, и не разбирает ее заново.
+
+    Новая загрузка (update) сначала только ожидает подтверждения: в журнал она попадает
+    после confirm, когда данные страницы разобраны и сохранены. Иначе страница, которую
+    не удалось разобрать, в следующих запусках считалась бы неизменившейся.
+    """
+
+    def __init__(self, filename: str = CRAWL_STATE_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                self._records: Dict[str, dict] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._records = {}
+        self._pending: Dict[str, dict] = {}
+
+    def get(self, url: str) -> Optional[dict]:
+        return self._records.get(url)
+
+    def conditional_headers(self, url: str) -> dict:
+        """Заголовки условного запроса для повторной загрузки url."""
+        record = self._records.get(url) or {}
+        headers = {}
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def touch(self, url: str):
+        """Отмечает, что страница проверена и не изменилась (ответ 304)."""
+        with self._lock:
+            if url in self._records:
+                self._records[url]["last_fetched"] = time.time()
+
+    def update(self, url: str, content_hash: str, headers: Optional[dict] = None) -> bool:
+        """Запоминает новую загрузку до подтверждения (confirm). Возвращает True, если содержимое изменилось."""
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        with self._lock:
+            previous = self._records.get(url)
+            self._pending[url] = {
+                "hash": content_hash,
+                "last_fetched": time.time(),
+                "etag": headers.get("etag"),
+                "last_modified": headers.get("last-modified"),
+            }
+        return previous is None or previous.get("hash") != content_hash
+
+    def confirm(self, urls: Iterable[str]):
+        """Переносит в журнал загрузки страниц, данные которых сохранены."""
+        with self._lock:
+            for url in urls:
+                record = self._pending.pop(url, None)
+                if record is not None:
+                    self._records[url] = record
+
+    def save(self):
+        # Снимок и запись под одной блокировкой: журнал могут сохранять несколько потоков
+        with self._lock:
+            write_json_atomic(self.filename, self._records, indent=None)
+
+    def __len__(self):
+        return len(self._records)
+
+
+def reset_records(filename: str = CRAWL_STATE_FILE):
+    """Удаляет журнал, чтобы следующий запуск обошел все страницы заново."""
+    if os.path.exists(filename):
+        os.remove(filename)
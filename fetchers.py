@@ -0,0 +1,424 @@
+import re
+import json
+import time
+import hashlib
+import random
+import asyncio
+import threading
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+from fake_useragent import UserAgent
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+import metrics
+from marketplaces import get_marketplace, marketplace_for_url
+
+try:
+    import h2  # noqa: F401  - httpx включает HTTP/2 только при наличии пакета h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Сайт площадки по умолчанию (MARKETPLACE); другие площадки - marketplaces.MARKETPLACE_PROFILES
+AMAZON_BASE_URL = get_marketplace().base_url
+# Amazon показывает топ-100 категории на двух страницах по 50 товаров (?pg=2)
+CATEGORY_PAGE_SIZE = 50
+
+# Части HTML, которые меняются от запроса к запросу при неизменном контенте:
+# ref=-сегменты ссылок, идентификаторы сессии, одноразовые токены
+_VOLATILE_RE = re.compile(
+    r"/ref=[^/\"?&\s]*|[?&](?:ref_?|pd_rd_[a-z]+|pf_rd_[a-z]+|qid|sr|th|psc|content-id)=[^\"&\s]*"
+    r"|\b\d{3}-\d{7}-\d{7}\b|data-(?:csa|csrf)[-\w]*=\"[^\"]*\""
+)
+
+# Признаки страницы с капчей / блокировкой
+_CAPTCHA_RE = re.compile(
+    r"/errors/validateCaptcha|Enter the characters you see below|api-services-support@amazon\.com",
+    re.IGNORECASE,
+)
+
+
+class PageKind:
+    """
+    Описание типа страницы: по какому маркеру в HTML понять, что страница
+    загрузилась полноценно, и что делать в браузере при фолбэке на Selenium.
+    """
+
+    def __init__(self, name: str, marker: str, wait_css: Optional[str] = None,
+                 scroll_script: Optional[str] = None, settle: tuple = (0.0, 0.0),
+                 fragment_end: Optional[str] = None, count_css: Optional[str] = None, max_scrolls: int = 10):
+        self.name = name
+        self.marker = re.compile(marker)
+        self.fragment_end = fragment_end
+        self.wait_css = wait_css
+        self.scroll_script = scroll_script
+        self.settle = settle
+        # Если задан count_css, браузер прокручивает страницу, пока число таких элементов не перестанет расти
+        self.count_css = count_css
+        self.max_scrolls = max_scrolls
+
+    def is_complete(self, html: str) -> bool:
+        return bool(html) and self.marker.search(html) is not None
+
+    def fingerprint(self, html: str) -> str:
+        """
+        Хэш значимой части страницы (от маркера до fragment_end) без изменчивых
+        токенов - одинаковый для страниц с одинаковым содержимым.
+        """
+        fragment = html or ""
+        match = self.marker.search(fragment)
+        if match:
+            end = fragment.rfind(self.fragment_end) if self.fragment_end else -1
+            fragment = fragment[match.start():end if end > match.start() else None]
+        fragment = _VOLATILE_RE.sub("", fragment)
+        return hashlib.sha1(fragment.encode("utf-8", "replace")).hexdigest()
+
+
+BESTSELLERS_PAGE = PageKind(
+    "bestsellers", r'class="[^"]*\ba-carousel-header-row\b', wait_css="div.a-carousel-header-row",
+    scroll_script="window.scrollTo(0, document.body.scrollHeight);", settle=(2, 4),
+)
+CATEGORY_PAGE = PageKind(
+    "category", r'<ol[^>]*class="[^"]*\ba-ordered-list\b',
+    wait_css="ol.a-ordered-list, div.p13n-desktop-grid", fragment_end="</ol>",
+    count_css="li.zg-no-numbers", settle=(1, 2),
+)
+PRODUCT_PAGE = PageKind(
+    "product", r'id="productTitle"',
+    wait_css="#productTitle, #centerCol", scroll_script="window.scrollBy(0, 500);", settle=(0.5, 1.5),
+)
+
+
+def category_page_url(url: str, page: int) -> str:
+    """Ссылка на страницу page списка бестселлеров категории (первая страница - сама ссылка)."""
+    if page <= 1:
+        return url
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "pg"] + [("pg", str(page))]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def looks_like_captcha(html: str) -> bool:
+    return bool(html) and _CAPTCHA_RE.search(html) is not None
+
+
+class FetchResult:
+    """Результат загрузки страницы любым способом."""
+
+    __slots__ = ("url", "status", "text", "headers", "source", "elapsed", "unchanged")
+
+    def __init__(self, url: str, status: int, text: str, headers: Optional[dict] = None,
+                 source: str = "http", elapsed: float = 0.0):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.headers = headers or {}
+        self.source = source
+        self.elapsed = elapsed
+        # True, если содержимое совпадает с прошлой загрузкой (или сервер ответил 304)
+        self.unchanged = False
+
+
+class HttpFetcher:
+    """
+    Пул асинхронных HTTP-соединений (keep-alive, HTTP/2 при наличии h2) с общим cookie jar.
+    Event loop крутится в отдельном потоке, поэтому fetch() можно вызывать
+    из обычного синхронного кода и из нескольких потоков одновременно.
+    Один клиент обслуживает несколько площадок: cookies сессии берутся с главной
+    страницы каждого хоста, Accept-Language - из профиля площадки.
+    """
+
+    def __init__(self, base_url: str = AMAZON_BASE_URL, user_agent: Optional[str] = None,
+                 max_connections: int = 10, timeout: float = 20.0, proxy: Optional[str] = None):
+        self.base_url = base_url.rstrip("/")
+        self.user_agent = user_agent or UserAgent(platforms='pc').random
+        self._headers = {
+            "User-Agent": self.user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9",
+            "Upgrade-Insecure-Requests": "1",
+        }
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._timeout = timeout
+        self._proxy = proxy
+        self._warmed = set()
+        self._warm_lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="http-fetcher", daemon=True)
+        self._thread.start()
+        self._client: httpx.AsyncClient = self._run(self._make_client())
+
+    async def _make_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            headers=self._headers, http2=HTTP2_AVAILABLE, follow_redirects=True,
+            limits=self._limits, timeout=self._timeout, proxy=self._proxy,
+        )
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def afetch(self, url: str, headers: Optional[dict] = None) -> FetchResult:
+        started = time.perf_counter()
+        response = await self._client.get(url, headers=headers)
+        return FetchResult(str(response.url), response.status_code, response.text,
+                           dict(response.headers), "http", time.perf_counter() - started)
+
+    def fetch(self, url: str, headers: Optional[dict] = None) -> FetchResult:
+        self.warm_up(url)
+        marketplace = marketplace_for_url(url)
+        if marketplace is not None:
+            headers = {"Accept-Language": marketplace.accept_language, **(headers or {})}
+        result = self._run(self.afetch(url, headers))
+        metrics.observe_stage("http_get", result.elapsed)
+        return result
+
+    def warm_up(self, url: Optional[str] = None):
+        """
+        Заходит на главную страницу хоста url (по умолчанию base_url), чтобы получить
+        cookies сессии (как driver.get на главную).
+        """
+        parts = urlsplit(url or self.base_url)
+        home = f"{parts.scheme}://{parts.netloc}"
+        if home in self._warmed:
+            return
+        with self._warm_lock:
+            if home in self._warmed:
+                return
+            marketplace = marketplace_for_url(home)
+            headers = {"Accept-Language": marketplace.accept_language} if marketplace is not None else None
+            try:
+                self._run(self.afetch(home + "/", headers))
+            except httpx.HTTPError as e:
+                print(f"[WARN] HTTP warm-up failed: {e}")
+            self._warmed.add(home)
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class SeleniumFetcher:
+    """
+    Загрузка страниц через браузер. Драйвер создается лениво при первом обращении
+    (если не передан готовый), так что Chrome запускается только когда он действительно нужен.
+    Если передан pool (DriverPool), драйвер берется из пула прогретых сессий на одну
+    страницу и сразу возвращается туда: поток не держит браузер, пока разбирает страницу
+    или ждет других, поэтому потоков может быть больше, чем браузеров в пуле.
+    """
+
+    def __init__(self, driver=None, driver_factory: Optional[Callable] = None, wait_timeout: float = 20,
+                 pool=None):
+        self._driver = driver
+        self._owns_driver = driver is None
+        self._driver_factory = driver_factory
+        self._pool = pool
+        self._lease = None
+        self.wait_timeout = wait_timeout
+        self.startup_s = 0.0
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            started = time.perf_counter()
+            if self._pool is not None:
+                self._lease = self._pool.acquire()
+                self._driver = self._lease.driver
+            else:
+                self._driver = self._driver_factory()
+            self.startup_s += time.perf_counter() - started
+        return self._driver
+
+    def fetch(self, url: str, kind: Optional[PageKind] = None) -> FetchResult:
+        started = time.perf_counter()
+        broken = False
+        try:
+            driver = self.driver
+            if self._lease is not None:
+                self._lease.pages += 1
+                with metrics.stage("warm_up"):
+                    self._pool.warm_up(self._lease, url)
+            # driver_get включает ожидание нужного элемента - страница до него еще не готова
+            with metrics.stage("driver_get"):
+                driver.get(url)
+                if kind and kind.wait_css:
+                    WebDriverWait(driver, self.wait_timeout).until(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, kind.wait_css))
+                    )
+            if kind and kind.count_css:
+                self._scroll_until_stable(driver, kind)
+            elif kind and kind.scroll_script:
+                driver.execute_script(kind.scroll_script)
+                with metrics.stage("sleep"):
+                    time.sleep(random.uniform(*kind.settle))
+            with metrics.stage("page_source"):
+                html = driver.page_source
+        except WebDriverException:
+            # Упавший или зависший Chrome (в т.ч. таймаут ожидания) в пул не возвращаем
+            broken = True
+            raise
+        finally:
+            if self._pool is not None:
+                self._release(broken)
+        return FetchResult(url, 200, html, None, "selenium", time.perf_counter() - started)
+
+    @staticmethod
+    def _scroll_until_stable(driver, kind: PageKind):
+        """Прокручивает страницу вниз, пока лениво подгружаемые элементы count_css перестанут добавляться."""
+        count_script = f"return document.querySelectorAll({json.dumps(kind.count_css)}).length;"
+        last = driver.execute_script(count_script)
+        for _ in range(kind.max_scrolls):
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            with metrics.stage("sleep"):
+                time.sleep(random.uniform(*kind.settle))
+            count = driver.execute_script(count_script)
+            if count == last:
+                break
+            last = count
+
+    def _release(self, broken: bool = False):
+        if self._lease is not None:
+            self._pool.release(self._lease, broken=broken)
+            self._lease = None
+            self._driver = None
+
+    def close(self):
+        if self._lease is not None:
+            self._release()
+        elif self._owns_driver and self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+
+
+def _retry_after(headers: dict) -> Optional[float]:
+    value = (headers or {}).get("retry-after") or (headers or {}).get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class FallbackFetcher:
+    """
+    Сначала пробует дешевый HTTP-запрос; если ответ похож на капчу, не 200
+    или в нем нет маркера нужного типа страницы - повторяет загрузку через Selenium.
+
+    Если передан журнал records (FetchRecords), HTTP-запросы делаются условными
+    (If-None-Match / If-Modified-Since), а у результата выставляется unchanged,
+    когда хэш значимой части страницы совпал с прошлым запуском. Новый хэш попадает
+    в журнал, только когда вызывающий код подтвердит, что данные страницы сохранены
+    (FetchRecords.confirm); капча и страницы без маркера не запоминаются вовсе.
+
+    Если передан limiter (RateLimiter), перед каждым запросом выдерживается пауза
+    для хоста, а по ответу скорость увеличивается (чистая страница) или снижается
+    (капча, 429/5xx, нет маркера). Пауза прерывается cancel_event.
+
+    before_fetch(url) вызывается перед каждой загрузкой - например, чтобы продлить
+    аренду задачи очереди, пока задача обходит страницы.
+    """
+
+    def __init__(self, http: Optional[HttpFetcher], browser: Optional[SeleniumFetcher], records=None,
+                 limiter=None, cancel_event: Optional[threading.Event] = None,
+                 before_fetch: Optional[Callable[[str], None]] = None):
+        self.http = http
+        self.browser = browser
+        self.records = records
+        self.limiter = limiter
+        self.cancel_event = cancel_event
+        self.before_fetch = before_fetch
+        # reused - страницы, которые вызывающий код не стал разбирать заново; wait_s - паузы ограничителя
+        self.stats = {"http": 0, "selenium": 0, "fallbacks": 0, "not_modified": 0, "reused": 0, "wait_s": 0.0}
+
+    def fetch(self, url: str, kind: PageKind, force: bool = False, key: Optional[str] = None,
+              use_browser: bool = False) -> FetchResult:
+        """
+        force=True - загрузить страницу целиком, без условного запроса.
+        key - ключ записи в журнале, если url содержит изменчивые части (по умолчанию сам url).
+        use_browser=True - сразу через Selenium (например, чтобы прокруткой подгрузить ленивую часть страницы).
+        """
+        if self.before_fetch is not None:
+            self.before_fetch(url)
+        key = key or url
+        use_records = self.records is not None and not force
+        if self.http is not None and not (use_browser and self.browser is not None):
+            try:
+                headers = self.records.conditional_headers(key) if use_records else None
+                self._wait(url)
+                result = self.http.fetch(url, headers)
+                if result.status == 304 and use_records:
+                    self._feedback(url, True)
+                    metrics.PAGES.inc(kind=kind.name, source="http", outcome="not_modified")
+                    self.records.touch(key)
+                    self.stats["not_modified"] += 1
+                    result.unchanged = True
+                    return result
+                if result.status == 200 and kind.is_complete(result.text) and not looks_like_captcha(result.text):
+                    self._feedback(url, True)
+                    metrics.PAGES.inc(kind=kind.name, source="http", outcome="success")
+                    self.stats["http"] += 1
+                    return self._record(key, result, kind)
+                if looks_like_captcha(result.text):
+                    reason, outcome = "captcha", "captcha"
+                    self._feedback(url, False)
+                elif result.status == 429 or result.status >= 500 or result.status == 200:
+                    reason, outcome = f"status {result.status} / no marker", "blocked"
+                    self._feedback(url, False, _retry_after(result.headers))
+                else:
+                    reason, outcome = f"status {result.status}", "error"
+            except httpx.HTTPError as e:
+                reason, outcome = f"{type(e).__name__}: {e}", "error"
+            metrics.PAGES.inc(kind=kind.name, source="http", outcome=outcome)
+            if self.browser is None:
+                raise RuntimeError(f"HTTP fetch of {url} failed ({reason}) and no browser fallback is configured")
+            print(f"  [FETCH] HTTP не подошел для {kind.name} ({reason}), переключаюсь на Selenium...")
+            self.stats["fallbacks"] += 1
+
+        self._wait(url)
+        try:
+            result = self.browser.fetch(url, kind)
+        except Exception:
+            self._feedback(url, False)
+            metrics.PAGES.inc(kind=kind.name, source="selenium", outcome="error")
+            raise
+        if looks_like_captcha(result.text):
+            outcome = "captcha"
+        else:
+            outcome = "success" if kind.is_complete(result.text) else "blocked"
+        self._feedback(url, outcome == "success")
+        metrics.PAGES.inc(kind=kind.name, source="selenium", outcome=outcome)
+        self.stats["selenium"] += 1
+        if outcome != "success":
+            return result
+        return self._record(key, result, kind)
+
+    def _wait(self, url: str):
+        if self.limiter is not None:
+            delay = self.limiter.acquire(url, self.cancel_event)
+            metrics.observe_stage("sleep", delay)
+            self.stats["wait_s"] += delay
+
+    def _feedback(self, url: str, ok: bool, retry_after: Optional[float] = None):
+        if self.limiter is None:
+            return
+        if ok:
+            self.limiter.success(url)
+        else:
+            self.limiter.throttle(url, retry_after)
+
+    def _record(self, key: str, result: FetchResult, kind: PageKind) -> FetchResult:
+        if self.records is not None:
+            result.unchanged = not self.records.update(key, kind.fingerprint(result.text), result.headers)
+        return result
+
+    def close(self):
+        if self.browser is not None:
+            self.browser.close()
@@ -0,0 +1,174 @@
+"""
+Локальный сервер, который отдает сохраненные HTML-страницы Amazon из папки fixtures/.
+Нужен, чтобы проверять загрузку и разбор страниц без обращения к реальному сайту.
+Для бенчмарков сервер умеет изображать медленный и нестабильный сайт: задержку ответа
+и долю ответов 503 / страниц с капчей.
+
+    python fixture_server.py            # запустить сервер на 127.0.0.1:8765
+    python fixture_server.py --latency 0.2 --error-rate 0.05
+    python fixture_server.py --check    # прогнать HTTP-загрузчик по всем типам страниц
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Маршрут (регулярка по пути) -> (HTTP-статус, файл фикстуры).
+# Для ?pg=N отдается "<файл>_pageN.html", если такая фикстура есть (иначе 404)
+ROUTES = [
+    (re.compile(r"^/$"), 200, "home.html"),
+    (re.compile(r"^/gp/bestsellers/?$"), 200, "bestsellers.html"),
+    (re.compile(r"/zgbs/"), 200, "category.html"),
+    (re.compile(r"/dp/[A-Z0-9]{10}"), 200, "product.html"),
+    (re.compile(r"^/captcha"), 200, "captcha.html"),
+    (re.compile(r"^/unavailable"), 503, "captcha.html"),
+]
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server: "FixtureHTTPServer" = self.server
+        if server.latency:
+            time.sleep(server.latency * server.random.uniform(1 - server.jitter, 1 + server.jitter))
+        roll = server.random.random()
+        if roll < server.error_rate:
+            self._send_file(503, "captcha.html")
+            return
+        if roll < server.error_rate + server.captcha_rate:
+            self._send_file(200, "captcha.html")
+            return
+
+        parts = urlsplit(self.path)
+        path = parts.path
+        page = parse_qs(parts.query).get("pg", ["1"])[0]
+        for pattern, status, filename in ROUTES:
+            if pattern.search(path):
+                if page != "1":
+                    filename = filename.replace(".html", f"_page{page}.html")
+                    if not os.path.exists(os.path.join(FIXTURES_DIR, filename)):
+                        break
+                self._send_file(status, filename, set_cookie=path == "/")
+                return
+        self.send_error(404)
+
+    def _send_file(self, status: int, filename: str, set_cookie: bool = False):
+        with open(os.path.join(FIXTURES_DIR, filename), "rb") as f:
+            body = f.read()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if set_cookie:
+            self.send_header("Set-Cookie", "session-id=000-0000000-0000000; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Бенчмарк открывает много соединений сразу - очередь по умолчанию (5) для этого мала
+    request_queue_size = 128
+
+    def __init__(self, address, latency: float = 0.0, jitter: float = 0.5, error_rate: float = 0.0,
+                 captcha_rate: float = 0.0, seed: Optional[int] = None):
+        super().__init__(address, FixtureHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.captcha_rate = captcha_rate
+        self.random = random.Random(seed)
+
+
+class FixtureServer:
+    """
+    Фоновый сервер фикстур; используется как контекстный менеджер.
+    latency - средняя задержка ответа в секундах (разброс +-jitter от нее);
+    error_rate / captcha_rate - доля ответов 503 и страниц с капчей вместо нужной страницы;
+    seed - фиксирует последовательность ошибок, чтобы прогоны бенчмарка были сравнимы.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.5,
+                 error_rate: float = 0.0, captcha_rate: float = 0.0, seed: Optional[int] = None):
+        self.httpd = FixtureHTTPServer((host, port), latency, jitter, error_rate, captcha_rate, seed)
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def self_check() -> bool:
+    """Проверяет, что HTTP-загрузчик принимает полные страницы и отбраковывает капчу/ошибки."""
+    from fetchers import (HttpFetcher, FallbackFetcher, BESTSELLERS_PAGE, CATEGORY_PAGE,
+                          PRODUCT_PAGE, looks_like_captcha)
+
+    ok = True
+    with FixtureServer() as server:
+        http = HttpFetcher(base_url=server.base_url, user_agent="fixture-check")
+        fetcher = FallbackFetcher(http, browser=None)
+        try:
+            for path, kind in [("/gp/bestsellers", BESTSELLERS_PAGE),
+                               ("/Best-Sellers-Electronics/zgbs/electronics", CATEGORY_PAGE),
+                               ("/Best-Sellers-Electronics/zgbs/electronics?pg=2", CATEGORY_PAGE),
+                               ("/Some-Product/dp/B01M16WBW1", PRODUCT_PAGE)]:
+                result = fetcher.fetch(server.base_url + path, kind)
+                print(f"[OK] {kind.name}: {len(result.text)} bytes via {result.source} in {result.elapsed * 1000:.1f} ms")
+            cookies = list(http._client.cookies.keys())
+            print(f"[{'OK' if 'session-id' in cookies else 'FAIL'}] warm-up cookies: {cookies}")
+            ok &= "session-id" in cookies
+
+            for path in ["/captcha", "/unavailable"]:
+                try:
+                    fetcher.fetch(server.base_url + path, CATEGORY_PAGE)
+                    print(f"[FAIL] {path} was accepted")
+                    ok = False
+                except RuntimeError as e:
+                    print(f"[OK] {path} rejected: {e}")
+            ok &= looks_like_captcha(http.fetch(server.base_url + "/captcha").text)
+        finally:
+            http.close()
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="check the HTTP fetcher against the fixtures and exit")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response delay, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 503 responses")
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="share of captcha pages")
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if self_check() else 1)
+    with FixtureServer(port=args.port, latency=args.latency, error_rate=args.error_rate,
+                       captcha_rate=args.captcha_rate) as server:
+        print(f"Fixture server: {server.base_url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,149 @@
+import json
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from marketplaces import Marketplace
+from normalize import NUMERIC_FIELDS, normalize_item
+
+# Поля, доступные для сортировки: параметр API -> поле в нормализованном товаре
+SORT_FIELDS = {
+    "rank": "rank",
+    "price": "price_value",
+    "list_price": "list_price_value",
+    "rating": "rating_value",
+    "reviews_count": "reviews_count_value",
+    "bsr": "bsr_value",
+}
+
+
+class ItemsIndex:
+    """
+    Нормализованный список товаров и отсортированные индексы по числовым полям.
+    Строится один раз при загрузке снимка; фильтры по диапазону отвечаются
+    бинарным поиском, сортировка - готовым порядком позиций.
+    marketplace - площадка снимка: формат чисел и валюта цен.
+    """
+
+    def __init__(self, items: Optional[list], marketplace: Optional[Marketplace] = None):
+        self.items: List[dict] = [normalize_item(it, marketplace) for it in (items or []) if isinstance(it, dict)]
+        # поле -> (отсортированные значения, позиции товаров в том же порядке)
+        self._sorted: Dict[str, Tuple[list, list]] = {}
+        # поле -> позиции товаров без значения (всегда идут в конце выдачи)
+        self._missing: Dict[str, list] = {}
+        # поле -> место каждого товара в отсортированном порядке (None - нет значения)
+        self._place: Dict[str, list] = {}
+
+        for field in set(NUMERIC_FIELDS) | set(SORT_FIELDS.values()):
+            pairs, missing = [], []
+            for pos, item in enumerate(self.items):
+                value = item.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    pairs.append((value, pos))
+                else:
+                    missing.append(pos)
+            pairs.sort()
+            self._sorted[field] = ([v for v, _ in pairs], [p for _, p in pairs])
+            self._missing[field] = missing
+            place = [None] * len(self.items)
+            for i, (_, pos) in enumerate(pairs):
+                place[pos] = i
+            self._place[field] = place
+
+    def _bounds(self, field: str, lo: Optional[float], hi: Optional[float]) -> Tuple[int, int]:
+        values, _ = self._sorted[field]
+        start = bisect_left(values, lo) if lo is not None else 0
+        end = bisect_right(values, hi) if hi is not None else len(values)
+        return start, max(start, end)
+
+    def range(self, field: str, lo: Optional[float] = None, hi: Optional[float] = None) -> list:
+        """Позиции товаров, у которых lo <= field <= hi (в порядке возрастания field)."""
+        start, end = self._bounds(field, lo, hi)
+        return self._sorted[field][1][start:end]
+
+    def order(self, field: str, descending: bool = False) -> list:
+        """Все позиции, отсортированные по field; товары без значения - в конце."""
+        return self._order_slice(field, descending, 0, None)
+
+    def _order_slice(self, field: str, descending: bool, offset: int, end: Optional[int]) -> list:
+        """Позиции offset..end порядка order(field, descending) без построения всего порядка."""
+        _, positions = self._sorted[field]
+        missing = self._missing[field]
+        n = len(positions)
+        stop = n + len(missing) if end is None else end
+        if descending:
+            head = positions[max(n - stop, 0):max(n - offset, 0)][::-1]
+        else:
+            head = positions[offset:stop]
+        return head + missing[max(offset - n, 0):max(stop - n, 0)]
+
+    def _matches(self, pos: int, field: str, lo: Optional[float], hi: Optional[float]) -> bool:
+        value = self.items[pos].get(field)
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return False
+        return (lo is None or value >= lo) and (hi is None or value <= hi)
+
+    def query(self, ranges: Dict[str, Tuple[Optional[float], Optional[float]]],
+              sort_by: Optional[str] = None, descending: bool = False,
+              offset: int = 0, limit: Optional[int] = None) -> Tuple[int, List[dict]]:
+        """
+        Фильтрует по диапазонам {поле: (lo, hi)}, сортирует и режет страницу.
+        Возвращает (общее число совпадений, товары страницы).
+
+        Без фильтров страница вырезается прямо из готового порядка. С фильтрами кандидаты
+        берутся из самого узкого диапазона и проверяются по остальным полям; если это
+        диапазон поля сортировки, кандидаты уже отсортированы.
+        """
+        sort_field = SORT_FIELDS[sort_by] if sort_by else None
+        end = offset + limit if limit is not None else None
+        filters = [(field, lo, hi) for field, (lo, hi) in ranges.items() if lo is not None or hi is not None]
+
+        if not filters:
+            if sort_field:
+                page = self._order_slice(sort_field, descending, offset, end)
+            else:
+                ordered = range(len(self.items))
+                page = (ordered[::-1] if descending else ordered)[offset:end]
+            return len(self.items), [self.items[pos] for pos in page]
+
+        bounds = {field: self._bounds(field, lo, hi) for field, lo, hi in filters}
+        narrowest = min(bounds, key=lambda field: bounds[field][1] - bounds[field][0])
+        start, stop = bounds[narrowest]
+        candidates = self._sorted[narrowest][1][start:stop]
+        others = [(field, lo, hi) for field, lo, hi in filters if field != narrowest]
+        if others:
+            candidates = [pos for pos in candidates
+                          if all(self._matches(pos, field, lo, hi) for field, lo, hi in others)]
+
+        if sort_field == narrowest:
+            ordered = candidates[::-1] if descending else candidates
+        elif sort_field:
+            place = self._place[sort_field]
+            # Товары без значения поля сортировки - в конце, в исходном порядке (как в order())
+            ordered = sorted(candidates, key=lambda pos: (0, -place[pos] if descending else place[pos])
+                             if place[pos] is not None else (1, pos))
+        else:
+            ordered = sorted(candidates, reverse=descending)
+        return len(candidates), [self.items[pos] for pos in ordered[offset:end]]
+
+
+class CategoryIndex:
+    """
+    Снимок бестселлеров, разложенный по категориям: порядок категорий, число товаров
+    и заранее сериализованный JSON каждой категории, чтобы отдавать одну категорию
+    или поток категорий без повторной сериализации на каждый запрос.
+    """
+
+    def __init__(self, data: Optional[dict]):
+        data = data if isinstance(data, dict) else {}
+        self.names: List[str] = list(data)
+        self.counts: Dict[str, int] = {name: len(products) for name, products in data.items()}
+        self.chunks: Dict[str, bytes] = {
+            name: json.dumps(products, ensure_ascii=False).encode("utf-8") for name, products in data.items()
+        }
+
+    def categories(self) -> List[dict]:
+        return [{"category": name, "count": self.counts[name]} for name in self.names]
+
+    def page(self, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        end = offset + limit if limit is not None else None
+        return self.names[offset:end]
@@ -0,0 +1,248 @@
+"""
+Общая очередь задач обхода на SQLite: несколько процессов (или узлов с общим томом)
+берут задачи в аренду, выполняют их и отмечают выполненными.
+
+Задача выдается одному воркеру на lease_s секунд. Если воркер упал и аренда истекла,
+задача снова выдается другому; после max_attempts неудачных попыток она считается
+проваленной. Отметка о выполнении принимается только от текущего арендатора, а сами
+результаты пишутся идемпотентно (по ключу), поэтому повторное выполнение задачи
+безопасно. Внутри запуска задача с тем же ключом ставится в очередь один раз.
+
+У задачи может быть раздел (partition, например площадка): воркер раздела берет только
+его задачи и задачи без раздела, так что медленный раздел не задерживает остальные.
+
+SQLite здесь - локальная замена общего брокера: интерфейс JobQueue не зависит от него,
+и для нескольких узлов без общего диска его можно реализовать поверх Redis или Postgres.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+QUEUE_DB = os.getenv("QUEUE_DB", "crawl_queue.db")
+# Сколько секунд задача принадлежит воркеру, прежде чем ее можно выдать снова
+QUEUE_LEASE_S = float(os.getenv("QUEUE_LEASE_S", "600"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+# Пауза перед повтором после ошибки (удваивается с каждой попыткой)
+QUEUE_RETRY_S = 30.0
+
+# Статусы задачи
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_runs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    key         TEXT NOT NULL UNIQUE,
+    params      TEXT NOT NULL DEFAULT '{}',
+    created_at  REAL NOT NULL,
+    finished_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id       INTEGER NOT NULL REFERENCES queue_runs (id),
+    kind         TEXT NOT NULL,
+    key          TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    priority     INTEGER NOT NULL DEFAULT 0,
+    status       TEXT NOT NULL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner  TEXT,
+    lease_until  REAL,
+    error        TEXT,
+    updated_at   REAL NOT NULL,
+    partition    TEXT NOT NULL DEFAULT '',
+    UNIQUE (run_id, key)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_ready ON tasks (status, priority, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_run ON tasks (run_id, status);
+"""
+
+
+class Task:
+    """Задача, выданная воркеру в аренду."""
+
+    __slots__ = ("id", "run_id", "kind", "key", "payload", "attempts", "max_attempts", "owner")
+
+    def __init__(self, row: sqlite3.Row, owner: str):
+        self.id = row["id"]
+        self.run_id = row["run_id"]
+        self.kind = row["kind"]
+        self.key = row["key"]
+        self.payload = json.loads(row["payload"])
+        self.attempts = row["attempts"] + 1
+        self.max_attempts = row["max_attempts"]
+        self.owner = owner
+
+
+class JobQueue:
+    """Очередь задач в файле SQLite; один объект можно использовать из нескольких потоков."""
+
+    def __init__(self, db_path: str = QUEUE_DB, lease_s: float = QUEUE_LEASE_S,
+                 max_attempts: int = QUEUE_MAX_ATTEMPTS, retry_s: float = QUEUE_RETRY_S, clock=time.time):
+        self.db_path = db_path
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.retry_s = retry_s
+        self._clock = clock
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Транзакции открываем сами (BEGIN IMMEDIATE), чтобы выдача задачи была атомарной между процессами
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            # Очереди, созданные до разделов: все их задачи - без раздела
+            if "partition" not in {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}:
+                conn.execute("ALTER TABLE tasks ADD COLUMN partition TEXT NOT NULL DEFAULT ''")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    # --- Запуски ---
+
+    def create_run(self, key: str, params: Optional[dict] = None) -> Optional[int]:
+        """Создает запуск с уникальным ключом; None, если такой запуск уже создан (другим координатором)."""
+        with self._transaction() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO queue_runs (key, params, created_at) VALUES (?, ?, ?)",
+                                  (key, json.dumps(params or {}), self._clock()))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def update_run_params(self, run_id: int, params: dict):
+        with self._transaction() as conn:
+            conn.execute("UPDATE queue_runs SET params = ? WHERE id = ?", (json.dumps(params), run_id))
+
+    def finish_run(self, run_id: int):
+        with self._transaction() as conn:
+            conn.execute("UPDATE queue_runs SET finished_at = ? WHERE id = ? AND finished_at IS NULL",
+                         (self._clock(), run_id))
+
+    def runs(self, active_only: bool = False, limit: int = 20) -> List[dict]:
+        """Последние запуски (новые первыми) с разбивкой задач по статусам."""
+        where = "WHERE finished_at IS NULL" if active_only else ""
+        rows = self._conn().execute(f"SELECT * FROM queue_runs {where} ORDER BY id DESC LIMIT ?", (limit,))
+        return [{"id": row["id"], "key": row["key"], "params": json.loads(row["params"]),
+                 "created_at": row["created_at"], "finished_at": row["finished_at"],
+                 "tasks": self.progress(row["id"])} for row in rows.fetchall()]
+
+    # --- Задачи ---
+
+    def enqueue(self, run_id: int, kind: str, key: str, payload: dict, priority: int = 0,
+                partition: str = "") -> bool:
+        """Ставит задачу в очередь; False, если задача с таким ключом в этом запуске уже есть."""
+        now = self._clock()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO tasks (run_id, kind, key, payload, priority, status, max_attempts, "
+                "available_at, updated_at, partition) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, kind, key, json.dumps(payload, ensure_ascii=False), priority, PENDING,
+                 self.max_attempts, now, now, partition))
+            return cursor.rowcount == 1
+
+    def lease(self, owner: str, lease_s: Optional[float] = None, partition: Optional[str] = None) -> Optional[Task]:
+        """
+        Выдает воркеру owner следующую готовую задачу (с наибольшим приоритетом) или None.
+        partition - брать только задачи этого раздела и задачи без раздела (None - любые).
+        Задачи с истекшей арендой выдаются снова; если попытки кончились - помечаются проваленными.
+        """
+        lease_s = lease_s or self.lease_s
+        where, args = "", ()
+        if partition is not None:
+            where, args = " AND partition IN (?, '')", (partition,)
+        with self._transaction() as conn:
+            while True:
+                now = self._clock()
+                row = conn.execute(
+                    "SELECT * FROM tasks WHERE ((status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?))"
+                    f"{where} ORDER BY priority DESC, id LIMIT 1", (PENDING, now, LEASED, now) + args).fetchone()
+                if row is None:
+                    return None
+                if row["status"] == LEASED and row["attempts"] >= row["max_attempts"]:
+                    conn.execute("UPDATE tasks SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                                 (FAILED, f"lease of {row['lease_owner']} expired", now, row["id"]))
+                    continue
+                conn.execute(
+                    "UPDATE tasks SET status = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE id = ?", (LEASED, owner, now + lease_s, now, row["id"]))
+                return Task(row, owner)
+
+    def extend(self, task: Task, lease_s: Optional[float] = None) -> bool:
+        """Продлевает аренду долгой задачи; False, если задача уже выдана другому воркеру."""
+        now = self._clock()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_until = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                (now + (lease_s or self.lease_s), now, task.id, LEASED, task.owner))
+            return cursor.rowcount == 1
+
+    def complete(self, task: Task) -> bool:
+        """Отмечает задачу выполненной; False, если аренда уже перешла к другому воркеру."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, error = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (DONE, self._clock(), task.id, LEASED, task.owner))
+            return cursor.rowcount == 1
+
+    def fail(self, task: Task, error: str) -> Optional[str]:
+        """
+        Неудачная попытка: задача вернется в очередь после паузы или, если попытки кончились,
+        будет помечена проваленной. Возвращает новый статус (None, если аренда уже не наша).
+        """
+        now = self._clock()
+        status = FAILED if task.attempts >= task.max_attempts else PENDING
+        retry_at = now + self.retry_s * 2 ** (task.attempts - 1)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, error = ?, available_at = ?, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (status, error[:500], retry_at, now, task.id, LEASED, task.owner))
+            return status if cursor.rowcount == 1 else None
+
+    def progress(self, run_id: int) -> Dict[str, int]:
+        """Число задач запуска по статусам и всего."""
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for row in self._conn().execute("SELECT status, COUNT(*) AS n FROM tasks WHERE run_id = ? GROUP BY status",
+                                        (run_id,)):
+            counts[row["status"]] = row["n"]
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def is_drained(self, run_id: int) -> bool:
+        """В запуске не осталось задач, которые еще могут быть выполнены."""
+        progress = self.progress(run_id)
+        return progress[PENDING] == 0 and progress[LEASED] == 0
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK: запись сразу берет блокировку файла, без гонки между процессами."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,84 @@
+"""
+Профили площадок Amazon: адрес сайта, валюта, формат чисел и локализованные подписи,
+по которым находятся элементы страниц ("See More" на странице бестселлеров,
+"Best Sellers Rank" на странице товара). Разметка страниц на всех площадках одна,
+отличаются только подписи и формат цен и рейтингов.
+
+MARKETPLACE - площадка по умолчанию (для парсеров и API без параметра marketplace),
+MARKETPLACES - площадки, которые обходятся по расписанию: "us,de,uk,jp".
+"""
+import os
+import re
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+
+class Marketplace:
+    """Профиль одной площадки."""
+
+    def __init__(self, code: str, base_url: str, currency: str, accept_language: str,
+                 decimal_sep: str = ".", see_more_labels: Sequence[str] = ("See More",),
+                 bsr_labels: Sequence[str] = ("Best Sellers Rank",), rating_pattern: Optional[str] = None):
+        self.code = code
+        self.base_url = base_url
+        self.host = urlsplit(base_url).netloc
+        self.currency = currency
+        self.accept_language = accept_language
+        # Разделитель дробной части в ценах и рейтингах ("19,99 €", "4,5 von 5 Sternen")
+        self.decimal_sep = decimal_sep
+        # Подписи, по которым ищутся ссылка на категорию и строка BSR; английские - запасной вариант
+        self.see_more_labels = tuple(see_more_labels)
+        self.bsr_labels = tuple(bsr_labels)
+        # Где в строке рейтинга сама оценка, если она не первое число ("5つ星のうち4.5")
+        self.rating_re = re.compile(rating_pattern) if rating_pattern else None
+
+    def product_key(self, asin: Optional[str]) -> Optional[str]:
+        """Ключ товара в кэше: один ASIN на разных площадках - разные цены и рейтинги."""
+        # Ключи amazon.com остаются без префикса, как до появления других площадок
+        if not asin or self.code == "us":
+            return asin
+        return f"{self.code}:{asin}"
+
+    def filename(self, name: str) -> str:
+        """Файл состояния запуска этой площадки: "bestsellers.ndjson" -> "bestsellers.de.ndjson"."""
+        if self.code == "us":
+            return name
+        stem, ext = os.path.splitext(name)
+        return f"{stem}.{self.code}{ext}"
+
+    def to_dict(self) -> dict:
+        return {"code": self.code, "base_url": self.base_url, "currency": self.currency}
+
+
+MARKETPLACE_PROFILES: Dict[str, Marketplace] = {m.code: m for m in (
+    Marketplace("us", "https://www.amazon.com", "USD", "en-US,en;q=0.9"),
+    Marketplace("uk", "https://www.amazon.co.uk", "GBP", "en-GB,en;q=0.9"),
+    Marketplace("de", "https://www.amazon.de", "EUR", "de-DE,de;q=0.9,en;q=0.5", decimal_sep=",",
+                see_more_labels=("Mehr anzeigen", "Mehr ansehen", "See More"),
+                bsr_labels=("Amazon Bestseller-Rang", "Bestseller-Rang", "Best Sellers Rank")),
+    Marketplace("jp", "https://www.amazon.co.jp", "JPY", "ja-JP,ja;q=0.9,en;q=0.5",
+                see_more_labels=("もっと見る", "See More"),
+                bsr_labels=("Amazon 売れ筋ランキング", "売れ筋ランキング", "Best Sellers Rank"),
+                rating_pattern=r"うち\s*(\d+(?:\.\d+)?)"),
+)}
+
+MARKETPLACE = os.getenv("MARKETPLACE", "us")
+MARKETPLACES: List[str] = [code.strip() for code in os.getenv("MARKETPLACES", MARKETPLACE).split(",") if code.strip()]
+
+
+def get_marketplace(code: Optional[str] = None) -> Marketplace:
+    """Профиль площадки по коду (None - площадка по умолчанию); ValueError для неизвестного кода."""
+    code = code or MARKETPLACE
+    try:
+        return MARKETPLACE_PROFILES[code]
+    except KeyError:
+        raise ValueError(f"Unknown marketplace '{code}', expected one of: {', '.join(MARKETPLACE_PROFILES)}")
+
+
+def marketplace_for_url(url: str) -> Optional[Marketplace]:
+    """Площадка, которой принадлежит ссылка (None для чужих хостов, например fixture_server)."""
+    host = urlsplit(url or "").netloc.lower()
+    for marketplace in MARKETPLACE_PROFILES.values():
+        if host == marketplace.host or host == marketplace.host[len("www."):]:
+            return marketplace
+    return None
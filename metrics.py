@@ -0,0 +1,331 @@
+"""
+Метрики парсеров и API в текстовом формате Prometheus - без сторонних библиотек.
+
+Все метрики живут в одном реестре процесса (REGISTRY) и отдаются эндпоинтом /metrics.
+Отчет одного запуска (RunReport) дополнительно копит наблюдения потоков этого запуска,
+поэтому код этапов ничего не знает о запусках: он просто оборачивает работу
+в stage("...") и увеличивает счетчики.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from snapshot_store import write_json_atomic
+
+# Куда складываются JSON-отчеты запусков
+RUN_REPORT_DIR = os.getenv("RUN_REPORT_DIR", "run_reports")
+
+# Отчет запуска, к которому относятся наблюдения текущего потока (см. RunReport, in_run)
+_current = threading.local()
+
+# Границы корзин гистограмм длительности (секунды): от разбора страницы до старта Chrome
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: dict) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> str:
+        return f"# HELP {self.name} {_escape(self.help)}\n# TYPE {self.name} {self.kind}\n"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        report = getattr(_current, "report", None)
+        if report is not None:
+            report.record(self, key, amount)
+
+    def snapshot(self) -> Dict[Tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> str:
+        lines = [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                 for key, value in sorted(self.snapshot().items())]
+        return self.header() + "".join(line + "\n" for line in lines)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self.new_state()
+            self.add(state, value)
+        report = getattr(_current, "report", None)
+        if report is not None:
+            report.record(self, key, value)
+
+    def new_state(self) -> dict:
+        # Счетчики по корзинам (последняя - +Inf), сумма и количество наблюдений
+        return {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+
+    def add(self, state: dict, value: float):
+        state["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+        state["sum"] += value
+        state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[Tuple, dict]:
+        with self._lock:
+            return {key: {"buckets": list(state["buckets"]), "sum": state["sum"], "count": state["count"]}
+                    for key, state in self._values.items()}
+
+    def render(self) -> str:
+        lines = []
+        for key, state in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state["buckets"]):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return self.header() + "".join(line + "\n" for line in lines)
+
+    def quantile(self, q: float, state: dict) -> Optional[float]:
+        """Оценка квантиля по корзинам (верхняя граница корзины, как histogram_quantile без интерполяции)."""
+        if not state["count"]:
+            return None
+        rank, cumulative = q * state["count"], 0
+        for bound, count in zip(self.buckets + (float("inf"),), state["buckets"]):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+class Registry:
+    """Все метрики процесса в порядке регистрации."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+# --- Метрики парсеров ---
+STAGE_SECONDS = REGISTRY.histogram(
+    "amazon_parser_stage_seconds",
+    "Time spent in each crawl stage (chrome_startup, warm_up, http_get, driver_get, sleep, page_source, parse, write).",
+    ["stage"])
+PAGES = REGISTRY.counter(
+    "amazon_parser_pages_total",
+    "Page fetches by page kind, source (http/selenium) and outcome (success, not_modified, captcha, blocked, error).",
+    ["kind", "source", "outcome"])
+SELECTOR_MISSES = REGISTRY.counter(
+    "amazon_parser_selector_misses_total",
+    "Pages that loaded but did not contain an expected element.", ["page", "element"])
+# Только категории верхнего уровня: подкатегорий тысячи, и набор меток рос бы без предела
+CATEGORY_ITEMS = REGISTRY.gauge(
+    "amazon_parser_category_items", "Items collected for each top-level category in the last crawl of a marketplace.",
+    ["marketplace", "category"])
+RUNS = REGISTRY.counter("amazon_parser_runs_total", "Finished parser runs by parser and result.",
+                        ["parser", "result"])
+RUN_SECONDS = REGISTRY.histogram("amazon_parser_run_seconds", "Duration of whole parser runs.", ["parser"],
+                                 buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200))
+QUEUE_TASKS = REGISTRY.counter(
+    "amazon_queue_tasks_total",
+    "Distributed crawl tasks handled by this process, by kind and outcome (done, retry, failed, lease_lost).",
+    ["kind", "outcome"])
+
+# --- Метрики API ---
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "amazon_api_request_seconds", "API request latency until the response headers are sent.",
+    ["method", "route", "status"])
+# Состояние долгоживущих объектов процесса API, обновляется при каждом запросе /metrics
+DRIVER_POOL = REGISTRY.gauge("amazon_driver_pool", "Driver pool counters (started, reused, recycled, idle, in_use).",
+                             ["field"])
+PRODUCT_CACHE = REGISTRY.gauge("amazon_product_cache", "Product cache counters and hit ratio.", ["field"])
+HOST_RATE = REGISTRY.gauge("amazon_rate_limit_rps", "Current request rate allowed for each host.", ["host"])
+PARSER_RUNNING = REGISTRY.gauge("amazon_parser_running", "1 while a parser job is running.")
+
+
+def stage(name: str):
+    """Контекстный менеджер: время блока попадает в гистограмму этапа name."""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+
+
+class RunReport:
+    """
+    Отчет одного запуска парсера: этапы, исходы загрузок и промахи селекторов
+    за время запуска плюс то, что передал сам парсер.
+    В отчет попадают только наблюдения потоков запуска: потока, создавшего отчет, и потоков,
+    чьи функции обернуты в in_run. Воркеры очереди (distributed_crawl) и другие запуски
+    в том же процессе считаются только в общем реестре.
+    """
+
+    _TRACKED = (STAGE_SECONDS, PAGES, SELECTOR_MISSES)
+
+    def __init__(self, parser: str):
+        self.parser = parser
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[Tuple, object]] = {metric.name: {} for metric in self._TRACKED}
+        self._thread = threading.get_ident()
+        self._previous = getattr(_current, "report", None)
+        _current.report = self
+
+    def record(self, metric: _Metric, key: Tuple, value: float):
+        """Наблюдение метрики metric из потока запуска."""
+        values = self._values.get(metric.name)
+        if values is None:
+            return
+        with self._lock:
+            if isinstance(metric, Histogram):
+                state = values.get(key)
+                if state is None:
+                    state = values[key] = metric.new_state()
+                metric.add(state, value)
+            else:
+                values[key] = values.get(key, 0) + value
+
+    def finish(self, result: str, **extra) -> dict:
+        """Закрывает запуск: обновляет метрики запусков и возвращает отчет (dict для JSON)."""
+        if threading.get_ident() == self._thread:
+            _current.report = self._previous
+        duration = time.perf_counter() - self._started
+        RUNS.inc(parser=self.parser, result=result)
+        RUN_SECONDS.observe(duration, parser=self.parser)
+
+        with self._lock:
+            values = {name: dict(metric_values) for name, metric_values in self._values.items()}
+        stages = {}
+        for key, state in values[STAGE_SECONDS.name].items():
+            stages[key[0]] = {
+                "count": state["count"], "total_s": round(state["sum"], 3),
+                "mean_s": round(state["sum"] / state["count"], 4),
+                "p95_le_s": STAGE_SECONDS.quantile(0.95, state),
+            }
+        pages: Dict[str, Dict[str, float]] = {}
+        for (kind, source, outcome), value in values[PAGES.name].items():
+            pages.setdefault(kind, {})[f"{source}.{outcome}"] = value
+        misses = {f"{page}.{element}": value for (page, element), value in values[SELECTOR_MISSES.name].items()}
+        return {
+            "parser": self.parser, "result": result,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "duration_s": round(duration, 1),
+            "stages": stages, "pages": pages, "selector_misses": misses, **extra,
+        }
+
+
+def in_run(fn):
+    """
+    Оборачивает fn для пула потоков: ее наблюдения относятся к запуску (RunReport)
+    потока, который вызвал in_run.
+    """
+    report = getattr(_current, "report", None)
+
+    def run(*args, **kwargs):
+        previous = getattr(_current, "report", None)
+        _current.report = report
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.report = previous
+
+    return run
+
+
+def write_run_report(report: dict, directory: str = RUN_REPORT_DIR) -> Optional[str]:
+    """Сохраняет отчет запуска в directory/<parser>_<время>.json; возвращает путь (None при ошибке)."""
+    stamp = report.get("started_at", "").replace(":", "").replace("-", "")
+    filename = os.path.join(directory, f"{report['parser']}_{stamp}.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        write_json_atomic(filename, report)
+    except OSError as e:
+        print(f"[WARN] Could not write run report {filename}: {e}")
+        return None
+    return filename
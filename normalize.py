@@ -0,0 +1,120 @@
+import re
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from marketplaces import Marketplace
+
+_ASIN_RE = re.compile(r"/(?:dp|gp/product)/([A-Z0-9]{10})")
+
+# Изменчивые части ссылок Amazon: /ref=... до конца пути и идентификатор сессии
+_REF_RE = re.compile(r"/ref=.*$")
+_SESSION_RE = re.compile(r"/\d{3}-\d{7}-\d{7}")
+_ZGBS_RE = re.compile(r"/(?:zgbs|gp/bestsellers)/(.+)$")
+# Параметры запроса, которые меняют содержимое страницы (остальные - трекинг)
+_KEPT_PARAMS = ("pg",)
+
+# Первое число в строке: "4.4 out of 5 stars", "406,573 ratings", "#1 in Home & Kitchen", "1.024,99 €"
+_NUMBER_RE = re.compile(r"\d(?:[\d.,]*\d)?")
+
+
+def _first_number(value, marketplace: Optional[Marketplace] = None, pattern=_NUMBER_RE) -> Optional[float]:
+    """
+    Первое число в строке в формате площадки marketplace (по умолчанию "1,024.99").
+    pattern - где искать число (группа 1, если она есть).
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = pattern.search(str(value))
+    if not match:
+        return None
+    decimal_sep = marketplace.decimal_sep if marketplace is not None else "."
+    thousands_sep = "." if decimal_sep == "," else ","
+    number = match.group(match.lastindex or 0).replace(thousands_sep, "").replace(decimal_sep, ".")
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def parse_price(value, marketplace: Optional[Marketplace] = None) -> Optional[float]:
+    """"$1,024.99" -> 1024.99, "1.024,99 €" (de) -> 1024.99, "N/A" -> None."""
+    return _first_number(value, marketplace)
+
+
+def parse_rating(value, marketplace: Optional[Marketplace] = None) -> Optional[float]:
+    """"4.4 out of 5 stars" -> 4.4, "4,5 von 5 Sternen" (de) -> 4.5, "5つ星のうち4.5" (jp) -> 4.5."""
+    if marketplace is not None and marketplace.rating_re is not None:
+        return _first_number(value, marketplace, marketplace.rating_re)
+    return _first_number(value, marketplace)
+
+
+def parse_count(value, marketplace: Optional[Marketplace] = None) -> Optional[int]:
+    """"406,573 ratings" -> 406573."""
+    number = _first_number(value, marketplace)
+    return int(number) if number is not None else None
+
+
+def parse_bsr(value, marketplace: Optional[Marketplace] = None) -> Optional[int]:
+    """"#1 in Home & Kitchen" -> 1."""
+    number = _first_number(value, marketplace)
+    return int(number) if number is not None else None
+
+
+def extract_asin(url) -> Optional[str]:
+    """"https://www.amazon.com/x/dp/B01M16WBW1/ref=..." -> "B01M16WBW1"."""
+    match = _ASIN_RE.search(url or "")
+    return match.group(1) if match else None
+
+
+def canonical_url(url: str) -> str:
+    """
+    Ссылка без трекинга: без /ref=..., идентификатора сессии и лишних параметров.
+    Ссылка на товар сводится к https://host/dp/ASIN.
+    """
+    parts = urlsplit(url or "")
+    asin = extract_asin(parts.path)
+    if asin:
+        return urlunsplit((parts.scheme, parts.netloc, f"/dp/{asin}", "", ""))
+    path = _SESSION_RE.sub("", _REF_RE.sub("", parts.path)).rstrip("/") or "/"
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k in _KEPT_PARAMS])
+    return urlunsplit((parts.scheme, parts.netloc, path, query, ""))
+
+
+def url_key(url: str) -> str:
+    """
+    Ключ страницы для дедупликации: "asin:B01M16WBW1" для товара, "zgbs:electronics/281407"
+    для категории бестселлеров (одна и та же категория бывает под разными slug), иначе каноническая ссылка.
+    """
+    canonical = canonical_url(url)
+    asin = extract_asin(canonical)
+    if asin:
+        return f"asin:{asin}"
+    path = urlsplit(canonical).path
+    match = _ZGBS_RE.search(path)
+    return f"zgbs:{match.group(1)}" if match else canonical
+
+
+# Типизированные поля, которые добавляются к каждому товару при загрузке:
+# имя нового поля -> (исходное поле, функция разбора)
+NUMERIC_FIELDS = {
+    "price_value": ("price", parse_price),
+    "list_price_value": ("list_price", parse_price),
+    "rating_value": ("rating", parse_rating),
+    "reviews_count_value": ("reviews_count", parse_count),
+    "bsr_value": ("best_sellers_rank", parse_bsr),
+}
+
+
+def normalize_item(item: dict, marketplace: Optional[Marketplace] = None) -> dict:
+    """
+    Возвращает копию товара с заполненными числовыми полями *_value (в формате чисел
+    площадки marketplace) и, если площадка указана, валютой цен currency.
+    """
+    normalized = dict(item)
+    for field, (source, parse) in NUMERIC_FIELDS.items():
+        normalized[field] = parse(item.get(source), marketplace)
+    if marketplace is not None:
+        normalized["currency"] = marketplace.currency
+    return normalized
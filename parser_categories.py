@@ -1,18 +1,43 @@
+import os
 import time
-import json
-import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import undetected_chromedriver as uc
-from bs4 import BeautifulSoup
 from fake_useragent import UserAgent
+import storage
+import metrics
+from extractors import (parse_html, extract_categories, extract_category_cards, count_category_cards,
+                        count_listed_products, extract_subcategories)
+from crawl_frontier import CrawlFrontier, FRONTIER_FILE
+from marketplaces import get_marketplace
+from normalize import parse_bsr, extract_asin
+from fetch_records import FetchRecords, CRAWL_STATE_FILE
+from snapshot_store import NdjsonWriter, read_ndjson
+from rate_limiter import RateLimiter
+from product_cache import ProductCache
+from fetchers import (HttpFetcher, SeleniumFetcher, FallbackFetcher, BESTSELLERS_PAGE, CATEGORY_PAGE,
+                      AMAZON_BASE_URL, CATEGORY_PAGE_SIZE, category_page_url)
 
+# Количество параллельных браузеров на этапе обхода категорий
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", "1"))
+# Сколько товаров собирать в каждой категории (Amazon показывает топ-100 на двух страницах)
+CATEGORY_ITEM_LIMIT = int(os.getenv("CATEGORY_ITEM_LIMIT", "100"))
+# NDJSON-снимок последнего запуска: одна строка {"category", "products"} на категорию
+BESTSELLERS_NDJSON = "bestsellers.ndjson"
 
-def run_parser():
-    """
-    Основная функция парсера, которая собирает данные и сохраняет их в JSON.
-    Возвращает True в случае успеха и False в случае ошибки.
-    """
-    scraped_data = {}
+# Статистика последнего запуска по каждому воркеру (для выбора числа воркеров)
+last_run_stats = []
+# Итоги последнего запуска: сколько страниц пропущено и сколько категорий изменилось,
+# время по этапам и исходы загрузок (metrics.RunReport); копия пишется в RUN_REPORT_DIR
+last_run_report = {}
+
+# undetected_chromedriver патчит бинарник chromedriver при старте,
+# поэтому браузеры создаем строго по одному
+_driver_start_lock = threading.Lock()
 
+
+def create_chrome():
+    """Создает headless-экземпляр Chrome со случайным User-Agent."""
     options = uc.ChromeOptions()
     ua = UserAgent(platforms='pc')
     user_agent = ua.random
@@ -21,114 +46,405 @@ def run_parser():
     # Включаем headless режим для фоновой работы на сервере
     options.add_argument('--headless')
 
-    driver = None  # Объявляем заранее, чтобы использовать в finally
-    try:
+    with _driver_start_lock, metrics.stage("chrome_startup"):
         driver = uc.Chrome(options=options)
-        driver.maximize_window()
+    driver.maximize_window()
+    return driver
 
-        # --- ЭТАП 1: Динамический сбор категорий ---
-        main_url = "https://www.amazon.com/gp/bestsellers"
-        print(f"ЭТАП 1: Захожу на главную страницу для сбора ссылок: {main_url}")
-        driver.get(main_url)
-        time.sleep(random.uniform(5, 8))
 
-        print("...Прокручиваю страницу для загрузки всех блоков...")
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(random.uniform(2, 4))
+def collect_categories(fetcher, base_url=AMAZON_BASE_URL, marketplace=None):
+    """ЭТАП 1: собирает названия и ссылки категорий с главной страницы бестселлеров площадки marketplace."""
+    main_url = base_url + "/gp/bestsellers"
+    print(f"ЭТАП 1: Захожу на главную страницу для сбора ссылок: {main_url}")
+    # Список категорий нужен всегда, поэтому без условного запроса
+    page = fetcher.fetch(main_url, BESTSELLERS_PAGE, force=True)
 
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
+    categories_to_parse = extract_categories(page.text, base_url, marketplace)
+    print(f"...Найдено {len(categories_to_parse)} категорий со ссылками.")
+    for category in categories_to_parse:
+        print(f"  ✅ Найдена категория: '{category['name']}'")
 
-        categories_to_parse = []
-        category_headers = soup.select('div.a-carousel-header-row')
+    return categories_to_parse
 
-        print(f"...Найдено {len(category_headers)} блоков категорий. Собираю ссылки...")
-        for header_block in category_headers:
-            category_name_element = header_block.select_one('h2.a-carousel-heading')
-            see_more_link_element = header_block.select_one('a[aria-label*="See More"]')
 
-            if category_name_element and see_more_link_element:
-                name = category_name_element.get_text(strip=True)
-                url = "https://www.amazon.com" + see_more_link_element['href']
-                categories_to_parse.append({'name': name, 'url': url})
-                print(f"  ✅ Найдена категория: '{name}'")
+def parse_category_page(page_source, cat_name, limit=CATEGORY_ITEM_LIMIT, base_url=AMAZON_BASE_URL):
+    """
+    Разбирает страницу категории (HTML или уже разобранное дерево - один раз)
+    и возвращает список первых limit товаров.
+    """
+    tree = parse_html(page_source) if isinstance(page_source, str) else page_source
 
-        if not categories_to_parse:
-            print("\nНе удалось собрать ни одной категории. Прекращаю работу.")
-            return False
+    products_in_category = extract_category_cards(tree, base_url, limit=limit)
+    if products_in_category is None:
+        print(f"  ❌ Не удалось найти общий список товаров для '{cat_name}'.")
+        metrics.SELECTOR_MISSES.inc(page="category", element="product_list")
+        return []
+
+    cards_count = count_category_cards(tree)
+    if not cards_count:
+        print(f"  ❌ Не удалось найти карточки товаров для '{cat_name}'.")
+        metrics.SELECTOR_MISSES.inc(page="category", element="cards")
+        return []
+
+    print(f"  ✅ Найдено {cards_count} карточек. Собираю данные о первых {min(cards_count, limit)}.")
+    return products_in_category
+
+
+def scrape_category(fetcher, category, previous, limit, stats, want_children=False, base_url=AMAZON_BASE_URL,
+                    kept_pages=None):
+    """
+    Собирает до limit товаров категории постранично (?pg=2, ...), держа в памяти
+    одно разобранное дерево за раз. Страница, не изменившаяся с прошлого запуска,
+    берется из previous. Если HTTP-ответ содержит только часть карточек (остальные
+    подгружаются при прокрутке), страница загружается браузером с прокруткой.
+    want_children - заодно собрать подкатегории из навигации первой страницы.
+    kept_pages - список, куда добавляются адреса страниц, товары которых вошли в результат
+    (их загрузки подтверждаются в журнале, когда данные сохранены).
+    Возвращает (товары, число пропущенных страниц, число загруженных страниц,
+    подкатегории или None, если страница не загружалась заново - ответ 304).
+    """
+    cat_name = category['name']
+    previous = previous or []
+    products, skipped, pages, children = [], 0, 0, None
+    for page_no in range(1, -(-limit // CATEGORY_PAGE_SIZE) + 1):
+        url = category_page_url(category['url'], page_no)
+        remaining = limit - len(products)
+        first_rank = (page_no - 1) * CATEGORY_PAGE_SIZE + 1
+        previous_page = [p for p in previous
+                         if first_rank <= (parse_bsr(p.get("rank")) or 0) < first_rank + CATEGORY_PAGE_SIZE]
+        # Прошлые данные страницы годятся, если их хватает или за ними в прошлом запуске шли
+        # следующие страницы (иначе страница могла быть обрезана меньшим лимитом)
+        reusable = bool(previous_page) and (len(previous_page) >= remaining or previous_page[-1] is not previous[-1])
+
+        page = fetcher.fetch(url, CATEGORY_PAGE)
+        if page.unchanged and not reusable:
+            # Страница не менялась, но прошлых данных нет - нужен полный ответ
+            page = fetcher.fetch(url, CATEGORY_PAGE, force=True)
+        stats["load_s"] += page.elapsed
+        pages += 1
+
+        if page.unchanged and reusable:
+            skipped += 1
+            page_products = previous_page
+            if want_children and page_no == 1 and page.status != 304:
+                children = extract_subcategories(page.text, base_url)
+        else:
+            t0 = time.perf_counter()
+            tree = parse_html(page.text)
+            if page.source == "http" and fetcher.browser is not None \
+                    and count_listed_products(tree) > count_category_cards(tree):
+                print(f"  ...в HTTP-ответе только часть карточек, догружаю страницу {page_no} прокруткой в браузере")
+                page = fetcher.fetch(url, CATEGORY_PAGE, force=True, use_browser=True)
+                stats["load_s"] += page.elapsed
+                # Загрузка браузером - это не разбор: из времени разбора ее исключаем
+                t0 += page.elapsed
+                tree = parse_html(page.text)
+            page_products = parse_category_page(tree, cat_name, remaining, base_url)
+            if want_children and page_no == 1:
+                children = extract_subcategories(tree, base_url)
+            del tree
+            parse_s = time.perf_counter() - t0
+            stats["parse_s"] += parse_s
+            metrics.observe_stage("parse", parse_s)
+
+        products.extend(page_products[:remaining])
+        if page_products and kept_pages is not None:
+            kept_pages.append(url)
+        if not page_products or len(products) >= limit:
+            break
+    return products, skipped, pages, children
+
+
+class _CrawlRun:
+    """Общее состояние одного запуска, которое делят между собой воркеры."""
+
+    def __init__(self, frontier, previous_data, records, limiter, journal, progress=None, cancel_event=None,
+                 driver_pool=None, item_limit=CATEGORY_ITEM_LIMIT, product_cache=None, base_url=AMAZON_BASE_URL,
+                 marketplace=None):
+        self.frontier = frontier
+        self.previous_data = previous_data
+        self.records = records
+        self.limiter = limiter
+        self.journal = journal
+        self.scraped_data = {}
+        self.changed = set()
+        # Страницы, чьи товары попали в scraped_data: их загрузки подтверждаются после записи в БД
+        self.kept_pages = []
+        self.lock = threading.Lock()
+        self.progress = progress or (lambda event: None)
+        self.cancel_event = cancel_event or threading.Event()
+        self.driver_pool = driver_pool
+        self.item_limit = item_limit
+        self.product_cache = product_cache
+        self.base_url = base_url
+        self.marketplace = marketplace or get_marketplace()
+
+
+def make_browser(driver_pool=None):
+    """Браузер для фолбэка: сессия из общего пула, если он есть, иначе свой ленивый Chrome."""
+    if driver_pool is not None:
+        return SeleniumFetcher(pool=driver_pool)
+    return SeleniumFetcher(driver_factory=create_chrome)
+
+
+def _category_worker(worker_id, fetcher, http, run):
+    """
+    ЭТАП 2 для одного воркера: забирает категории из общего frontier, пока обход не закончится,
+    и добавляет туда найденные подкатегории (в пределах лимита глубины).
+    Паузы между запросами выдерживает общий для всех воркеров RateLimiter, у каждого воркера
+    свой (ленивый) браузер для фолбэка.
+    Страницы, содержимое которых не изменилось с прошлого запуска, не разбираются заново.
+    Возвращает статистику по времени.
+    """
+    stats = {
+        "worker": worker_id, "categories": 0, "failed": 0, "items": 0, "skipped": 0,
+        "startup_s": 0.0, "load_s": 0.0, "sleep_s": 0.0, "parse_s": 0.0, "total_s": 0.0,
+    }
+    started = time.perf_counter()
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        fetcher = FallbackFetcher(http, make_browser(run.driver_pool), records=run.records,
+                                  limiter=run.limiter, cancel_event=run.cancel_event)
+    try:
+        while not run.cancel_event.is_set():
+            category = run.frontier.pop(run.cancel_event)
+            if category is None:
+                break
 
-        # --- ЭТАП 2: Парсинг страниц категорий ---
-        print("\nЭТАП 2: Начинаю обход страниц категорий...")
-        for category in categories_to_parse:
             cat_name = category['name']
-            cat_url = category['url']
-
-            print(f"\n--- Обрабатываю категорию: '{cat_name}' ---")
-            driver.get(cat_url)
-            delay = random.uniform(8, 13)
-            print(f"  ...делаю паузу на {delay:.2f} сек...")
-            time.sleep(delay)
-
-            page_soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-            product_list = page_soup.select_one('ol.a-ordered-list')
-            if not product_list:
-                print(f"  ❌ Не удалось найти общий список товаров для '{cat_name}'.")
-                continue
-
-            product_cards = product_list.select('li.zg-no-numbers')
-            if not product_cards:
-                print(f"  ❌ Не удалось найти карточки товаров для '{cat_name}'.")
-                continue
-
-            products_in_category = []
-            print(f"  ✅ Найдено {len(product_cards)} карточек. Собираю данные о первых 5.")
-
-            for card in product_cards[:5]:
-                try:
-                    link_tag = card.select_one('a.a-link-normal')
-                    product_url = "https://www.amazon.com" + link_tag['href'] if link_tag else None
-                    rank = card.select_one('span.zg-bdg-text').get_text(strip=True)
-                    title = card.select_one('div[class*="_cDEzb_p13n-sc-css-line-clamp-"]').get_text(strip=True)
-                    image_url = card.select_one('img')['src']
-                    rating = card.select_one('span.a-icon-alt').get_text(strip=True)
-                    reviews_count = card.select_one('span.a-size-small').get_text(strip=True)
-
-                    price_element = card.select_one('span._cDEzb_p13n-sc-price_3mJ9Z')
-                    if price_element:
-                        price = price_element.get_text(strip=True)
-                    else:
-                        offer_price_element = card.select_one('span.p13n-sc-price')
-                        price = offer_price_element.get_text(strip=True) if offer_price_element else 'N/A'
-
-                    products_in_category.append({
-                        "rank": rank, "title": title, "url": product_url,
-                        "image_url": image_url, "rating": rating,
-                        "reviews_count": reviews_count, "price": price
-                    })
-                except Exception:
-                    continue
+            previous = run.previous_data.get(cat_name)
+            print(f"\n--- [W{worker_id}] Обрабатываю категорию: '{cat_name}' (глубина {category['depth']}) ---")
+            run.progress({"event": "category_started", "category": cat_name, "worker": worker_id})
+            skipped, children, kept_pages = False, None, []
+            try:
+                products_in_category, skipped_pages, pages, children = scrape_category(
+                    fetcher, category, previous, run.item_limit, stats,
+                    want_children=category['depth'] < run.frontier.max_depth, base_url=run.base_url,
+                    kept_pages=kept_pages)
+                if skipped_pages:
+                    print(f"  ⏭️ [W{worker_id}] Без изменений страниц: {skipped_pages} из {pages}, "
+                          f"беру их данные из прошлого запуска.")
+                stats["skipped"] += skipped_pages
+                skipped = skipped_pages == pages
+                # Цены и рейтинги с карточек освежают кэш товаров - parser_selenium не будет грузить их страницы
+                run.product_cache.update_prices(
+                    products_in_category, lambda card: run.marketplace.product_key(extract_asin(card.get("url"))))
+            except Exception as e:
+                print(f"  ❌ [W{worker_id}] Ошибка при обработке '{cat_name}': {e}")
+                products_in_category = []
 
+            stats["categories"] += 1
             if products_in_category:
-                scraped_data[cat_name] = products_in_category
-                print(f"  👍 Собрал информацию о {len(products_in_category)} товарах.")
+                with run.lock:
+                    run.scraped_data[cat_name] = products_in_category
+                    run.kept_pages.extend(kept_pages)
+                    if products_in_category != previous:
+                        run.changed.add(cat_name)
+                # Категория попадает в журнал сразу - падение позже ее не потеряет
+                with metrics.stage("write"):
+                    run.journal.append({"category": cat_name, "products": products_in_category})
+                stats["items"] += len(products_in_category)
+                if category['depth'] == 0:
+                    metrics.CATEGORY_ITEMS.set(len(products_in_category), marketplace=run.marketplace.code,
+                                               category=cat_name)
+                print(f"  👍 [W{worker_id}] Собрал информацию о {len(products_in_category)} товарах.")
+            else:
+                stats["failed"] += 1
+            # Отмечаем категорию в frontier только после записи в журнал: при падении она будет обработана снова
+            if run.frontier.done(category, children):
+                print(f"  🌿 [W{worker_id}] Найдены подкатегории, всего категорий в обходе: {run.frontier.total}")
+                run.progress({"event": "categories_found", "total": run.frontier.total})
+            run.progress({"event": "category_done", "category": cat_name, "worker": worker_id,
+                          "items": len(products_in_category), "skipped": skipped})
+    except Exception as e:
+        print(f"  ❌ [W{worker_id}] Воркер остановлен из-за ошибки: {e}")
+    finally:
+        stats["startup_s"] = fetcher.browser.startup_s
+        stats.update(fetcher.stats)
+        stats["sleep_s"] = stats.pop("wait_s")
+        if own_fetcher:
+            fetcher.close()
+        stats["total_s"] = time.perf_counter() - started
+    return stats
 
-        # Сохраняем данные только если что-то удалось собрать
-        if scraped_data:
-            with open('amazon_bestsellers_data.json', 'w', encoding='utf-8') as f:
-                json.dump(scraped_data, f, ensure_ascii=False, indent=4)
-            print(f"\n✅ Все данные успешно сохранены в файл.")
-            return True
+
+def _print_worker_stats(stats_list):
+    print("\nСтатистика воркеров:")
+    for s in stats_list:
+        per_page = s["total_s"] / s["categories"] if s["categories"] else 0.0
+        print(f"  [W{s['worker']}] категорий: {s['categories']} (ошибок: {s['failed']}), товаров: {s['items']}, "
+              f"старт: {s['startup_s']:.1f}s, загрузка: {s['load_s']:.1f}s, пауза: {s['sleep_s']:.1f}s, "
+              f"разбор: {s['parse_s']:.1f}s, всего: {s['total_s']:.1f}s ({per_page:.1f}s/стр.), "
+              f"HTTP: {s['http']}, Selenium: {s['selenium']}, без изменений: {s['skipped']}")
+
+
+def recover_partial_run(journal_file=BESTSELLERS_NDJSON):
+    """Категории, которые успел собрать прошлый запуск, упавший до конца (остались в .partial-журнале)."""
+    return {r["category"]: r["products"] for r in read_ndjson(journal_file + ".partial") if r.get("products")}
+
+
+def run_parser(workers=None, incremental=True, progress=None, cancel_event=None, driver_pool=None, http=None,
+               limiter=None, item_limit=None, max_depth=None, product_cache=None, base_url=None, marketplace=None):
+    """
+    Основная функция парсера, которая собирает данные и сохраняет их в SQLite (storage).
+    workers - число параллельных воркеров для обхода категорий (по умолчанию PARSER_WORKERS).
+    incremental - не разбирать заново страницы, не изменившиеся с прошлого запуска,
+    и записывать новый запуск только если какая-то категория действительно изменилась.
+    progress - колбэк, получающий события прогресса (dict с ключом "event").
+    cancel_event - threading.Event; если он выставлен, воркеры останавливаются, а данные не записываются.
+    driver_pool - DriverPool с прогретыми браузерами, которые переживают запуск (иначе Chrome на каждый запуск).
+    http - долгоживущий HttpFetcher с уже полученными cookies; такой не закрывается в конце запуска.
+    limiter - RateLimiter, задающий паузы между запросами к хосту (по умолчанию новый на запуск).
+    item_limit - сколько товаров собирать в каждой категории (по умолчанию CATEGORY_ITEM_LIMIT).
+    max_depth - глубина обхода подкатегорий (по умолчанию CRAWL_MAX_DEPTH). Очередь обхода
+    сохраняется на диск, и запуск после падения продолжает ее, а не начинает заново.
+    product_cache - ProductCache, куда попадают свежие цены и рейтинги с карточек категорий
+    (по умолчанию открывается PRODUCT_CACHE_FILE и закрывается в конце запуска).
+    marketplace - код площадки (marketplaces.MARKETPLACE_PROFILES, по умолчанию MARKETPLACE): ее сайт,
+    подписи на страницах и отдельные запуски в БД, журнал и очередь обхода.
+    base_url - адрес сайта вместо адреса площадки (например, локальный fixture_server для бенчмарков).
+    Возвращает True в случае успеха и False в случае ошибки.
+    """
+    global last_run_stats, last_run_report
+    run_report = metrics.RunReport("categories")
+    last_run_report, result, run = {}, "failed", None
+    workers = max(1, workers or PARSER_WORKERS)
+    market = get_marketplace(marketplace)
+    base_url = (base_url or market.base_url).rstrip("/")
+    records = FetchRecords(market.filename(CRAWL_STATE_FILE)) if incremental else None
+    stored_data = storage.load_latest_bestsellers(marketplace=market.code) if incremental else {}
+    # Данные упавшего запуска новее, чем последний запуск в БД
+    journal_file = market.filename(BESTSELLERS_NDJSON)
+    recovered = recover_partial_run(journal_file)
+    if recovered:
+        print(f"Восстановлено категорий из прерванного запуска: {len(recovered)}")
+    previous_data = {**stored_data, **recovered}
+    frontier_file = market.filename(FRONTIER_FILE)
+    frontier = CrawlFrontier(frontier_file) if max_depth is None else CrawlFrontier(frontier_file, max_depth)
+    journal = NdjsonWriter(journal_file)
+    if frontier.resumed:
+        # Категории, собранные до падения, обходить заново не будем - переносим их в новый журнал
+        for name, products in recovered.items():
+            journal.append({"category": name, "products": products})
+    limiter = limiter or RateLimiter()
+    cancel_event = cancel_event or threading.Event()
+    own_cache = product_cache is None
+    if own_cache:
+        product_cache = ProductCache()
+
+    # Один пул HTTP-соединений на весь запуск (или общий между запусками); Chrome нужен только при фолбэке
+    own_http = http is None
+    if own_http:
+        http = HttpFetcher(base_url=base_url)
+    fetcher = FallbackFetcher(http, make_browser(driver_pool), records=records,
+                              limiter=limiter, cancel_event=cancel_event)
+    try:
+        # --- ЭТАП 1: Динамический сбор категорий ---
+        if frontier.resumed:
+            print(f"ЭТАП 1: Продолжаю прерванный обход, категорий в очереди: {frontier.total}")
         else:
-            print("\n❌ Не удалось собрать никаких данных. Файл не был создан.")
+            for category in collect_categories(fetcher, base_url, market):
+                frontier.add(category['url'], category['name'], depth=0)
+            frontier.save()
+
+        if not frontier.total:
+            print("\nНе удалось собрать ни одной категории. Прекращаю работу.")
+            journal.discard()
+            frontier.finish()
+            return False
+
+        # --- ЭТАП 2: Парсинг страниц категорий (и подкатегорий в ширину) ---
+        print(f"\nЭТАП 2: Начинаю обход страниц категорий ({workers} воркер(ов), "
+              f"глубина подкатегорий до {frontier.max_depth})...")
+        run = _CrawlRun(frontier, previous_data, records, limiter, journal, progress, cancel_event,
+                        driver_pool, item_limit or CATEGORY_ITEM_LIMIT, product_cache, base_url, market)
+        run.progress({"event": "categories_found", "total": frontier.total})
+
+        # Первый воркер переиспользует загрузчик (и браузер, если он уже запущен) из этапа 1,
+        # остальные работают в пуле потоков со своими браузерами
+        with ThreadPoolExecutor(max_workers=max(1, workers - 1)) as executor:
+            # Наблюдения потоков пула попадают в отчет этого запуска (metrics.in_run)
+            worker = metrics.in_run(_category_worker)
+            futures = [executor.submit(worker, i, None, http, run) for i in range(1, workers)]
+            first_stats = _category_worker(0, fetcher, http, run)
+            last_run_stats = [first_stats] + [f.result() for f in futures]
+        _print_worker_stats(last_run_stats)
+        if run.cancel_event.is_set():
+            result = "cancelled"
+            print("\n⛔ Запуск отменен, данные не записываю.")
+            journal.discard()
+            frontier.finish()
             return False
 
+        # Сохраняем категории в исходном порядке, независимо от того, какой воркер их обработал.
+        # Если категорию в этот раз собрать не удалось - оставляем данные прошлого запуска.
+        scraped_data, carried = {}, []
+        for c in frontier.order:
+            products = run.scraped_data.get(c['name'])
+            if not products and previous_data.get(c['name']):
+                products = previous_data[c['name']]
+                if not (frontier.resumed and c['name'] in recovered):
+                    journal.append({"category": c['name'], "products": products})
+                    carried.append(c['name'])
+            if products:
+                scraped_data[c['name']] = products
+
+        last_run_report = {
+            "marketplace": market.code,
+            "categories_total": frontier.total,
+            "categories_changed": len(run.changed),
+            "pages_skipped": sum(s["skipped"] for s in last_run_stats),
+        }
+        last_run_report["rate_limits"] = limiter.stats()
+        if driver_pool is not None:
+            last_run_report["driver_pool"] = driver_pool.stats()
+        last_run_report["product_cache"] = product_cache.stats()
+        print(f"\nИзменилось категорий: {last_run_report['categories_changed']} из "
+              f"{last_run_report['categories_total']}, пропущено страниц без изменений: "
+              f"{last_run_report['pages_skipped']}")
+
+        # Сохраняем данные только если что-то удалось собрать
+        if not scraped_data:
+            print("\n❌ Не удалось собрать никаких данных. В БД ничего не записано.")
+            journal.discard()
+            frontier.finish()
+            return False
+        with metrics.stage("write"):
+            if scraped_data == stored_data:
+                print("\n✅ Данные не изменились, новый запуск в БД не записываю.")
+            else:
+                # Весь запуск пишется одной транзакцией: API видит либо старый, либо новый снимок
+                run_id = storage.save_bestsellers(scraped_data, marketplace=market.code, carried=carried)
+                print(f"\n✅ Все данные успешно сохранены в БД (запуск #{run_id}).")
+            # Журнал загрузок пишем только после БД: иначе отмененный или упавший запуск
+            # отметил бы страницы "без изменений", хотя их данные в БД так и не попали
+            if records is not None:
+                records.confirm(run.kept_pages)
+                records.save()
+            # Завершенный журнал атомарно становится актуальным NDJSON-снимком
+            journal.commit()
+        frontier.finish()
+        result = "succeeded"
+        return True
+
     except Exception as e:
         print(f"Критическая ошибка во время парсинга: {e}")
         return False
     finally:
-        if driver:
-            print("Закрываю браузер...")
-            driver.quit()
+        print("Закрываю браузер и HTTP-соединения...")
+        fetcher.close()
+        journal.close()
+        if own_cache:
+            product_cache.close()
+        else:
+            product_cache.flush()
+        if own_http:
+            http.close()
+        items_per_category = {name: len(products) for name, products in run.scraped_data.items()} if run else {}
+        last_run_report = run_report.finish(result, **last_run_report, items_per_category=items_per_category)
+        report_file = metrics.write_run_report(last_run_report)
+        if report_file:
+            print(f"Отчет запуска: {report_file}")
 
 
 # Этот блок позволит запускать парсер напрямую, как и раньше
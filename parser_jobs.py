@@ -0,0 +1,153 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Статусы задачи парсера
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Сколько завершенных задач держать в памяти для /api/parser-status/{job_id}
+MAX_FINISHED_JOBS = 20
+
+
+class ParserBusyError(Exception):
+    """Парсер уже работает; новую задачу запустить нельзя."""
+
+    def __init__(self, running_job: "ParserJob"):
+        super().__init__(f"Parser job {running_job.id} is already running")
+        self.running_job = running_job
+
+
+class ParserJob:
+    """Одна задача парсера: статус, прогресс по категориям и журнал событий для SSE."""
+
+    def __init__(self, trigger: str, params: Optional[dict] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.trigger = trigger
+        self.params = params or {}
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.progress = {"categories_total": 0, "categories_done": 0, "items_found": 0, "current_category": None}
+        self.events: List[dict] = []
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed_s(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return round((self.finished_at or time.time()) - self.started_at, 1)
+
+    def report(self, event: dict):
+        """Колбэк прогресса, который вызывает run_parser (из любого потока воркеров)."""
+        with self._lock:
+            kind = event.get("event")
+            if kind == "categories_found":
+                self.progress["categories_total"] = event["total"]
+            elif kind == "category_started":
+                self.progress["current_category"] = event["category"]
+            elif kind == "category_done":
+                self.progress["categories_done"] += 1
+                self.progress["items_found"] += event.get("items", 0)
+            # Каждое событие несет снимок прогресса на момент, когда оно произошло
+            self.events.append({"job_id": self.id, "status": self.status, **event,
+                                "elapsed_s": self.elapsed_s, **self.progress})
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.id, "trigger": self.trigger, "params": self.params, "status": self.status,
+                "elapsed_s": self.elapsed_s, "error": self.error, **self.progress,
+            }
+
+
+class ParserJobManager:
+    """
+    Запускает парсер в фоновом потоке и хранит задачи по id.
+    Единственная блокировка защищает от одновременного запуска двух парсеров -
+    и из API, и из планировщика.
+    """
+
+    def __init__(self, run_fn: Callable[..., bool]):
+        self._run_fn = run_fn
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parser-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, ParserJob] = {}
+        self._current: Optional[ParserJob] = None
+
+    @property
+    def current(self) -> Optional[ParserJob]:
+        return self._current
+
+    @property
+    def is_running(self) -> bool:
+        return self._current is not None
+
+    def get(self, job_id: str) -> Optional[ParserJob]:
+        return self._jobs.get(job_id)
+
+    def submit(self, trigger: str = "api", **params) -> ParserJob:
+        """
+        Ставит запуск парсера в фон и сразу возвращает задачу; ParserBusyError, если парсер уже занят.
+        params передаются в функцию запуска (например, marketplace).
+        """
+        with self._lock:
+            if self._current is not None:
+                raise ParserBusyError(self._current)
+            job = ParserJob(trigger, params)
+            self._current = job
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job)
+        return job
+
+    def cancel(self, job_id: str) -> Optional[ParserJob]:
+        """Просит задачу остановиться; парсер завершит текущую страницу и выйдет без записи данных."""
+        job = self._jobs.get(job_id)
+        if job is not None and job.status not in FINISHED_STATUSES:
+            job.cancel_event.set()
+            job.report({"event": "cancel_requested"})
+        return job
+
+    def shutdown(self):
+        job = self._current
+        if job is not None:
+            job.cancel_event.set()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job: ParserJob):
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.report({"event": "started"})
+        try:
+            success = self._run_fn(progress=job.report, cancel_event=job.cancel_event, **job.params)
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+            elif success:
+                job.status = SUCCEEDED
+            else:
+                job.status = FAILED
+                job.error = "Во время работы парсера произошла ошибка."
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            # Освобождаем парсер до события finished, чтобы клиент мог сразу запустить новую задачу
+            with self._lock:
+                self._current = None
+            job.report({"event": "finished", "error": job.error})
+
+    def _forget_old_jobs(self):
+        finished = [j for j in self._jobs.values() if j.status in FINISHED_STATUSES]
+        for job in sorted(finished, key=lambda j: j.created_at)[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job.id]
@@ -1,18 +1,39 @@
+import os
 import time
 import random
-import json
-import re
-from typing import List, Dict, Optional
-from bs4 import BeautifulSoup
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from fake_useragent import UserAgent
+import storage
+import metrics
+from fetch_records import FetchRecords, CRAWL_STATE_FILE
+from snapshot_store import NdjsonWriter
+from rate_limiter import RateLimiter
+from product_cache import ProductCache
+from marketplaces import Marketplace, get_marketplace, marketplace_for_url
+from normalize import extract_asin, url_key
+from extractors import (parse_html, extract_product, extract_product_links, count_category_cards,
+                        count_listed_products)
+from fetchers import (HttpFetcher, SeleniumFetcher, FallbackFetcher, CATEGORY_PAGE, PRODUCT_PAGE,
+                      AMAZON_BASE_URL, CATEGORY_PAGE_SIZE, category_page_url)
 
 # Настройки
-MAX_ITEMS = 5
-DATA_FILE = "data.json"
+MAX_ITEMS = int(os.getenv("MAX_ITEMS", "5"))
+# Сколько страниц товаров загружать одновременно (у каждого потока свой браузер для фолбэка)
+PRODUCT_CONCURRENCY = int(os.getenv("PRODUCT_CONCURRENCY", "1"))
+# Повторы для товара, который не удалось загрузить, и базовая пауза между ними (удваивается)
+PRODUCT_RETRIES = 2
+RETRY_BACKOFF_S = 2.0
+
+# NDJSON-снимок последнего запуска: один товар на строку
+ITEMS_NDJSON = "items.ndjson"
+
+# Время загрузки каждого товара в последнем вызове parse_category_selenium
+last_run_latencies: List[Dict] = []
+# Отчет последнего вызова: этапы, исходы загрузок, кэш (см. metrics.RunReport); пишется и в RUN_REPORT_DIR
+last_run_report: Dict = {}
 
 
 def create_driver(headless: bool = False, proxy: Optional[str] = None):
@@ -32,168 +53,306 @@ def create_driver(headless: bool = False, proxy: Optional[str] = None):
     if proxy:
         options.add_argument(f"--proxy-server={proxy}")
 
-    driver = uc.Chrome(options=options)
+    with metrics.stage("chrome_startup"):
+        driver = uc.Chrome(options=options)
     return driver
 
 
 def human_wait(min_s=1.0, max_s=3.0):
-    time.sleep(random.uniform(min_s, max_s))
+    with metrics.stage("sleep"):
+        time.sleep(random.uniform(min_s, max_s))
 
 
 # Эта функция нам больше не нужна, так как мы будем парсить ссылки иначе
 # def extract_product_links_from_category(...)
 
-def parse_product_page(driver, url: str, rank: int):
-    print(f"  > Parsing product URL: {url}")
-    driver.get(url)
-    WebDriverWait(driver, 20).until(
-        EC.presence_of_element_located((By.CSS_SELECTOR, "#productTitle, #centerCol"))
-    )
-    human_wait(1.5, 3.5)
-
-    driver.execute_script("window.scrollBy(0, 500);")
-    human_wait(0.5, 1.5)
-
-    soup = BeautifulSoup(driver.page_source, "lxml")
-
-    # --- Извлечение данных с улучшенными селекторами ---
-
-    title = soup.select_one("#productTitle")
-    title_text = title.get_text(strip=True) if title else "N/A"
-
-    asin = None
-    asin_tag = soup.select_one('input#ASIN')
-    if asin_tag and asin_tag.get('value'):
-        asin = asin_tag['value']
-    else:
-        # Запасной метод извлечения ASIN из URL
-        match = re.search(r"/dp/([A-Z0-9]{10})", url)
-        if match:
-            asin = match.group(1)
-
-    # Рейтинг и отзывы
-    rating_text = "N/A"
-    rating_tag = soup.select_one("#acrPopover")
-    if rating_tag and rating_tag.get('title'):
-        rating_text = rating_tag['title']
-
-    reviews_text = "0"
-    reviews_tag = soup.select_one("#acrCustomerReviewText")
-    if reviews_tag:
-        reviews_text = reviews_tag.get_text(strip=True)
-
-    # Картинка
-    image_url = None
-    img_tag = soup.select_one("#landingImage")
-    if img_tag and img_tag.get('src'):
-        image_url = img_tag['src']
-
-    # Буллеты
-    bullets = [li.get_text(strip=True) for li in soup.select("#feature-bullets ul li")[:5]]
-
-    # --- НОВАЯ УЛУЧШЕННАЯ ЛОГИКА ДЛЯ ЦЕНЫ, СКИДКИ И PRIME ---
-
-    price, list_price, discount = "N/A", None, None
-    is_prime = False
-
-    price_block = soup.select_one("#corePrice_feature_div, #tmmSwatches")
-    if price_block:
-        # Текущая цена
-        current_price_tag = price_block.select_one("span.a-offscreen")
-        if current_price_tag:
-            price = current_price_tag.get_text(strip=True)
-
-        # Старая (зачеркнутая) цена
-        list_price_tag = price_block.select_one("span[data-a-strike='true'] span.a-offscreen")
-        if list_price_tag:
-            list_price = list_price_tag.get_text(strip=True)
-
-        # Просчет скидки, если есть обе цены
-        if price != "N/A" and list_price:
-            try:
-                p_float = float(re.sub(r'[$,]', '', price))
-                lp_float = float(re.sub(r'[$,]', '', list_price))
-                if lp_float > p_float:
-                    discount = f"{int(round((lp_float - p_float) / lp_float * 100))}%"
-            except (ValueError, ZeroDivisionError):
-                pass
-
-    # Проверка на Prime (ищем иконку)
-    if soup.select_one("i.a-icon-prime"):
-        is_prime = True
-
-    # BSR
-    bsr = "N/A"
-    detail = soup.select_one("#detailBullets_feature_div") or soup.select_one("#productDetails_detailBullets_sections1")
-    if detail:
-        for li in detail.select('li'):
-            text = li.get_text()
-            if "Best Sellers Rank" in text:
-                bsr_text = ' '.join(li.get_text().split())
-                bsr = bsr_text.replace("Best Sellers Rank: ", "").split(' (')[0]
-                break
-
-    return {
-        "asin": asin, "rank": rank, "title": title_text, "price": price,
-        "list_price": list_price, "discount_percent": discount, "rating": rating_text,
-        "reviews_count": reviews_text, "is_prime": is_prime, "best_sellers_rank": bsr,
-        "bullet_points": bullets, "main_image_url": image_url, "url": url
-    }
-
-
-def parse_category_selenium(category_url: str, max_items=MAX_ITEMS, headless=False, proxy: Optional[str] = None):
+def create_window_driver(headless: bool = False, proxy: Optional[str] = None):
+    """Создает драйвер, имитирующий обычное окно браузера (без прогрева сессии)."""
     driver = create_driver(headless=headless, proxy=proxy)
 
     # --- ИМИТАЦИЯ ЧЕЛОВЕКА ---
     driver.maximize_window()
     driver.set_window_size(1920, 1080)
+    # --------------------------
+    return driver
 
-    # "Прогрев": заходим на главную страницу, чтобы получить cookies
-    print("[INFO] Warming up session by visiting main page...")
-    driver.get("https://www.amazon.com/")
+
+def warm_up_session(driver, base_url: str = AMAZON_BASE_URL):
+    """"Прогрев": заходим на главную страницу сайта, чтобы получить его cookies."""
+    print(f"[INFO] Warming up session by visiting {base_url}/ ...")
+    driver.get(base_url + "/")
     human_wait(2, 4)
-    # --------------------------
+
+
+def create_warm_driver(headless: bool = False, proxy: Optional[str] = None, base_url: str = AMAZON_BASE_URL):
+    """Создает драйвер, имитирующий обычное окно браузера, и прогревает сессию на главной."""
+    driver = create_window_driver(headless=headless, proxy=proxy)
+    warm_up_session(driver, base_url)
+    return driver
+
+
+def product_key(url: str) -> str:
+    """Стабильный ключ товара: ASIN из ссылки, иначе сама ссылка."""
+    return extract_asin(url) or url
+
+
+def parse_product_page(fetcher: FallbackFetcher, url: str, rank: int, previous: Optional[Dict] = None,
+                       cache: Optional[ProductCache] = None, marketplace: Optional[Marketplace] = None):
+    """
+    Загружает и разбирает страницу товара. Если все поля товара свежи в кэше (cache) -
+    страница не загружается вовсе. Если журнал загрузок показывает, что страница
+    не изменилась, и есть данные прошлого запуска (previous) - возвращает их без разбора.
+    marketplace - площадка товара (подписи на странице, формат цен, ключ в кэше).
+    """
+    print(f"  > Parsing product URL: {url}")
+    marketplace = marketplace or get_marketplace()
+    key = product_key(url)
+    asin = marketplace.product_key(extract_asin(url))
+    cached = cache.get(asin) if cache is not None else None
+    if cached is not None:
+        print("    (fresh in product cache, not fetching)")
+        return {"asin": cached.pop("asin"), "rank": rank, **cached, "url": url}
+    # Паузы между запросами выдерживает ограничитель скорости загрузчика
+    page = fetcher.fetch(url, PRODUCT_PAGE, key=key)
+    if page.unchanged and not previous:
+        page = fetcher.fetch(url, PRODUCT_PAGE, force=True, key=key)
+    if page.unchanged and previous:
+        print("    (not modified since last run, reusing previous data)")
+        fetcher.stats["reused"] += 1
+        item = {**previous, "rank": rank, "url": url}
+    else:
+        with metrics.stage("parse"):
+            item = extract_product(page.text, url, rank, marketplace)
+        if item["title"] == "N/A":
+            metrics.SELECTOR_MISSES.inc(page="product", element="title")
+    # Промах селектора (капча, другая разметка) в кэш не попадает - следующая попытка загрузит страницу заново
+    if cache is not None and item["title"] != "N/A":
+        cache.put(asin, item)
+    return item
+
+
+def _parse_product_with_retries(fetcher: FallbackFetcher, url: str, rank: int, previous: Optional[Dict],
+                                cache: Optional[ProductCache] = None,
+                                retries: int = PRODUCT_RETRIES,
+                                marketplace: Optional[Marketplace] = None) -> Tuple[Optional[Dict], Dict]:
+    """parse_product_page с повторами и экспоненциальной паузой; возвращает (товар или None, замер времени)."""
+    started = time.perf_counter()
+    error = None
+    for attempt in range(1, retries + 2):
+        try:
+            item = parse_product_page(fetcher, url, rank, previous, cache, marketplace)
+            return item, {"rank": rank, "url": url, "ok": True, "attempts": attempt,
+                          "latency_s": round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            error = e
+            print(f"[WARN] Attempt {attempt} failed for {url}: {e}")
+            if attempt <= retries:
+                time.sleep(RETRY_BACKOFF_S * 2 ** (attempt - 1))
+    return None, {"rank": rank, "url": url, "ok": False, "attempts": retries + 1, "error": str(error),
+                  "latency_s": round(time.perf_counter() - started, 3)}
+
+
+def iter_product_pages(make_fetcher: Callable[[], FallbackFetcher], product_links: List[str],
+                       previous_items: Dict[str, Dict], concurrency: int = PRODUCT_CONCURRENCY,
+                       stats: Optional[Dict] = None, cache: Optional[ProductCache] = None,
+                       marketplace: Optional[Marketplace] = None) -> Iterator[Tuple[Optional[Dict], Dict]]:
+    """
+    Загружает страницы товаров в concurrency потоков и отдает (товар, замер) строго в порядке
+    рангов: следующий товар отдается, как только готов он сам, остальные продолжают грузиться.
+    make_fetcher вызывается по одному разу в каждом потоке; созданные загрузчики закрываются в конце,
+    а их суммарная статистика записывается в stats.
+    """
+    local = threading.local()
+    fetchers: List[FallbackFetcher] = []
+    lock = threading.Lock()
+
+    def task(rank: int, url: str):
+        if not hasattr(local, "fetcher"):
+            local.fetcher = make_fetcher()
+            with lock:
+                fetchers.append(local.fetcher)
+        return _parse_product_with_retries(local.fetcher, url, rank, previous_items.get(product_key(url)), cache,
+                                           marketplace=marketplace)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="product") as executor:
+            # Наблюдения потоков товаров попадают в отчет вызывающего запуска
+            task = metrics.in_run(task)
+            futures = [executor.submit(task, rank, url) for rank, url in enumerate(product_links, start=1)]
+            for future in futures:
+                yield future.result()
+    finally:
+        for fetcher in fetchers:
+            fetcher.close()
+        if stats is not None:
+            stats.update(_sum_stats(f.stats for f in fetchers))
+
+
+def _sum_stats(stats_list) -> Dict:
+    total: Dict = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def collect_product_links(fetcher: FallbackFetcher, category_url: str, max_items: int,
+                          base_url: str = AMAZON_BASE_URL) -> List[str]:
+    """
+    Ссылки на первые max_items товаров категории, постранично (?pg=2, ...).
+    Если в HTTP-ответе только часть карточек, страница догружается прокруткой в браузере.
+    Берутся только ссылки на товары (/dp/ASIN); один ASIN попадает в список один раз,
+    даже если ссылки на него отличаются ref=-сегментами.
+    """
+    links: List[str] = []
+    seen = set()
+    for page_no in range(1, -(-max_items // CATEGORY_PAGE_SIZE) + 1):
+        url = category_page_url(category_url, page_no)
+        page = fetcher.fetch(url, CATEGORY_PAGE, force=True)
+        with metrics.stage("parse"):
+            tree = parse_html(page.text)
+            lazy = page.source == "http" and fetcher.browser is not None \
+                and count_listed_products(tree) > count_category_cards(tree)
+        if lazy:
+            print(f"[INFO] Page {page_no} is lazy-loaded, scrolling it in the browser")
+            page = fetcher.fetch(url, CATEGORY_PAGE, force=True, use_browser=True)
+            with metrics.stage("parse"):
+                tree = parse_html(page.text)
+        new_links = []
+        with metrics.stage("parse"):
+            for link in extract_product_links(tree, base_url, CATEGORY_PAGE_SIZE * 4):
+                key = url_key(link)
+                if extract_asin(link) and key not in seen:
+                    seen.add(key)
+                    new_links.append(link)
+        if page_no == 1 and not new_links:
+            metrics.SELECTOR_MISSES.inc(page="category", element="product_links")
+        del tree
+        links.extend(new_links[:max_items - len(links)])
+        if not new_links or len(links) >= max_items:
+            break
+    return links
+
+
+def _load_previous_items(marketplace: str) -> Dict[str, Dict]:
+    return {product_key(it.get("url") or ""): it for it in storage.load_latest_items(marketplace=marketplace)}
+
+
+def parse_category_selenium(category_url: str, max_items=MAX_ITEMS, headless=False, proxy: Optional[str] = None,
+                            incremental: bool = True, driver_pool=None, http: Optional[HttpFetcher] = None,
+                            limiter: Optional[RateLimiter] = None, concurrency: int = PRODUCT_CONCURRENCY,
+                            product_cache: Optional[ProductCache] = None, base_url: Optional[str] = None,
+                            marketplace: Optional[str] = None):
+    """
+    driver_pool / http - долгоживущие прогретые сессии (DriverPool и HttpFetcher), например из процесса API;
+    без них браузер и HTTP-клиент создаются на один вызов.
+    limiter - адаптивный ограничитель скорости запросов к хосту (по умолчанию новый на вызов).
+    concurrency - сколько страниц товаров загружать параллельно; время по каждому товару
+    сохраняется в last_run_latencies, отчет по этапам - в last_run_report.
+    product_cache - кэш товаров по ASIN; товары со свежими полями не загружаются (по умолчанию
+    открывается PRODUCT_CACHE_FILE и закрывается в конце вызова).
+    marketplace - код площадки (по умолчанию - площадка, которой принадлежит category_url, иначе MARKETPLACE).
+    base_url - адрес сайта вместо адреса площадки (например, локальный fixture_server для бенчмарков).
+    """
+    global last_run_latencies, last_run_report
+    run_report = metrics.RunReport("products")
+    result, results, latencies = "failed", [], []
+    market = get_marketplace(marketplace) if marketplace else marketplace_for_url(category_url) or get_marketplace()
+    base_url = (base_url or market.base_url).rstrip("/")
+    # Сначала пробуем обычные HTTP-запросы; Chrome запустится, только если HTTP не справится
+    own_http = http is None
+    if own_http:
+        http = HttpFetcher(base_url=base_url, proxy=proxy)
+    records = FetchRecords(market.filename(CRAWL_STATE_FILE)) if incremental else None
+    previous_items = _load_previous_items(market.code) if incremental else {}
+    limiter = limiter or RateLimiter()
+    own_cache = product_cache is None
+    if own_cache:
+        product_cache = ProductCache()
+
+    def make_fetcher() -> FallbackFetcher:
+        if driver_pool is not None:
+            browser = SeleniumFetcher(pool=driver_pool)
+        else:
+            browser = SeleniumFetcher(
+                driver_factory=lambda: create_warm_driver(headless=headless, proxy=proxy, base_url=base_url))
+        return FallbackFetcher(http, browser, records=records, limiter=limiter)
+
+    fetcher = make_fetcher()
+    journal = NdjsonWriter(market.filename(ITEMS_NDJSON))
 
     try:
         print(f"[INFO] Parsing category: {category_url}")
-        driver.get(category_url)
-        WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.CSS_SELECTOR, "div.p13n-desktop-grid")))
-
-        soup = BeautifulSoup(driver.page_source, "lxml")
-
-        # Находим ссылки на товары
-        product_links = []
-        product_grid = soup.select_one('div.p13n-desktop-grid')
-        if product_grid:
-            links = product_grid.select('a.a-link-normal', href=True)
-            for link in links:
-                href = link['href']
-                if href.startswith('/'):
-                    full_url = "https://www.amazon.com" + href
-                    if full_url not in product_links:
-                        product_links.append(full_url)
-                if len(product_links) >= max_items:
-                    break
+        product_links = collect_product_links(fetcher, category_url, max_items, base_url)
 
         if not product_links:
             print("[ERROR] Could not find product links on the category page.")
+            journal.discard()
             return []
 
-        results = []
-        for i, url in enumerate(product_links, start=1):
-            try:
-                item = parse_product_page(driver, url, rank=i)
-                results.append(item)
-            except Exception as e:
-                print(f"[ERROR] Failed to parse product {url}: {e}")
-
-        print(f"[INFO] Writing {len(results)} items to {DATA_FILE}")
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-
+        product_stats = {}
+        if concurrency > 1:
+            # Загрузчик страницы категории больше не нужен - освобождаем его браузер для потоков товаров
+            fetcher.close()
+            products = iter_product_pages(make_fetcher, product_links, previous_items, concurrency, product_stats,
+                                          product_cache, market)
+        else:
+            products = (_parse_product_with_retries(fetcher, url, rank, previous_items.get(product_key(url)),
+                                                    product_cache, marketplace=market)
+                        for rank, url in enumerate(product_links, start=1))
+        for item, latency in products:
+            latencies.append(latency)
+            if item is None:
+                print(f"[ERROR] Failed to parse product {latency['url']}: {latency['error']}")
+                continue
+            print(f"    #{latency['rank']} done in {latency['latency_s']:.2f}s ({latency['attempts']} attempt(s))")
+            results.append(item)
+            # Товар пишется в журнал сразу, в порядке рангов
+            with metrics.stage("write"):
+                journal.append(item)
+        last_run_latencies = latencies
+
+        stats = _sum_stats([fetcher.stats, product_stats])
+        print(f"[INFO] Skipped {stats['reused']} unchanged product pages, fetch stats: {stats}")
+        ok_latencies = sorted(l["latency_s"] for l in latencies if l["ok"])
+        if ok_latencies:
+            print(f"[INFO] Product latency: median {ok_latencies[len(ok_latencies) // 2]:.2f}s, "
+                  f"max {ok_latencies[-1]:.2f}s, failed {len(latencies) - len(ok_latencies)}")
+        print(f"[INFO] Rate limits: {limiter.stats()}")
+        print(f"[INFO] Product cache: {product_cache.stats()}")
+
+        with metrics.stage("write"):
+            if [{**it, "url": None} for it in results] == [{**it, "url": None} for it in previous_items.values()]:
+                print("[INFO] Nothing changed, no new run written")
+            else:
+                run_id = storage.save_items(results, marketplace=market.code)
+                print(f"[INFO] Wrote {len(results)} items to the database (run #{run_id})")
+            if records is not None:
+                # В журнал попадают только разобранные и сохраненные страницы - неудачная загрузится заново
+                records.confirm(product_key(it["url"]) for it in results if it["title"] != "N/A")
+                records.save()
+            journal.commit()
+
+        result = "succeeded" if results else "failed"
         return results
     finally:
-        driver.quit()
+        ok_latencies = [l["latency_s"] for l in latencies if l["ok"]]
+        last_run_report = run_report.finish(
+            result, marketplace=market.code, category_url=category_url, items=len(results),
+            products_failed=len(latencies) - len(ok_latencies),
+            product_latency_max_s=round(max(ok_latencies), 2) if ok_latencies else None,
+            product_cache=product_cache.stats(), rate_limits=limiter.stats())
+        report_file = metrics.write_run_report(last_run_report)
+        if report_file:
+            print(f"[INFO] Run report: {report_file}")
+        fetcher.close()
+        journal.close()
+        if own_cache:
+            product_cache.close()
+        else:
+            product_cache.flush()
+        if own_http:
+            http.close()
 
 
 if __name__ == "__main__":
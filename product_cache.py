@@ -0,0 +1,160 @@
+"""
+Кэш данных товаров по ASIN между запусками.
+
+У каждого поля свой срок жизни: цена устаревает за часы, рейтинг и BSR - за сутки,
+название, буллеты и картинка - за недели. Товар берется из кэша без загрузки страницы,
+только если свежи все его поля. В памяти держится ограниченное число товаров (LRU),
+вытесненные и все измененные записи сбрасываются в SQLite-файл и подхватываются
+оттуда при следующем обращении - в том числе в следующем запуске.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+PRODUCT_CACHE_FILE = os.getenv("PRODUCT_CACHE_FILE", "product_cache.db")
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "5000"))
+
+HOUR = 3600
+DAY = 24 * HOUR
+# Срок жизни каждого поля страницы товара (секунды)
+FIELD_TTLS = {
+    "price": 6 * HOUR,
+    "list_price": 6 * HOUR,
+    "discount_percent": 6 * HOUR,
+    "rating": DAY,
+    "reviews_count": DAY,
+    "best_sellers_rank": DAY,
+    "is_prime": DAY,
+    "asin": 30 * DAY,
+    "title": 30 * DAY,
+    "bullet_points": 30 * DAY,
+    "main_image_url": 30 * DAY,
+}
+# Поля, которые вместе с ценой пересчитываются из одной и той же части страницы
+_PRICE_DEPENDENT = ("list_price", "discount_percent")
+
+
+class ProductCache:
+    """LRU-кэш полей товаров с TTL на каждое поле и сбросом на диск."""
+
+    def __init__(self, filename: str = PRODUCT_CACHE_FILE, max_entries: int = PRODUCT_CACHE_SIZE,
+                 clock=time.time):
+        self.filename = filename
+        self.max_entries = max_entries
+        self._clock = clock
+        # asin -> {"fields": {поле: значение}, "fetched_at": {поле: время}}
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._dirty: set = set()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS product_cache (asin TEXT PRIMARY KEY, entry TEXT NOT NULL)")
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "disk_reads": 0}
+
+    def _entry(self, asin: str) -> Optional[dict]:
+        entry = self._entries.get(asin)
+        if entry is not None:
+            self._entries.move_to_end(asin)
+            return entry
+        row = self._conn.execute("SELECT entry FROM product_cache WHERE asin = ?", (asin,)).fetchone()
+        if row is None:
+            return None
+        self.counters["disk_reads"] += 1
+        entry = json.loads(row[0])
+        self._entries[asin] = entry
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            asin, entry = self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+            if asin in self._dirty:
+                self._write({asin: entry})
+                self._dirty.discard(asin)
+
+    def _write(self, entries: Dict[str, dict]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO product_cache (asin, entry) VALUES (?, ?)",
+                [(asin, json.dumps(entry, ensure_ascii=False)) for asin, entry in entries.items()],
+            )
+
+    def get(self, asin: Optional[str]) -> Optional[dict]:
+        """Поля товара, если все они есть в кэше и не устарели; иначе None."""
+        if not asin:
+            return None
+        with self._lock:
+            entry = self._entry(asin)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            now = self._clock()
+            fetched_at = entry["fetched_at"]
+            for field, ttl in FIELD_TTLS.items():
+                if field not in entry["fields"] or now - fetched_at.get(field, 0) > ttl:
+                    self.counters["stale"] += 1
+                    return None
+            self.counters["hits"] += 1
+            return dict(entry["fields"])
+
+    def put(self, asin: Optional[str], fields: dict):
+        """Запоминает свежие значения полей (только известных FIELD_TTLS), дополняя запись товара."""
+        if not asin:
+            return
+        with self._lock:
+            entry = self._entry(asin) or {"fields": {}, "fetched_at": {}}
+            now = self._clock()
+            for field, value in fields.items():
+                if field in FIELD_TTLS:
+                    entry["fields"][field] = value
+                    entry["fetched_at"][field] = now
+            self._entries[asin] = entry
+            self._entries.move_to_end(asin)
+            self._dirty.add(asin)
+            self._evict()
+
+    def update_prices(self, cards: Iterable[dict], asin_of):
+        """
+        Обновляет цену и рейтинг по карточкам со страницы категории. Если цена не изменилась,
+        зависящие от нее поля (старая цена, скидка) тоже считаются проверенными;
+        если изменилась - они помечаются устаревшими.
+        """
+        with self._lock:
+            now = self._clock()
+            for card in cards:
+                asin = asin_of(card)
+                entry = self._entry(asin) if asin else None
+                if entry is None:
+                    continue
+                fields, fetched_at = entry["fields"], entry["fetched_at"]
+                price = card.get("price")
+                if price and price != "N/A":
+                    same_price = fields.get("price") == price
+                    for field in _PRICE_DEPENDENT:
+                        fetched_at[field] = now if same_price else 0
+                    fields["price"], fetched_at["price"] = price, now
+                if card.get("rating"):
+                    fields["rating"], fetched_at["rating"] = card["rating"], now
+                self._dirty.add(asin)
+
+    def flush(self):
+        """Сбрасывает измененные записи на диск, чтобы их увидел следующий запуск."""
+        with self._lock:
+            dirty = {asin: self._entries[asin] for asin in self._dirty if asin in self._entries}
+            self._dirty.clear()
+            if dirty:
+                self._write(dirty)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"] + self.counters["stale"]
+            return {**self.counters, "entries_in_memory": len(self._entries),
+                    "hit_ratio": round(self.counters["hits"] / lookups, 3) if lookups else 0.0}
+
+    def close(self):
+        self.flush()
+        self._conn.close()
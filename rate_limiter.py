@@ -0,0 +1,126 @@
+"""
+Адаптивное ограничение частоты запросов к каждому хосту: token bucket, скорость
+которого подстраивается по AIMD - растет на фиксированный шаг, пока ответы чистые,
+и уменьшается в разы при капче, 429/503 или странице без нужного маркера.
+
+Часы и функция сна передаются снаружи, поэтому поведение можно проверить
+на симулированном времени без реальных пауз.
+"""
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+# Скорость в запросах в секунду на один хост
+RATE_INITIAL = float(os.getenv("RATE_INITIAL", "0.2"))
+RATE_MIN = float(os.getenv("RATE_MIN", "0.03"))
+RATE_MAX = float(os.getenv("RATE_MAX", "2.0"))
+# Аддитивный рост после успешного ответа и мультипликативное снижение после блокировки
+RATE_INCREASE = 0.02
+RATE_DECREASE = 0.5
+# Сколько запросов можно сделать подряд без паузы
+RATE_BURST = 1.0
+# Случайный разброс пауз (+-20%), чтобы запросы не шли с ровным интервалом
+RATE_JITTER = 0.2
+
+
+class HostLimiter:
+    """Token bucket одного хоста с AIMD-регулировкой скорости."""
+
+    def __init__(self, rate: float = RATE_INITIAL, min_rate: float = RATE_MIN, max_rate: float = RATE_MAX,
+                 increase: float = RATE_INCREASE, decrease: float = RATE_DECREASE, burst: float = RATE_BURST,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        # До этого момента запросы не выдаются совсем (Retry-After)
+        self._hold_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "successes": 0, "throttles": 0, "waited_s": 0.0}
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Резервирует один запрос и возвращает, сколько секунд нужно подождать перед ним."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= 1
+            delay = max(0.0, -self._tokens / self.rate, self._hold_until - now)
+            self.stats["requests"] += 1
+            self.stats["waited_s"] += delay
+            return delay
+
+    def success(self):
+        with self._lock:
+            self.stats["successes"] += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttle(self, retry_after: Optional[float] = None):
+        """Сайт начал сопротивляться: снижаем скорость и сбрасываем накопленный запас."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self.stats["throttles"] += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._hold_until = max(self._hold_until, now + retry_after)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "waited_s": round(self.stats["waited_s"], 1), "rate": round(self.rate, 3)}
+
+
+class RateLimiter:
+    """Набор HostLimiter по хостам; один экземпляр делят все воркеры запуска."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 jitter: float = RATE_JITTER, **host_settings):
+        self._clock = clock
+        self._sleep = sleep
+        self.jitter = jitter
+        self._host_settings = host_settings
+        self._hosts: Dict[str, HostLimiter] = {}
+        self._lock = threading.Lock()
+
+    def host(self, url: str) -> HostLimiter:
+        name = urlsplit(url).netloc.lower()
+        with self._lock:
+            limiter = self._hosts.get(name)
+            if limiter is None:
+                limiter = self._hosts[name] = HostLimiter(clock=self._clock, **self._host_settings)
+            return limiter
+
+    def acquire(self, url: str, cancel_event: Optional[threading.Event] = None) -> float:
+        """Ждет своей очереди на запрос к хосту url; пауза прерывается cancel_event. Возвращает паузу в секундах."""
+        delay = self.host(url).reserve()
+        if delay > 0 and self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if delay > 0:
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                self._sleep(delay)
+        return delay
+
+    def success(self, url: str):
+        self.host(url).success()
+
+    def throttle(self, url: str, retry_after: Optional[float] = None):
+        self.host(url).throttle(retry_after)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {name: limiter.snapshot() for name, limiter in hosts.items()}
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, List, Optional
+
+
+class Snapshot:
+    """
+    Неизменяемый снимок данных: распарсенный объект, готовое тело ответа, ETag
+    и (опционально) производная структура, построенная при загрузке.
+    """
+
+    __slots__ = ("data", "body", "etag", "version", "index")
+
+    def __init__(self, data: Any, body: bytes, version: Any, index: Any = None):
+        self.data = data
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.version = version
+        self.index = index
+
+
+class FileSource:
+    """Источник данных для SnapshotStore: JSON-файл, версия - его mtime и размер."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def version(self):
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def read(self):
+        with open(self.filename, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+class SnapshotStore:
+    """
+    Держит в памяти снимок данных и перечитывает его только при смене версии источника
+    (mtime файла, id последнего запуска в БД). Новый снимок собирается целиком и
+    подменяется одной операцией присваивания, поэтому читатели никогда не видят "половину" данных.
+
+    source - путь к JSON-файлу или объект с методами version() и read().
+    build - необязательная функция, которая один раз на загрузку строит из данных
+    производную структуру (нормализованные поля, индексы) и кладет ее в snapshot.index.
+    """
+
+    def __init__(self, source, default: Any = None,
+                 build: Optional[Callable[[Any], Any]] = None):
+        self.source = FileSource(source) if isinstance(source, str) else source
+        self.default = default
+        self.build = build
+        self._snapshot: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+
+    def _load(self, version) -> Snapshot:
+        data = self.default
+        if version is not None:
+            try:
+                data = self.source.read()
+            except (FileNotFoundError, json.JSONDecodeError):
+                data = self.default
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        index = self.build(data) if self.build else None
+        return Snapshot(data, body, version, index)
+
+    def get(self) -> Snapshot:
+        """Возвращает актуальный снимок, при необходимости перечитывая источник."""
+        version = self.source.version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            # Другой поток мог уже перечитать данные, пока мы ждали блокировку
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._load(version)
+                self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        """Сбрасывает снимок, чтобы следующий get() перечитал источник."""
+        self._snapshot = None
+
+
+def write_json_atomic(filename: str, data: Any, indent: Optional[int] = 4):
+    """
+    Пишет JSON во временный файл и атомарно подменяет им целевой,
+    чтобы API никогда не прочитал недописанный файл.
+    """
+    tmp_name = f"{filename}.tmp"
+    with open(tmp_name, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, filename)
+
+
+class NdjsonWriter:
+    """
+    Журнал запуска в формате NDJSON: каждая запись дописывается отдельной строкой,
+    как только готова, поэтому при падении посередине уже собранное не теряется.
+    Пока запуск идет, строки пишутся в "<filename>.partial"; commit() атомарно
+    переименовывает журнал в filename - он и становится актуальным снимком.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.partial_name = f"{filename}.partial"
+        self._lock = threading.Lock()
+        self._file = open(self.partial_name, "w", encoding="utf-8")
+        self.count = 0
+
+    def append(self, record: Any):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+
+    def commit(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self.partial_name, self.filename)
+
+    def close(self):
+        """Закрывает файл, оставляя .partial-журнал на диске (например, после падения запуска)."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def discard(self):
+        """Закрывает журнал, не подменяя снимок (отмененный запуск)."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+            if os.path.exists(self.partial_name):
+                os.remove(self.partial_name)
+
+
+def read_ndjson(filename: str) -> List[Any]:
+    """Читает записи NDJSON-журнала; недописанная последняя строка (падение во время записи) пропускается."""
+    records = []
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+    except FileNotFoundError:
+        pass
+    return records
@@ -14,9 +14,13 @@ document.addEventListener("DOMContentLoaded", () => {
         if (!productsContainer) return;
 
         async function fetchProducts() {
-            const minRating = minRatingSelect.value;
-            const url = `/items?min_rating=${minRating}`;
-            const res = await fetch(url);
+            // Фильтрация и сортировка выполняются на сервере по заранее построенным индексам
+            const params = new URLSearchParams({
+                min_rating: minRatingSelect.value,
+                sort_by: sortSelect.value,
+                order: sortOrderSelect.value,
+            });
+            const res = await fetch(`/items?${params}`);
             const data = await res.json();
             return data.items;
         }
@@ -42,28 +46,8 @@ document.addEventListener("DOMContentLoaded", () => {
             });
         }
 
-        function sortItems(items) {
-            const sortBy = sortSelect.value;
-            const order = sortOrderSelect.value;
-            return items.sort((a, b) => {
-                let valA, valB;
-                if (sortBy === "price") {
-                    valA = parseFloat(a.price?.replace(/[\$,]/g, '') || 0);
-                    valB = parseFloat(b.price?.replace(/[\$,]/g, '') || 0);
-                } else if (sortBy === "rating") {
-                    valA = parseFloat(a.rating?.split(" ")[0] || 0);
-                    valB = parseFloat(b.rating?.split(" ")[0] || 0);
-                } else {
-                    valA = a.rank;
-                    valB = b.rank;
-                }
-                return order === "asc" ? valA - valB : valB - valA;
-            });
-        }
-
         async function refresh() {
-            let items = await fetchProducts();
-            items = sortItems(items);
+            const items = await fetchProducts();
             renderProducts(items);
         }
 
@@ -87,6 +71,8 @@ document.addEventListener("DOMContentLoaded", () => {
         const bestsellersContainer = document.getElementById("bestsellersContainer");
         const manualRefreshBtn = document.getElementById("manualRefreshBtn");
         const lastUpdatedText = document.getElementById("lastUpdatedText");
+        const loaderText = document.getElementById("loaderText");
+        const cancelParserBtn = document.getElementById("cancelParserBtn");
 
         // Элементы модальных окон
         const confirmationModal = document.getElementById("confirmationModal");
@@ -101,7 +87,9 @@ document.addEventListener("DOMContentLoaded", () => {
         }
         console.log("Все элементы для секции бестселлеров успешно найдены.");
 
-        let allBestsellersData = {};
+        // Товары уже открытых категорий (сбрасывается при каждой загрузке списка категорий)
+        let categoryCache = {};
+        let currentJobId = null;
 
         // --- Функции для управления UI ---
         const showModal = () => {
@@ -137,11 +125,15 @@ document.addEventListener("DOMContentLoaded", () => {
 
         async function fetchAndDisplayData() {
             try {
-                const response = await fetch('/api/bestsellers');
-                allBestsellersData = await response.json();
+                // Для выпадающего списка нужны только названия категорий, без товаров
+                const response = await fetch('/api/bestsellers/categories');
+                const data = await response.json();
+                categoryCache = {};
 
-                if (Object.keys(allBestsellersData).length > 0) {
-                    populateCategorySelect(Object.keys(allBestsellersData));
+                if (data.categories && data.categories.length > 0) {
+                    populateCategorySelect(data.categories.map(c => c.category));
+                    // Перерисовываем выбранную категорию свежими данными
+                    if (categorySelect.value) categorySelect.dispatchEvent(new Event('change'));
                 } else {
                     categorySelect.innerHTML = `<option value="">No categories found. Run parser.</option>`;
                 }
@@ -189,17 +181,57 @@ document.addEventListener("DOMContentLoaded", () => {
             });
         }
 
+        function describeProgress(job) {
+            const total = job.categories_total ? ` / ${job.categories_total}` : "";
+            const current = job.current_category ? ` — ${job.current_category}` : "";
+            return `Updating data... ${job.categories_done}${total} categories, ` +
+                   `${job.items_found} items, ${Math.round(job.elapsed_s)}s${current}`;
+        }
+
+        // Следим за задачей парсера через SSE до ее завершения
+        function followParserJob(jobId) {
+            return new Promise((resolve) => {
+                const source = new EventSource(`/api/parser-status/${jobId}/events`);
+                source.onmessage = (message) => {
+                    const job = JSON.parse(message.data);
+                    if (loaderText) loaderText.textContent = describeProgress(job);
+                    if (job.event === "finished") {
+                        source.close();
+                        resolve(job);
+                    }
+                };
+                source.onerror = async () => {
+                    // Соединение оборвалось - узнаем итог обычным запросом
+                    source.close();
+                    const response = await fetch(`/api/parser-status/${jobId}`);
+                    resolve(await response.json());
+                };
+            });
+        }
+
         async function handleManualRefresh() {
             hideModal();
             showLoader();
             try {
                 const response = await fetch('/api/trigger-parser', { method: 'POST' });
-                if (!response.ok) {
-                    const errorData = await response.json();
-                    throw new Error(errorData.detail || 'Parser failed to start.');
-                }
                 const result = await response.json();
-                alert(result.message); // Показываем сообщение от сервера
+                if (response.status === 409 && result.detail && result.detail.job_id) {
+                    // Парсер уже работает (например, по расписанию) - просто следим за ним
+                    currentJobId = result.detail.job_id;
+                } else if (!response.ok) {
+                    throw new Error((result.detail && result.detail.message) || result.detail || 'Parser failed to start.');
+                } else {
+                    currentJobId = result.job_id;
+                }
+
+                const job = await followParserJob(currentJobId);
+                if (job.status === "succeeded") {
+                    alert("Parser finished successfully.");
+                } else if (job.status === "cancelled") {
+                    alert("Update was cancelled.");
+                } else {
+                    alert(`Parser failed: ${job.error || job.status}`);
+                }
 
                 // Сразу же обновляем данные на странице
                 await updateParserStatus();
@@ -208,21 +240,46 @@ document.addEventListener("DOMContentLoaded", () => {
             } catch (error) {
                 alert(`Error starting parser: ${error.message}`);
             } finally {
+                currentJobId = null;
+                if (loaderText) loaderText.textContent = "Updating data... Please wait.";
                 hideLoader();
             }
         }
 
+        async function cancelParserJob() {
+            if (!currentJobId) return;
+            await fetch(`/api/parser-status/${currentJobId}/cancel`, { method: 'POST' });
+            if (loaderText) loaderText.textContent = "Cancelling...";
+        }
+
         // --- Привязка событий ---
         console.log("Привязка событий к кнопкам...");
         manualRefreshBtn.addEventListener('click', showModal);
         cancelRefreshBtn.addEventListener('click', hideModal);
         confirmRefreshBtn.addEventListener('click', handleManualRefresh);
+        if (cancelParserBtn) cancelParserBtn.addEventListener('click', cancelParserJob);
 
-        categorySelect.addEventListener('change', () => {
+        async function fetchCategory(category) {
+            if (!categoryCache[category]) {
+                const response = await fetch(`/api/bestsellers?category=${encodeURIComponent(category)}`);
+                if (!response.ok) return [];
+                categoryCache[category] = await response.json();
+            }
+            return categoryCache[category];
+        }
+
+        categorySelect.addEventListener('change', async () => {
             const selectedCategory = categorySelect.value;
-            if (selectedCategory && allBestsellersData[selectedCategory]) {
-                renderBestsellers(allBestsellersData[selectedCategory]);
-            } else {
+            if (!selectedCategory) {
+                bestsellersContainer.innerHTML = "";
+                return;
+            }
+            try {
+                const products = await fetchCategory(selectedCategory);
+                // Пока шел запрос, пользователь мог выбрать другую категорию
+                if (categorySelect.value === selectedCategory) renderBestsellers(products);
+            } catch (error) {
+                console.error("Ошибка при загрузке категории:", error);
                 bestsellersContainer.innerHTML = "";
             }
         });
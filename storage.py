@@ -0,0 +1,396 @@
+"""
+Хранилище результатов парсинга в SQLite.
+
+Каждый запуск парсера записывается одной транзакцией как отдельный run, поэтому
+сохраняется история позиций товаров. API читает последний run индексированными запросами.
+
+Распределенный обход (distributed_crawl) пишет run постепенно: start_run, затем категории
+и товары по мере готовности (повторная запись того же ключа заменяет прежнюю), затем finish_run.
+Пока run не завершен, API видит его данные поверх последнего завершенного run.
+Строки, перенесенные из прошлого run (категория или товар в этот раз не собраны),
+помечены carried и в историю позиций не попадают.
+
+Запуски разных площадок (marketplaces) хранятся рядом: у каждого run есть код площадки,
+а "последний запуск" всегда выбирается в пределах одной площадки.
+
+    python storage.py import    # загрузить существующие amazon_bestsellers_data.json и data.json
+"""
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from marketplaces import MARKETPLACE, get_marketplace
+from normalize import extract_asin, normalize_item, parse_bsr
+
+DB_PATH = os.getenv("DB_PATH", "amazon_data.db")
+
+# Виды запусков: категории бестселлеров (parser_categories) и товары категории (parser_selenium)
+BESTSELLERS = "bestsellers"
+ITEMS = "items"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind        TEXT NOT NULL,
+    scraped_at  REAL NOT NULL,
+    finished_at REAL,
+    updated_at  REAL,
+    marketplace TEXT NOT NULL DEFAULT 'us'
+);
+CREATE INDEX IF NOT EXISTS idx_runs_kind ON runs (kind, id);
+
+CREATE TABLE IF NOT EXISTS bestsellers (
+    run_id      INTEGER NOT NULL REFERENCES runs (id),
+    category    TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    rank        INTEGER,
+    asin        TEXT,
+    scraped_at  REAL NOT NULL,
+    data        TEXT NOT NULL,
+    carried     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, category, position)
+);
+CREATE INDEX IF NOT EXISTS idx_bestsellers_category ON bestsellers (category, run_id);
+CREATE INDEX IF NOT EXISTS idx_bestsellers_asin ON bestsellers (asin, scraped_at);
+CREATE INDEX IF NOT EXISTS idx_bestsellers_scraped_at ON bestsellers (scraped_at);
+
+CREATE TABLE IF NOT EXISTS items (
+    run_id              INTEGER NOT NULL REFERENCES runs (id),
+    position            INTEGER NOT NULL,
+    rank                INTEGER,
+    asin                TEXT,
+    price_value         REAL,
+    rating_value        REAL,
+    reviews_count_value INTEGER,
+    bsr_value           INTEGER,
+    scraped_at          REAL NOT NULL,
+    data                TEXT NOT NULL,
+    carried             INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_items_asin ON items (asin, scraped_at);
+CREATE INDEX IF NOT EXISTS idx_items_scraped_at ON items (scraped_at);
+"""
+
+_local = threading.local()
+
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """Соединение для текущего потока (одно на поток и файл БД), схема создается при первом открытии."""
+    db_path = db_path or DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _migrate(conn)
+        connections[db_path] = conn
+    return conn
+
+
+def _migrate(conn: sqlite3.Connection):
+    """
+    БД, созданные до постепенной записи запусков: все их запуски считаются завершенными.
+    БД, созданные до появления площадок: все их запуски - amazon.com.
+    БД, созданные до пометки перенесенных строк: все их строки считаются собранными.
+    """
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(runs)")}
+    with conn:
+        for table in ("bestsellers", "items"):
+            if "carried" not in {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN carried INTEGER NOT NULL DEFAULT 0")
+        if "finished_at" not in columns:
+            conn.execute("ALTER TABLE runs ADD COLUMN finished_at REAL")
+            conn.execute("ALTER TABLE runs ADD COLUMN updated_at REAL")
+            conn.execute("UPDATE runs SET finished_at = scraped_at, updated_at = scraped_at")
+        if "marketplace" not in columns:
+            conn.execute("ALTER TABLE runs ADD COLUMN marketplace TEXT NOT NULL DEFAULT 'us'")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_marketplace ON runs (kind, marketplace, id)")
+
+
+def _new_run(conn: sqlite3.Connection, kind: str, scraped_at: float, finished: bool = True,
+             marketplace: str = MARKETPLACE) -> int:
+    get_marketplace(marketplace)  # неизвестный код - ValueError до записи
+    return conn.execute(
+        "INSERT INTO runs (kind, scraped_at, finished_at, updated_at, marketplace) VALUES (?, ?, ?, ?, ?)",
+        (kind, scraped_at, scraped_at if finished else None, scraped_at, marketplace),
+    ).lastrowid
+
+
+def _bestseller_rows(run_id: int, category: str, products: List[dict], scraped_at: float,
+                     carried: bool = False) -> list:
+    return [
+        (run_id, category, position, parse_bsr(item.get("rank")), extract_asin(item.get("url")),
+         scraped_at, json.dumps(item, ensure_ascii=False), int(carried))
+        for position, item in enumerate(products)
+    ]
+
+
+def _item_row(position: int, item: dict, scraped_at: float, marketplace: str) -> tuple:
+    n = normalize_item(item, get_marketplace(marketplace))
+    return (position, parse_bsr(item.get("rank")), item.get("asin") or extract_asin(item.get("url")),
+            n["price_value"], n["rating_value"], n["reviews_count_value"], n["bsr_value"],
+            scraped_at, json.dumps(item, ensure_ascii=False))
+
+
+_INSERT_BESTSELLER = ("INSERT INTO bestsellers (run_id, category, position, rank, asin, scraped_at, data, carried) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+_INSERT_ITEM = ("INSERT OR REPLACE INTO items (run_id, position, rank, asin, price_value, rating_value, "
+                "reviews_count_value, bsr_value, scraped_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def save_bestsellers(data: Dict[str, List[dict]], scraped_at: Optional[float] = None,
+                     db_path: Optional[str] = None, marketplace: str = MARKETPLACE,
+                     carried: Iterable[str] = ()) -> int:
+    """
+    Записывает {категория: [товары]} одним запуском в одной транзакции. Возвращает id запуска.
+    carried - категории, данные которых взяты из прошлого запуска (в историю позиций не попадают).
+    """
+    scraped_at = scraped_at or time.time()
+    carried = set(carried)
+    conn = connect(db_path)
+    with conn:
+        run_id = _new_run(conn, BESTSELLERS, scraped_at, marketplace=marketplace)
+        conn.executemany(_INSERT_BESTSELLER, [
+            row for category, products in data.items()
+            for row in _bestseller_rows(run_id, category, products, scraped_at, category in carried)
+        ])
+    return run_id
+
+
+def save_items(items: List[dict], scraped_at: Optional[float] = None, db_path: Optional[str] = None,
+               marketplace: str = MARKETPLACE) -> int:
+    """Записывает список товаров категории одним запуском в одной транзакции. Возвращает id запуска."""
+    scraped_at = scraped_at or time.time()
+    conn = connect(db_path)
+    rows = [_item_row(position, item, scraped_at, marketplace) for position, item in enumerate(items)]
+    with conn:
+        run_id = _new_run(conn, ITEMS, scraped_at, marketplace=marketplace)
+        conn.executemany(_INSERT_ITEM, [(run_id,) + row for row in rows])
+    return run_id
+
+
+def start_run(kind: str, scraped_at: Optional[float] = None, db_path: Optional[str] = None,
+              marketplace: str = MARKETPLACE) -> int:
+    """Открывает запуск, который будет заполняться постепенно (см. save_run_category / save_run_item)."""
+    conn = connect(db_path)
+    with conn:
+        return _new_run(conn, kind, scraped_at or time.time(), finished=False, marketplace=marketplace)
+
+
+def save_run_category(run_id: int, category: str, products: List[dict], db_path: Optional[str] = None):
+    """Записывает (или перезаписывает) товары одной категории открытого запуска одной транзакцией."""
+    now = time.time()
+    conn = connect(db_path)
+    with conn:
+        conn.execute("DELETE FROM bestsellers WHERE run_id = ? AND category = ?", (run_id, category))
+        conn.executemany(_INSERT_BESTSELLER, _bestseller_rows(run_id, category, products, now))
+        conn.execute("UPDATE runs SET updated_at = ? WHERE id = ?", (now, run_id))
+
+
+def save_run_item(run_id: int, position: int, item: dict, db_path: Optional[str] = None):
+    """Записывает (или перезаписывает) товар на позиции position открытого запуска."""
+    now = time.time()
+    conn = connect(db_path)
+    with conn:
+        marketplace = conn.execute("SELECT marketplace FROM runs WHERE id = ?", (run_id,)).fetchone()["marketplace"]
+        conn.execute(_INSERT_ITEM, (run_id,) + _item_row(position, item, now, marketplace))
+        conn.execute("UPDATE runs SET updated_at = ? WHERE id = ?", (now, run_id))
+
+
+def _previous_run(conn: sqlite3.Connection, run_id: int) -> Optional[sqlite3.Row]:
+    """Последний завершенный запуск того же вида и площадки, созданный раньше run_id."""
+    return conn.execute(
+        "SELECT p.id FROM runs r JOIN runs p ON p.kind = r.kind AND p.marketplace = r.marketplace "
+        "WHERE r.id = ? AND p.id < r.id AND p.finished_at IS NOT NULL ORDER BY p.id DESC LIMIT 1",
+        (run_id,)).fetchone()
+
+
+def load_previous_category(run_id: int, category: str, db_path: Optional[str] = None) -> List[dict]:
+    """Товары категории category в запуске, предшествующем открытому run_id (пусто, если их нет)."""
+    conn = connect(db_path)
+    base = _previous_run(conn, run_id)
+    if base is None:
+        return []
+    rows = conn.execute("SELECT data FROM bestsellers WHERE run_id = ? AND category = ? ORDER BY position",
+                        (base["id"], category))
+    return [json.loads(row["data"]) for row in rows]
+
+
+def load_previous_item(run_id: int, url: str, db_path: Optional[str] = None) -> Optional[dict]:
+    """
+    Товар по ссылке url в запуске, предшествующем открытому run_id (None, если его там не было).
+    Товары сравниваются по ASIN из ссылки: на странице варианта товара ASIN может быть другим.
+    """
+    conn = connect(db_path)
+    base = _previous_run(conn, run_id)
+    key = extract_asin(url) or url
+    if base is None:
+        return None
+    for row in conn.execute("SELECT data FROM items WHERE run_id = ?", (base["id"],)):
+        item = json.loads(row["data"])
+        if (extract_asin(item.get("url")) or item.get("url")) == key:
+            return item
+    return None
+
+
+def finish_run(run_id: int, db_path: Optional[str] = None):
+    """
+    Закрывает постепенно записанный запуск. Категории и позиции товаров, которые собрать
+    не удалось, переносятся из последнего завершенного запуска - как и в run_parser,
+    после закрытия API показывает то же, что показывал, пока запуск шел. Перенесенные строки
+    сохраняют время, когда их на самом деле собрали, и помечаются carried.
+    """
+    now = time.time()
+    conn = connect(db_path)
+    with conn:
+        kind = conn.execute("SELECT kind FROM runs WHERE id = ?", (run_id,)).fetchone()["kind"]
+        base = _previous_run(conn, run_id)
+        if base is not None and kind == BESTSELLERS:
+            conn.execute(
+                "INSERT INTO bestsellers (run_id, category, position, rank, asin, scraped_at, data, carried) "
+                "SELECT ?, category, position, rank, asin, scraped_at, data, 1 FROM bestsellers "
+                "WHERE run_id = ? AND category NOT IN (SELECT category FROM bestsellers WHERE run_id = ?) "
+                "ORDER BY rowid", (run_id, base["id"], run_id))
+        elif base is not None:
+            conn.execute(
+                "INSERT OR IGNORE INTO items (run_id, position, rank, asin, price_value, rating_value, "
+                "reviews_count_value, bsr_value, scraped_at, data, carried) "
+                "SELECT ?, position, rank, asin, price_value, rating_value, reviews_count_value, bsr_value, "
+                "scraped_at, data, 1 FROM items WHERE run_id = ?", (run_id, base["id"]))
+        conn.execute("UPDATE runs SET finished_at = ?, updated_at = ? WHERE id = ?", (now, now, run_id))
+
+
+def latest_run(kind: str, db_path: Optional[str] = None, finished: bool = False,
+               marketplace: str = MARKETPLACE) -> Optional[sqlite3.Row]:
+    """Последний запуск указанного вида на площадке marketplace (finished=True - только завершенный)."""
+    where = " AND finished_at IS NOT NULL" if finished else ""
+    return connect(db_path).execute(
+        f"SELECT id, scraped_at, finished_at, updated_at FROM runs WHERE kind = ? AND marketplace = ?{where} "
+        f"ORDER BY id DESC LIMIT 1",
+        (kind, marketplace),
+    ).fetchone()
+
+
+def _load_bestsellers_run(run_id: int, db_path: Optional[str]) -> Dict[str, List[dict]]:
+    data: Dict[str, List[dict]] = {}
+    rows = connect(db_path).execute(
+        "SELECT category, data FROM bestsellers WHERE run_id = ? ORDER BY rowid", (run_id,)
+    )
+    for row in rows:
+        data.setdefault(row["category"], []).append(json.loads(row["data"]))
+    return data
+
+
+def _load_items_run(run_id: int, db_path: Optional[str]) -> Dict[int, dict]:
+    rows = connect(db_path).execute(
+        "SELECT position, data FROM items WHERE run_id = ? ORDER BY position", (run_id,)
+    )
+    return {row["position"]: json.loads(row["data"]) for row in rows}
+
+
+def load_latest_bestsellers(db_path: Optional[str] = None, marketplace: str = MARKETPLACE) -> Dict[str, List[dict]]:
+    """
+    Категории последнего запуска. Если он еще идет - уже готовые категории поверх
+    последнего завершенного запуска (порядок категорий - как в нем, новые в конце).
+    """
+    run = latest_run(BESTSELLERS, db_path, marketplace=marketplace)
+    if run is None:
+        return {}
+    data = _load_bestsellers_run(run["id"], db_path)
+    if run["finished_at"] is None:
+        base = latest_run(BESTSELLERS, db_path, finished=True, marketplace=marketplace)
+        if base is not None:
+            data = {**_load_bestsellers_run(base["id"], db_path), **data}
+    return data
+
+
+def load_latest_items(db_path: Optional[str] = None, marketplace: str = MARKETPLACE) -> List[dict]:
+    """Товары последнего запуска; пока он идет, недостающие позиции берутся из последнего завершенного."""
+    run = latest_run(ITEMS, db_path, marketplace=marketplace)
+    if run is None:
+        return []
+    items = _load_items_run(run["id"], db_path)
+    if run["finished_at"] is None:
+        base = latest_run(ITEMS, db_path, finished=True, marketplace=marketplace)
+        if base is not None:
+            items = {**_load_items_run(base["id"], db_path), **items}
+    return [items[position] for position in sorted(items)]
+
+
+def rank_history(asin: str, db_path: Optional[str] = None, marketplace: str = MARKETPLACE) -> List[dict]:
+    """
+    История позиций товара во всех категориях бестселлеров площадки, от старых запусков к новым.
+    Идущий запуск не учитывается: его категории еще могут быть перезаписаны. Перенесенные
+    из прошлого запуска строки - тоже: это повтор уже учтенной точки, а не новое наблюдение.
+    """
+    rows = connect(db_path).execute(
+        "SELECT b.scraped_at, b.category, b.rank FROM bestsellers b JOIN runs r ON r.id = b.run_id "
+        "WHERE b.asin = ? AND r.marketplace = ? AND r.finished_at IS NOT NULL AND b.carried = 0 "
+        "ORDER BY b.scraped_at",
+        (asin, marketplace)
+    )
+    return [
+        {"scraped_at": _format_time(row["scraped_at"]), "category": row["category"], "rank": row["rank"]}
+        for row in rows
+    ]
+
+
+def last_updated(kind: str, db_path: Optional[str] = None, marketplace: str = MARKETPLACE) -> Optional[str]:
+    """Время последнего запуска указанного вида на площадке в читаемом формате."""
+    run = latest_run(kind, db_path, marketplace=marketplace)
+    return _format_time(run["updated_at"] or run["scraped_at"]) if run else None
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class RunSource:
+    """Источник данных для SnapshotStore: последний запуск указанного вида на площадке marketplace."""
+
+    _loaders = {BESTSELLERS: load_latest_bestsellers, ITEMS: load_latest_items}
+
+    def __init__(self, kind: str, db_path: Optional[str] = None, marketplace: str = MARKETPLACE):
+        self.kind = kind
+        self.db_path = db_path
+        self.marketplace = marketplace
+
+    def version(self):
+        # Открытый запуск меняет версию с каждой записанной категорией или товаром
+        run = latest_run(self.kind, self.db_path, marketplace=self.marketplace)
+        return (run["id"], run["updated_at"]) if run else None
+
+    def read(self):
+        return self._loaders[self.kind](self.db_path, marketplace=self.marketplace)
+
+
+def import_json_files(bestsellers_file: str = "amazon_bestsellers_data.json", items_file: str = "data.json",
+                      db_path: Optional[str] = None):
+    """Разовый импорт старых JSON-снимков (amazon.com); время запуска берется из mtime файла."""
+    for filename, save in ((bestsellers_file, save_bestsellers), (items_file, save_items)):
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            print(f"[IMPORT] {filename} не найден, пропускаю.")
+            continue
+        run_id = save(data, scraped_at=os.path.getmtime(filename), db_path=db_path, marketplace="us")
+        print(f"[IMPORT] {filename} -> run #{run_id} ({len(data)} записей)")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["import"]:
+        import_json_files(*sys.argv[2:4])
+    else:
+        print(__doc__)
@@ -0,0 +1,97 @@
+"""
+Пул браузеров с поддельным драйвером: потоков загрузки больше, чем браузеров в пуле.
+
+    python -m pytest tests
+"""
+import os
+import threading
+
+import pytest
+from selenium.common.exceptions import WebDriverException
+
+import parser_selenium
+from driver_pool import DriverPool
+from fetchers import FallbackFetcher, SeleniumFetcher, PRODUCT_PAGE
+from fixture_server import FIXTURES_DIR
+
+with open(os.path.join(FIXTURES_DIR, "product.html"), "r", encoding="utf-8") as f:
+    PRODUCT_HTML = f.read()
+
+
+class FakeDriver:
+    """Драйвер, который мгновенно "загружает" фикстуру страницы товара."""
+
+    def __init__(self):
+        self.current_url = None
+        self.quit_calls = 0
+
+    def get(self, url):
+        self.current_url = url
+
+    def find_element(self, by, value):
+        return object()
+
+    def execute_script(self, script, *args):
+        return 0
+
+    @property
+    def page_source(self):
+        return PRODUCT_HTML
+
+    def quit(self):
+        self.quit_calls += 1
+
+
+def test_product_threads_share_smaller_pool(monkeypatch):
+    monkeypatch.setattr(PRODUCT_PAGE, "settle", (0, 0))
+    pool = DriverPool(FakeDriver, max_size=2)
+    links = [f"https://www.amazon.com/dp/B0000000{n:02d}" for n in range(12)]
+    results = []
+
+    def run():
+        make_fetcher = lambda: FallbackFetcher(None, SeleniumFetcher(pool=pool))
+        for item, latency in parser_selenium.iter_product_pages(make_fetcher, links, {}, concurrency=3):
+            results.append(item)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(timeout=10)
+    assert not worker.is_alive(), "product threads are stuck waiting for a browser"
+    assert len(results) == len(links) and all(results)
+    stats = pool.stats()
+    assert stats["in_use"] == 0
+    assert stats["started"] <= 2
+    pool.close()
+
+
+class CrashedDriver(FakeDriver):
+    def get(self, url):
+        raise WebDriverException("chrome not reachable")
+
+
+def test_crashed_browser_is_not_returned_to_pool(monkeypatch):
+    monkeypatch.setattr(PRODUCT_PAGE, "settle", (0, 0))
+    drivers = [CrashedDriver(), FakeDriver()]
+    pool = DriverPool(lambda: drivers.pop(0), max_size=1)
+    browser = SeleniumFetcher(pool=pool)
+    with pytest.raises(WebDriverException):
+        browser.fetch("https://www.amazon.com/dp/B000000001", PRODUCT_PAGE)
+    stats = pool.stats()
+    assert stats["recycled"] == 1 and stats["idle"] == 0 and stats["in_use"] == 0
+    # Следующая страница идет в новом браузере
+    assert browser.fetch("https://www.amazon.com/dp/B000000001", PRODUCT_PAGE).status == 200
+    assert pool.stats()["started"] == 2
+    pool.close()
+
+
+def test_pooled_browser_is_warmed_once_per_marketplace(monkeypatch):
+    monkeypatch.setattr(PRODUCT_PAGE, "settle", (0, 0))
+    warmed = []
+    pool = DriverPool(FakeDriver, max_size=1, warm=lambda driver, site: warmed.append(site))
+    browser = SeleniumFetcher(pool=pool)
+    for url in ("https://www.amazon.com/dp/B000000001", "https://www.amazon.de/dp/B000000002",
+                "https://www.amazon.com/dp/B000000003", "https://www.amazon.de/dp/B000000004"):
+        browser.fetch(url, PRODUCT_PAGE)
+    assert warmed == ["https://www.amazon.com", "https://www.amazon.de"]
+    assert pool.stats()["started"] == 1
+    pool.close()
@@ -0,0 +1,61 @@
+"""
+Журнал загрузок: новая загрузка попадает в журнал только после подтверждения,
+а у каждой площадки свой файл журнала.
+
+    python -m pytest tests
+"""
+import json
+import os
+
+import parser_categories
+import storage
+from fetch_records import FetchRecords
+from fixture_server import FixtureServer
+from rate_limiter import RateLimiter
+
+URL = "https://www.amazon.com/Best-Sellers-Electronics/zgbs/electronics"
+
+
+def test_update_is_staged_until_confirm(tmp_path):
+    filename = str(tmp_path / "crawl_state.json")
+    records = FetchRecords(filename)
+    assert records.update(URL, "hash-1", {"ETag": '"v1"'})
+    assert records.get(URL) is None
+    assert records.conditional_headers(URL) == {}
+    # Неподтвержденная загрузка не делает страницу "неизменившейся"
+    assert records.update(URL, "hash-1")
+
+    records.confirm([URL, "https://www.amazon.com/never-fetched"])
+    assert records.get(URL)["hash"] == "hash-1"
+    assert len(records) == 1
+    assert not records.update(URL, "hash-1", {"ETag": '"v1"'})
+    assert records.update(URL, "hash-2")
+
+
+def test_save_writes_only_confirmed_records(tmp_path):
+    filename = str(tmp_path / "crawl_state.json")
+    records = FetchRecords(filename)
+    records.update(URL, "hash-1", {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+    records.update(URL + "?pg=2", "hash-2")
+    records.confirm([URL])
+    records.save()
+    with open(filename, "r", encoding="utf-8") as f:
+        assert list(json.load(f)) == [URL]
+
+    reloaded = FetchRecords(filename)
+    assert reloaded.conditional_headers(URL) == {
+        "If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert reloaded.get(URL + "?pg=2") is None
+
+
+def test_run_parser_keeps_records_per_marketplace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "DB_PATH", str(tmp_path / "amazon.db"))
+    limiter = RateLimiter(jitter=0, rate=500, min_rate=500, max_rate=500, burst=500)
+    with FixtureServer() as server:
+        for market in ("us", "de"):
+            assert parser_categories.run_parser(workers=1, limiter=limiter, max_depth=0,
+                                                item_limit=10, base_url=server.base_url, marketplace=market)
+    assert os.path.exists("crawl_state.json") and os.path.exists("crawl_state.de.json")
+    with open("crawl_state.de.json", "r", encoding="utf-8") as f:
+        assert any("/zgbs/" in url for url in json.load(f))
@@ -0,0 +1,58 @@
+"""
+Индексы /items: диапазоны бинарным поиском, сортировка готовым порядком и страницы выдачи.
+
+    python -m pytest tests
+"""
+from items_index import ItemsIndex
+
+ITEMS = [
+    {"rank": 1, "title": "A", "price": "$25.00", "rating": "4.5 out of 5 stars", "reviews_count": "1,200 ratings"},
+    {"rank": 2, "title": "B", "price": "$9.99", "rating": "4.8 out of 5 stars", "reviews_count": "80 ratings"},
+    {"rank": 3, "title": "C", "price": "N/A", "rating": "3.9 out of 5 stars", "reviews_count": "15,300 ratings"},
+    {"rank": 4, "title": "D", "price": "$1,024.99", "rating": "N/A", "reviews_count": "N/A"},
+    {"rank": 5, "title": "E", "price": "$25.00", "rating": "4.5 out of 5 stars", "reviews_count": "310 ratings"},
+]
+
+
+def titles(items):
+    return [it["title"] for it in items]
+
+
+def test_range_is_inclusive_and_sorted_by_field():
+    index = ItemsIndex(ITEMS)
+    assert [index.items[pos]["title"] for pos in index.range("price_value", 9.99, 25)] == ["B", "A", "E"]
+    assert [index.items[pos]["title"] for pos in index.range("price_value", lo=100)] == ["D"]
+    assert index.range("price_value", 30, 20) == []
+
+
+def test_order_puts_missing_values_last():
+    index = ItemsIndex(ITEMS)
+    assert titles(index.items[pos] for pos in index.order("price_value")) == ["B", "A", "E", "D", "C"]
+    assert titles(index.items[pos] for pos in index.order("price_value", descending=True)) == ["D", "E", "A", "B", "C"]
+
+
+def test_query_without_filters_slices_order():
+    index = ItemsIndex(ITEMS)
+    assert index.query({}, offset=1, limit=2) == (5, [index.items[1], index.items[2]])
+    total, page = index.query({"price_value": (None, None)}, sort_by="rating", descending=True, offset=3)
+    assert total == 5 and titles(page) == ["C", "D"]
+    total, page = index.query({}, descending=True, limit=2)
+    assert titles(page) == ["E", "D"]
+
+
+def test_query_filter_on_sort_field():
+    index = ItemsIndex(ITEMS)
+    total, page = index.query({"price_value": (5, 30)}, sort_by="price", descending=True, limit=2)
+    assert total == 3 and titles(page) == ["E", "A"]
+
+
+def test_query_intersects_filters_and_sorts_by_other_field():
+    index = ItemsIndex(ITEMS)
+    ranges = {"rating_value": (4.5, None), "price_value": (None, 30), "reviews_count_value": (100, None)}
+    total, page = index.query(ranges, sort_by="reviews_count", descending=True)
+    assert total == 2 and titles(page) == ["A", "E"]
+    total, page = index.query(ranges, offset=1)
+    assert total == 2 and titles(page) == ["E"]
+    # Фильтр по одному полю, сортировка по полю, у части товаров пустому
+    total, page = index.query({"reviews_count_value": (50, None)}, sort_by="price")
+    assert total == 4 and titles(page) == ["B", "A", "E", "C"]
@@ -0,0 +1,101 @@
+"""
+Очередь задач на SQLite с симулированным временем: аренда, повторы и дедупликация.
+
+    python -m pytest tests
+"""
+import pytest
+
+from job_queue import JobQueue, DONE, FAILED, LEASED, PENDING
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = JobQueue(str(tmp_path / "queue.db"), lease_s=60, max_attempts=2, retry_s=10, clock=clock)
+    yield queue
+    queue.close()
+
+
+def test_same_key_is_enqueued_once_per_run(queue):
+    run_id = queue.create_run("crawl:2024-01-01")
+    assert queue.create_run("crawl:2024-01-01") is None
+    assert queue.enqueue(run_id, "category", "us:/zgbs/a", {"n": 1})
+    assert not queue.enqueue(run_id, "category", "us:/zgbs/a", {"n": 2})
+    other_run = queue.create_run("crawl:2024-01-02")
+    assert queue.enqueue(other_run, "category", "us:/zgbs/a", {"n": 3})
+    assert queue.progress(run_id)["total"] == 1
+    task = queue.lease("w1")
+    assert task.payload == {"n": 1}
+
+
+def test_expired_lease_goes_to_another_worker(queue, clock):
+    run_id = queue.create_run("run")
+    queue.enqueue(run_id, "product", "us:asin:B000000001", {})
+    first = queue.lease("w1")
+    assert queue.lease("w2") is None
+    # Продленная аренда не истекает в первоначальный срок
+    clock.now += 50
+    assert queue.extend(first)
+    clock.now += 50
+    assert queue.lease("w2") is None
+    clock.now += 11
+    second = queue.lease("w2")
+    assert second.id == first.id and second.attempts == 2
+    # Отметки прежнего арендатора больше не принимаются
+    assert not queue.extend(first)
+    assert not queue.complete(first)
+    assert queue.fail(first, "late") is None
+    assert queue.complete(second)
+    assert queue.progress(run_id)[DONE] == 1
+    assert queue.is_drained(run_id)
+
+
+def test_failed_task_is_retried_after_backoff_then_fails(queue, clock):
+    run_id = queue.create_run("run")
+    queue.enqueue(run_id, "product", "us:asin:B000000001", {})
+    task = queue.lease("w1")
+    assert queue.fail(task, "captcha") == PENDING
+    assert queue.lease("w1") is None
+    clock.now += 10
+    task = queue.lease("w1")
+    assert task.attempts == 2
+    assert queue.progress(run_id)[LEASED] == 1
+    assert queue.fail(task, "captcha") == FAILED
+    clock.now += 1000
+    assert queue.lease("w1") is None
+    assert queue.progress(run_id)[FAILED] == 1
+    assert queue.is_drained(run_id)
+
+
+def test_lease_expiry_after_last_attempt_fails_task(queue, clock):
+    run_id = queue.create_run("run")
+    queue.enqueue(run_id, "product", "us:asin:B000000001", {})
+    queue.lease("w1")
+    clock.now += 61
+    queue.lease("w2")
+    clock.now += 61
+    assert queue.lease("w3") is None
+    assert queue.progress(run_id)[FAILED] == 1
+
+
+def test_partition_worker_takes_own_and_shared_tasks(queue):
+    run_id = queue.create_run("run")
+    queue.enqueue(run_id, "bestsellers", "de:/gp/bestsellers", {}, priority=100, partition="de")
+    queue.enqueue(run_id, "bestsellers", "us:/gp/bestsellers", {}, priority=100, partition="us")
+    queue.enqueue(run_id, "cleanup", "shared", {})
+    assert queue.lease("w-us", partition="us").key == "us:/gp/bestsellers"
+    assert queue.lease("w-us", partition="us").key == "shared"
+    assert queue.lease("w-us", partition="us") is None
+    assert queue.lease("w-de", partition="de").key == "de:/gp/bestsellers"
@@ -0,0 +1,64 @@
+"""
+Площадки: разбор цен, оценок и позиций в формате de/jp и подписи строки BSR.
+
+    python -m pytest tests
+"""
+import os
+
+import pytest
+
+from extractors import extract_product
+from fixture_server import FIXTURES_DIR
+from marketplaces import get_marketplace, marketplace_for_url
+from normalize import normalize_item, parse_bsr, parse_count, parse_price, parse_rating
+
+DE = get_marketplace("de")
+JP = get_marketplace("jp")
+
+with open(os.path.join(FIXTURES_DIR, "product.html"), "r", encoding="utf-8") as f:
+    PRODUCT_HTML = f.read()
+
+
+def test_parse_de_numbers():
+    assert parse_price("1.024,99 €", DE) == 1024.99
+    assert parse_price("24,99 €", DE) == 24.99
+    assert parse_rating("4,5 von 5 Sternen", DE) == 4.5
+    assert parse_count("1.234 Sternebewertungen", DE) == 1234
+    assert parse_bsr("Nr. 1.234 in Bücher", DE) == 1234
+
+
+def test_parse_jp_numbers():
+    assert parse_price("￥1,280", JP) == 1280.0
+    # Оценка идет после "うち": "5つ星のうち4.5" - это 4.5, а не 5
+    assert parse_rating("5つ星のうち4.5", JP) == 4.5
+    assert parse_count("1,234個の評価", JP) == 1234
+    assert parse_bsr("1,234位本", JP) == 1234
+
+
+def test_normalize_item_sets_marketplace_currency():
+    de = normalize_item({"price": "24,99 €", "rating": "4,5 von 5 Sternen"}, DE)
+    assert de["price_value"] == 24.99 and de["rating_value"] == 4.5 and de["currency"] == "EUR"
+    assert normalize_item({"price": "￥1,280"}, JP)["currency"] == "JPY"
+
+
+def test_marketplace_lookup_and_keys():
+    with pytest.raises(ValueError):
+        get_marketplace("fr")
+    assert marketplace_for_url("https://www.amazon.de/dp/B000000001").code == "de"
+    assert DE.product_key("B000000001") == "de:B000000001"
+    assert get_marketplace("us").product_key("B000000001") == "B000000001"
+    assert DE.filename("crawl_state.json") == "crawl_state.de.json"
+
+
+def test_extract_product_uses_marketplace_bsr_labels():
+    page = (PRODUCT_HTML.replace("Best Sellers Rank", "Amazon Bestseller-Rang")
+            .replace("#1 in Home &amp; Kitchen", "Nr. 1 in Küche")
+            .replace("$24.99", "24,99 €").replace("$41.99", "41,99 €"))
+    item = extract_product(page, "https://www.amazon.de/dp/B000000001", 1, DE)
+    assert item["best_sellers_rank"] == "Nr. 1 in Küche"
+    assert item["discount_percent"] == "40%"
+
+    page = PRODUCT_HTML.replace("Best Sellers Rank:", "Amazon 売れ筋ランキング:").replace(
+        "#1 in Home &amp; Kitchen", "- 1位ホーム&amp;キッチン")
+    item = extract_product(page, "https://www.amazon.co.jp/dp/B000000001", 1, JP)
+    assert item["best_sellers_rank"] == "1位ホーム&キッチン"
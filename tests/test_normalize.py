@@ -0,0 +1,41 @@
+"""
+Разбор чисел из строк Amazon и канонические ключи ссылок.
+
+    python -m pytest tests
+"""
+from normalize import (canonical_url, extract_asin, normalize_item, parse_bsr, parse_count, parse_price,
+                       parse_rating, url_key)
+
+
+def test_parse_numbers():
+    assert parse_price("$1,024.99") == 1024.99
+    assert parse_price("N/A") is None
+    assert parse_price(None) is None
+    assert parse_price(12) == 12.0
+    assert parse_rating("4.4 out of 5 stars") == 4.4
+    assert parse_count("406,573 ratings") == 406573
+    assert parse_bsr("#1 in Home & Kitchen") == 1
+    assert parse_bsr("#12,345 in Books") == 12345
+
+
+def test_normalize_item_adds_values_without_changing_source():
+    item = {"price": "$19.99", "list_price": "$24.99", "rating": "4.6 out of 5 stars",
+            "reviews_count": "1,234 ratings", "best_sellers_rank": "#3 in Electronics"}
+    normalized = normalize_item(item)
+    assert normalized["price_value"] == 19.99
+    assert normalized["list_price_value"] == 24.99
+    assert normalized["rating_value"] == 4.6
+    assert normalized["reviews_count_value"] == 1234
+    assert normalized["bsr_value"] == 3
+    assert "currency" not in normalized
+    assert "price_value" not in item
+
+
+def test_url_keys_ignore_tracking():
+    url = "https://www.amazon.com/Some-Product/dp/B01M16WBW1/ref=zg_bs_1?pd_rd_i=B01M16WBW1&psc=1"
+    assert extract_asin(url) == "B01M16WBW1"
+    assert canonical_url(url) == "https://www.amazon.com/dp/B01M16WBW1"
+    assert url_key(url) == "asin:B01M16WBW1"
+    category = "https://www.amazon.com/Best-Sellers-Electronics/zgbs/electronics/ref=zg_bs_nav_0?pg=2&qid=1"
+    assert canonical_url(category) == "https://www.amazon.com/Best-Sellers-Electronics/zgbs/electronics?pg=2"
+    assert url_key("https://www.amazon.com/gp/bestsellers/electronics/ref=x") == "zgbs:electronics"
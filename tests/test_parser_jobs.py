@@ -0,0 +1,111 @@
+"""
+Фоновые задачи парсера: отмена, занятость и ответ 409 API, пока парсер или обход через очередь идут.
+
+    python -m pytest tests
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from job_queue import JobQueue
+from parser_jobs import ParserJobManager, ParserBusyError, CANCELLED, SUCCEEDED
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BlockingRun:
+    """Функция запуска, которая работает, пока ее не отпустят или не отменят."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, progress=None, cancel_event=None, **params):
+        self.calls.append(params)
+        progress({"event": "categories_found", "total": 2})
+        self.started.set()
+        while not self.release.is_set() and not cancel_event.is_set():
+            cancel_event.wait(0.01)
+        progress({"event": "category_done", "category": "Books", "items": 3})
+        # Как и run_parser: при отмене данные не записываются
+        return not cancel_event.is_set()
+
+
+def wait_finished(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    # Событие finished приходит последним, когда парсер уже освобожден
+    while not job.events or job.events[-1]["event"] != "finished":
+        assert time.monotonic() < deadline, f"job {job.id} did not finish"
+        time.sleep(0.01)
+
+
+def test_cancel_stops_job_and_frees_parser():
+    run = BlockingRun()
+    manager = ParserJobManager(run)
+    job = manager.submit(trigger="api", marketplace="de")
+    assert run.started.wait(5)
+    with pytest.raises(ParserBusyError) as busy:
+        manager.submit()
+    assert busy.value.running_job is job
+
+    assert manager.cancel(job.id) is job
+    wait_finished(job)
+    assert job.status == CANCELLED
+    assert manager.current is None
+    events = [e["event"] for e in job.events]
+    assert events[0] == "started" and "cancel_requested" in events and events[-1] == "finished"
+    assert job.to_dict()["categories_total"] == 2
+    assert run.calls == [{"marketplace": "de"}]
+
+    # Завершенную задачу отменить уже нельзя, а парсер свободен для следующей
+    manager.cancel(job.id)
+    assert job.status == CANCELLED
+    second = manager.submit()
+    run.release.set()
+    wait_finished(second)
+    assert second.status == SUCCEEDED
+    manager.shutdown()
+
+
+def test_trigger_returns_409_while_parser_or_queue_run_is_active(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    # Папка static подключается относительно текущей директории
+    monkeypatch.chdir(ROOT)
+    import api_server
+
+    run = BlockingRun()
+    manager = ParserJobManager(run)
+    queue = JobQueue(str(tmp_path / "queue.db"))
+    monkeypatch.setattr(api_server, "parser_jobs", manager)
+    monkeypatch.setattr(api_server, "crawl_queue", queue)
+    # Без lifespan: планировщик, воркеры очереди и браузеры в тесте не нужны
+    client = TestClient(api_server.app)
+
+    response = client.post("/api/trigger-parser", params={"marketplace": "uk"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert run.started.wait(5)
+    response = client.post("/api/trigger-parser")
+    assert response.status_code == 409 and response.json()["detail"]["job_id"] == job_id
+
+    response = client.post(f"/api/parser-status/{job_id}/cancel")
+    assert response.status_code == 200
+    wait_finished(manager.get(job_id))
+    assert client.get(f"/api/parser-status/{job_id}").json()["status"] == CANCELLED
+    assert client.post("/api/parser-status/unknown/cancel").status_code == 404
+
+    # Обход по расписанию через очередь тоже не дает запустить парсер вручную
+    run_id = queue.create_run("crawl:2024-01-01")
+    response = client.post("/api/trigger-parser")
+    assert response.status_code == 409 and response.json()["detail"]["crawl_run_id"] == run_id
+    queue.finish_run(run_id)
+    run.release.set()
+    response = client.post("/api/trigger-parser")
+    assert response.status_code == 202
+    wait_finished(manager.get(response.json()["job_id"]))
+    manager.shutdown()
+    queue.close()
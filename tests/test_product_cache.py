@@ -0,0 +1,126 @@
+"""
+Кэш товаров: TTL каждого поля, вытеснение LRU со сбросом на диск, обновление цен с карточек
+и то, что страница с капчей в кэш не попадает.
+
+    python -m pytest tests
+"""
+import os
+
+import pytest
+
+from fetchers import FetchResult
+from fixture_server import FIXTURES_DIR
+from parser_selenium import parse_product_page
+from product_cache import ProductCache, FIELD_TTLS, HOUR, DAY
+
+FIELDS = {field: f"value of {field}" for field in FIELD_TTLS}
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / "product_cache.db")
+
+
+def test_entry_is_fresh_until_its_shortest_ttl(cache_file, clock):
+    cache = ProductCache(cache_file, clock=clock)
+    cache.put("B000000001", {**FIELDS, "unknown_field": 1})
+    assert cache.get("B000000001") == FIELDS
+    clock.now += 6 * HOUR + 1
+    # Цена устарела - товар загружается заново
+    assert cache.get("B000000001") is None
+    cache.put("B000000001", {"price": "$2.00", "list_price": "$3.00", "discount_percent": "33%"})
+    assert cache.get("B000000001")["price"] == "$2.00"
+    clock.now += DAY
+    assert cache.get("B000000001") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["stale"] == 2
+    cache.close()
+
+
+def test_partial_entry_is_not_a_hit(cache_file, clock):
+    cache = ProductCache(cache_file, clock=clock)
+    cache.put("B000000001", {"price": "$1.00"})
+    assert cache.get("B000000001") is None
+    assert cache.get("B000000002") is None
+    assert cache.get(None) is None
+    assert cache.stats()["misses"] == 1
+    cache.close()
+
+
+def test_evicted_entries_spill_to_disk_and_come_back(cache_file, clock):
+    cache = ProductCache(cache_file, max_entries=2, clock=clock)
+    for asin in ("B000000001", "B000000002", "B000000003"):
+        cache.put(asin, FIELDS)
+    stats = cache.stats()
+    assert stats["entries_in_memory"] == 2 and stats["evictions"] == 1
+    # Вытесненная запись читается с диска и снова становится самой свежей
+    assert cache.get("B000000001") == FIELDS
+    assert cache.stats()["disk_reads"] == 1
+    assert cache.get("B000000003") == FIELDS
+    cache.put("B000000004", FIELDS)
+    assert cache.stats()["disk_reads"] == 1
+    cache.close()
+
+    reopened = ProductCache(cache_file, clock=clock)
+    for asin in ("B000000001", "B000000002", "B000000003", "B000000004"):
+        assert reopened.get(asin) == FIELDS
+    reopened.close()
+
+
+def test_update_prices_from_category_cards(cache_file, clock):
+    cache = ProductCache(cache_file, clock=clock)
+    cache.put("B000000001", {**FIELDS, "price": "$10.00"})
+    cache.put("B000000002", {**FIELDS, "price": "$20.00"})
+    clock.now += 6 * HOUR + 1
+    cards = [{"asin": "B000000001", "price": "$10.00", "rating": "4.7 out of 5 stars"},
+             {"asin": "B000000002", "price": "$18.00"},
+             {"asin": "B000000009", "price": "$1.00"}]
+    cache.update_prices(cards, lambda card: card["asin"])
+    # Цена та же - старая цена и скидка тоже проверены
+    assert cache.get("B000000001")["rating"] == "4.7 out of 5 stars"
+    # Цена изменилась - старую цену и скидку нужно загрузить со страницы
+    assert cache.get("B000000002") is None
+    assert cache.get("B000000009") is None
+    cache.close()
+
+
+class PageFetcher:
+    """Загрузчик, который отдает заранее заданную страницу."""
+
+    def __init__(self, html):
+        self.html = html
+        self.stats = {"reused": 0}
+
+    def fetch(self, url, kind, force=False, key=None, use_browser=False):
+        return FetchResult(url, 200, self.html)
+
+
+def test_parsed_product_is_cached_but_captcha_is_not(cache_file, clock):
+    cache = ProductCache(cache_file, clock=clock)
+    url = "https://www.amazon.com/dp/B000000001"
+    item = parse_product_page(PageFetcher(fixture("captcha.html")), url, 1, cache=cache)
+    assert item["title"] == "N/A"
+    assert cache.stats()["entries_in_memory"] == 0
+
+    item = parse_product_page(PageFetcher(fixture("product.html")), url, 1, cache=cache)
+    assert item["title"] != "N/A"
+    # Повторный разбор берет товар из кэша, не загружая страницу
+    assert parse_product_page(PageFetcher(""), url, 2, cache=cache)["title"] == item["title"]
+    cache.close()
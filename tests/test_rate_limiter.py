@@ -0,0 +1,122 @@
+"""
+Адаптивный ограничитель скорости на симулированном времени и FallbackFetcher
+против локального fixture_server - без реальных пауз и обращений к Amazon.
+
+    python -m pytest tests
+"""
+from urllib.parse import urlsplit
+
+import pytest
+
+from fetch_records import FetchRecords
+from fetchers import HttpFetcher, FallbackFetcher, CATEGORY_PAGE
+from fixture_server import FixtureServer
+from rate_limiter import HostLimiter, RateLimiter
+
+
+class FakeClock:
+    """Часы, которые двигаются только вручную или через sleep."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_bucket_refills_at_current_rate_up_to_burst():
+    clock = FakeClock()
+    host = HostLimiter(rate=2.0, burst=2.0, clock=clock)
+    assert host.reserve() == 0.0
+    assert host.reserve() == 0.0
+    # Запас исчерпан: следующий запрос - через 1 / rate
+    assert host.reserve() == pytest.approx(0.5)
+    clock.now += 10
+    # За 10 секунд накопилось бы 20 запросов, но запас ограничен burst
+    assert host.reserve() == 0.0
+    assert host.reserve() == 0.0
+    assert host.reserve() == pytest.approx(0.5)
+
+
+def test_throttle_cuts_rate_and_drops_burst():
+    clock = FakeClock()
+    host = HostLimiter(rate=1.0, min_rate=0.1, decrease=0.5, burst=3.0, clock=clock)
+    host.throttle()
+    assert host.rate == pytest.approx(0.5)
+    # Накопленный запас сброшен: следующий запрос ждет полный интервал новой скорости
+    assert host.reserve() == pytest.approx(2.0)
+    for _ in range(10):
+        host.throttle()
+    assert host.rate == pytest.approx(0.1)
+
+
+def test_retry_after_holds_requests():
+    clock = FakeClock()
+    host = HostLimiter(rate=1.0, burst=1.0, clock=clock)
+    host.throttle(retry_after=30)
+    assert host.reserve() == pytest.approx(30)
+    clock.now += 30
+    # После паузы запросы идут со сниженной скоростью
+    assert host.reserve() == 0.0
+    assert host.reserve() == pytest.approx(2.0)
+
+
+def test_rate_recovers_additively_up_to_max():
+    clock = FakeClock()
+    host = HostLimiter(rate=1.0, min_rate=0.1, max_rate=1.5, increase=0.1, decrease=0.5, clock=clock)
+    host.throttle()
+    for _ in range(5):
+        host.success()
+    assert host.rate == pytest.approx(1.0)
+    for _ in range(20):
+        host.success()
+    assert host.rate == pytest.approx(1.5)
+    assert host.snapshot()["successes"] == 25
+    assert host.snapshot()["throttles"] == 1
+
+
+def test_rate_limiter_keeps_separate_budget_per_host():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep, jitter=0, rate=1.0, burst=1.0)
+    assert limiter.acquire("https://www.amazon.com/a") == 0.0
+    assert limiter.acquire("https://www.amazon.com/b") == pytest.approx(1.0)
+    assert limiter.acquire("https://www.amazon.de/a") == 0.0
+    assert clock.slept == [pytest.approx(1.0)]
+    limiter.throttle("https://www.amazon.de/a")
+    stats = limiter.stats()
+    assert stats["www.amazon.com"]["rate"] == pytest.approx(1.0)
+    assert stats["www.amazon.de"]["rate"] == pytest.approx(0.5)
+
+
+def test_fallback_fetcher_against_fixture_server(tmp_path):
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep, jitter=0, rate=100.0, burst=100.0)
+    records = FetchRecords(str(tmp_path / "crawl_state.json"))
+    with FixtureServer() as server:
+        http = HttpFetcher(base_url=server.base_url, user_agent="test")
+        fetcher = FallbackFetcher(http, browser=None, records=records, limiter=limiter)
+        url = server.base_url + "/Best-Sellers-Electronics/zgbs/electronics"
+        try:
+            page = fetcher.fetch(url, CATEGORY_PAGE)
+            assert page.status == 200 and page.source == "http"
+            assert CATEGORY_PAGE.is_complete(page.text)
+            assert not page.unchanged
+            # Пока данные страницы не подтверждены, повторная загрузка не считается "без изменений"
+            assert not fetcher.fetch(url, CATEGORY_PAGE).unchanged
+            records.confirm([url])
+            assert fetcher.fetch(url, CATEGORY_PAGE).unchanged
+
+            # 503 без браузера для фолбэка - ошибка, а скорость к хосту снижается
+            with pytest.raises(RuntimeError):
+                fetcher.fetch(server.base_url + "/unavailable", CATEGORY_PAGE)
+        finally:
+            fetcher.close()
+            http.close()
+        host = limiter.stats()[urlsplit(server.base_url).netloc]
+    assert host["successes"] == 3
+    assert host["throttles"] == 1
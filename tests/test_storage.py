@@ -0,0 +1,84 @@
+"""
+Хранилище SQLite: постепенно записанные запуски, перенос несобранных данных и история позиций.
+
+    python -m pytest tests
+"""
+import sqlite3
+
+import pytest
+
+import storage
+
+
+def product(asin, rank, title="Item"):
+    return {"rank": f"#{rank}", "title": title, "url": f"https://www.amazon.com/dp/{asin}"}
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "amazon.db")
+
+
+def test_finish_run_carries_missing_category_with_original_time(db):
+    first = storage.save_bestsellers({"Books": [product("B000000001", 1)], "Toys": [product("B000000002", 1)]},
+                                     scraped_at=100.0, db_path=db)
+    second = storage.start_run(storage.BESTSELLERS, scraped_at=200.0, db_path=db)
+    storage.save_run_category(second, "Books", [product("B000000001", 3)], db_path=db)
+    # Пока запуск идет, история его не видит
+    assert [p["rank"] for p in storage.rank_history("B000000001", db)] == [1]
+    storage.finish_run(second, db_path=db)
+
+    data = storage.load_latest_bestsellers(db)
+    assert set(data) == {"Books", "Toys"}
+    rows = storage.connect(db).execute(
+        "SELECT run_id, scraped_at, carried FROM bestsellers WHERE category = 'Toys' ORDER BY run_id").fetchall()
+    assert [tuple(r) for r in rows] == [(first, 100.0, 0), (second, 100.0, 1)]
+
+    # Перенесенная строка - не новая точка истории
+    assert [p["rank"] for p in storage.rank_history("B000000002", db)] == [1]
+    assert [p["rank"] for p in storage.rank_history("B000000001", db)] == [1, 3]
+
+
+def test_finish_run_fills_missing_item_positions(db):
+    storage.save_items([{**product("B000000001", 1), "price": "$1.00"}, {**product("B000000002", 2), "price": "$2.00"}],
+                       scraped_at=100.0, db_path=db)
+    run_id = storage.start_run(storage.ITEMS, scraped_at=200.0, db_path=db)
+    storage.save_run_item(run_id, 0, {**product("B000000001", 1), "price": "$1.50"}, db_path=db)
+    assert storage.load_previous_item(run_id, "https://www.amazon.com/dp/B000000002/ref=x", db)["price"] == "$2.00"
+    storage.finish_run(run_id, db_path=db)
+    items = storage.load_latest_items(db)
+    assert [it["price"] for it in items] == ["$1.50", "$2.00"]
+    carried = storage.connect(db).execute(
+        "SELECT position, carried FROM items WHERE run_id = ? ORDER BY position", (run_id,)).fetchall()
+    assert [tuple(r) for r in carried] == [(0, 0), (1, 1)]
+
+
+def test_run_parser_style_save_marks_carried_categories(db):
+    storage.save_bestsellers({"Toys": [product("B000000002", 4)]}, scraped_at=100.0, db_path=db)
+    storage.save_bestsellers({"Toys": [product("B000000002", 4)]}, scraped_at=200.0, db_path=db, carried=["Toys"])
+    assert [p["scraped_at"] for p in storage.rank_history("B000000002", db)] == [storage._format_time(100.0)]
+
+
+def test_previous_category_comes_from_last_finished_run_of_same_marketplace(db):
+    storage.save_bestsellers({"Books": [product("B000000001", 1)]}, db_path=db)
+    storage.save_bestsellers({"Books": [product("B000000009", 1)]}, db_path=db, marketplace="de")
+    run_id = storage.start_run(storage.BESTSELLERS, db_path=db)
+    assert storage.load_previous_category(run_id, "Books", db) == [product("B000000001", 1)]
+    assert storage.load_previous_category(run_id, "Toys", db) == []
+
+
+def test_old_database_is_migrated(tmp_path):
+    db = str(tmp_path / "old.db")
+    conn = sqlite3.connect(db)
+    conn.executescript(
+        "CREATE TABLE runs (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, scraped_at REAL NOT NULL);"
+        "CREATE TABLE bestsellers (run_id INTEGER NOT NULL, category TEXT NOT NULL, position INTEGER NOT NULL, "
+        "rank INTEGER, asin TEXT, scraped_at REAL NOT NULL, data TEXT NOT NULL, "
+        "PRIMARY KEY (run_id, category, position));"
+        "INSERT INTO runs (kind, scraped_at) VALUES ('bestsellers', 100.0);"
+        "INSERT INTO bestsellers VALUES (1, 'Toys', 0, 5, 'B000000002', 100.0, '{}');")
+    conn.commit()
+    conn.close()
+    run = storage.latest_run(storage.BESTSELLERS, db, finished=True)
+    assert run["id"] == 1
+    assert [p["rank"] for p in storage.rank_history("B000000002", db)] == [5]